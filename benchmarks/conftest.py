@@ -0,0 +1,104 @@
+import json
+import sys
+import pytest
+from pypsi.core import Command
+from pypsi.commands.echo import EchoCommand
+from pypsi.commands.xargs import XArgsCommand
+from pypsi.pipes import read_objects
+from pypsi.shell import Shell
+
+
+class CatCommand(Command):
+    '''
+    Copy stdin to stdout, used to build pipes.
+    '''
+
+    def __init__(self, name='cat', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write(line)
+        return 0
+
+
+class ProduceCommand(Command):
+    '''
+    Write a number of records to stdout, as objects or as JSON lines.
+    '''
+
+    def __init__(self, name, pipe, **kwargs):
+        super().__init__(name=name, pipe=pipe, **kwargs)
+
+    def run(self, shell, args):
+        for i in range(int(args[0])):
+            record = {'id': i, 'name': "record{}".format(i)}
+            if self.pipe == 'obj':
+                yield record
+            else:
+                print(json.dumps(record))
+        return 0
+
+
+class ConsumeCommand(Command):
+    '''
+    Read the records written by :class:`ProduceCommand`.
+    '''
+
+    def __init__(self, name, pipe, **kwargs):
+        super().__init__(name=name, pipe=pipe, **kwargs)
+        self.count = 0
+
+    def run(self, shell, args):
+        self.count = 0
+        for record in read_objects():
+            if self.pipe != 'obj':
+                record = json.loads(record)
+            self.count += record['id'] >= 0
+        return 0
+
+
+class BurnCommand(Command):
+    '''
+    A CPU-bound pipe stage: burn CPU for every line read from stdin, or for
+    each of a number of generated lines, and then write the line to stdout.
+    '''
+
+    Work = 20000
+
+    def __init__(self, name, isolation, **kwargs):
+        super().__init__(name=name, isolation=isolation, **kwargs)
+
+    def run(self, shell, args):
+        if args:
+            lines = ("{}\n".format(i) for i in range(int(args[0])))
+        else:
+            lines = iter(sys.stdin.readline, '')
+
+        for line in lines:
+            total = 0
+            for i in range(self.Work):
+                total += i * i
+            sys.stdout.write(line)
+        return 0
+
+
+class BenchShell(Shell):
+    echo = EchoCommand()
+    cat = CatCommand()
+    produce = ProduceCommand('produce', 'obj')
+    consume = ConsumeCommand('consume', 'obj')
+    produce_text = ProduceCommand('produce_text', 'str')
+    consume_text = ConsumeCommand('consume_text', 'str')
+    burn = BurnCommand('burn', 'thread')
+    burn_process = BurnCommand('burn_process', 'process')
+    xargs = XArgsCommand()
+
+
+@pytest.fixture
+def shell():
+    shell = BenchShell()
+    yield shell
+    if shell.process_pool:
+        shell.process_pool.shutdown()
+    shell.restore()
@@ -0,0 +1,25 @@
+import os
+import pytest
+from pypsi.completers import path_completer
+
+
+FILES = 10000
+DIRS = 500
+
+
+@pytest.fixture(scope='module')
+def large_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('large_dir')
+    for i in range(FILES):
+        (path / "file{}.txt".format(i)).touch()
+    for i in range(DIRS):
+        (path / "dir{}".format(i)).mkdir()
+    return str(path) + os.path.sep
+
+
+class TestPathCompleter(object):
+
+    @pytest.mark.parametrize('prefix', ('', 'file1', 'dir4', 'missing'))
+    def test_path_completer(self, benchmark, large_dir, prefix):
+        benchmark.group = 'path_completer'
+        benchmark(path_completer, large_dir + prefix, prefix)
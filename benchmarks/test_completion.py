@@ -0,0 +1,57 @@
+import pytest
+from pypsi.cmdline import CompletionState
+from pypsi.features import BashFeatures, TabCompletionFeatures
+from pypsi.shell import Shell
+
+
+LINE_LENGTH = 10000
+KEYSTROKES = 50
+
+
+def make_line():
+    words = []
+    length = 0
+    i = 0
+    while length < LINE_LENGTH:
+        word = "arg{}".format(i) if i % 7 else "\"quoted arg\\ {}\"".format(i)
+        words.append(word)
+        length += len(word) + 1
+        i += 1
+    return "echo " + ' '.join(words)
+
+
+def type_line(shell, line, keystrokes):
+    '''
+    Simulate pressing tab after typing each of the last characters of a line.
+    '''
+    for i in range(len(line) - keystrokes + 1, len(line) + 1):
+        shell.get_completions(line[:i], '')
+
+
+def _full(line):
+    state = CompletionState(TabCompletionFeatures(BashFeatures()))
+    state.update(line)
+    return state.current()
+
+
+class TestCompletionLatency(object):
+
+    def setup(self):
+        self.shell = Shell()
+
+    def teardown(self):
+        self.shell.restore()
+
+    @pytest.mark.parametrize('mode', ('full', 'incremental'))
+    def test_latency_10k(self, benchmark, mode):
+        benchmark.group = 'completion'
+        line = make_line()
+        if mode == 'full':
+            # Discard the cached state before every completion, which is how
+            # completion worked before the state was kept between calls.
+            self.shell.get_completion_state = _full
+        else:
+            self.shell.get_completions(line[:-KEYSTROKES], '')
+
+        benchmark.pedantic(type_line, args=(self.shell, line, KEYSTROKES),
+                           rounds=5)
@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+import pytest
+
+
+class TestExecute(object):
+
+    def test_echo(self, benchmark, shell):
+        benchmark.group = 'execute'
+        benchmark(shell.execute, "echo hello world")
+
+    @pytest.mark.parametrize('pool', (False, True), ids=('threads', 'pool'))
+    @pytest.mark.parametrize('stages', (2, 5, 10))
+    def test_pipe(self, benchmark, shell, stages, pool):
+        benchmark.group = "pipe {} stages".format(stages)
+        if not pool:
+            shell.pipe_pool = None
+        statement = "echo hello world" + " | cat" * (stages - 1)
+        statement += " > " + os.devnull
+        # Pipes require the thread local streams, pytest replaces sys.stdout
+        # between the fixture setup and the test.
+        shell.bootstrap()
+        rc = benchmark(shell.execute, statement)
+        assert rc == 0
+
+    @pytest.mark.parametrize('mode', ('text', 'obj'))
+    def test_records(self, benchmark, shell, mode):
+        benchmark.group = 'pipe records'
+        if mode == 'obj':
+            statement = "produce 10000 | consume"
+        else:
+            statement = "produce_text 10000 | consume_text"
+        shell.bootstrap()
+        rc = benchmark(shell.execute, statement)
+        assert rc == 0
+        assert shell.commands[statement.split()[-1]].count == 10000
+
+    @pytest.mark.parametrize('isolation', ('thread', 'process'))
+    def test_cpu_pipe(self, benchmark, shell, isolation):
+        # Four CPU-bound stages only scale with the number of cores when
+        # they run in worker processes.
+        benchmark.group = 'pipe cpu 4 stages'
+        cmd = 'burn' if isolation == 'thread' else 'burn_process'
+        statement = "{0} 100 | {0} | {0} | {0} > {1}".format(cmd, os.devnull)
+        shell.bootstrap()
+        rc = benchmark.pedantic(shell.execute, (statement,), rounds=5,
+                                warmup_rounds=1)
+        assert rc == 0
+
+    @pytest.mark.parametrize('options', ('', '-n 100', '-P 4', '-P 4 -k'))
+    def test_xargs(self, benchmark, shell, tmp_path, options):
+        benchmark.group = 'xargs 10000 lines'
+        path = tmp_path / 'input.txt'
+        path.write_text(''.join("line{}\n".format(i) for i in range(10000)))
+        statement = "xargs {} echo {{}} < {} > {}".format(
+            options, path, os.devnull
+        )
+        shell.bootstrap()
+        rc = benchmark.pedantic(shell.execute, (statement,), rounds=3)
+        assert rc == 0
+
+    @pytest.mark.parametrize('mode', ('cmdloop', 'batch'))
+    def test_script(self, benchmark, shell, mode):
+        benchmark.group = 'script 100000 lines'
+        script = ''.join("echo line {}\n".format(i) for i in range(100000))
+        shell.bootstrap()
+
+        def run():
+            with open(os.devnull, 'w') as devnull:
+                sys.stdout._proxy(devnull)
+                try:
+                    if mode == 'batch':
+                        return shell.run_batch(io.StringIO(script))
+                    sys.stdin._proxy(io.StringIO(script))
+                    try:
+                        return shell.cmdloop()
+                    finally:
+                        sys.stdin._unproxy()
+                finally:
+                    sys.stdout._unproxy()
+
+        rc = benchmark.pedantic(run, rounds=1)
+        assert rc == 0
@@ -0,0 +1,43 @@
+import os
+import pytest
+from pypsi.core import pypsi_print
+from pypsi.format import Table, Column
+from pypsi.os import make_ansi_stream
+
+
+ROWS = {10: 200, 1000: 20, 100000: 3}
+TEXT = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim "
+    "veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip."
+)
+
+
+@pytest.fixture
+def devnull():
+    with open(os.devnull, 'w') as fp:
+        yield make_ansi_stream(fp, width=80)
+
+
+class TestPypsiPrint(object):
+
+    @pytest.mark.parametrize('wrap', (False, True), ids=('nowrap', 'wrap'))
+    def test_print(self, benchmark, devnull, wrap):
+        benchmark.group = 'pypsi_print'
+        benchmark(pypsi_print, TEXT, TEXT, file=devnull, wrap=wrap)
+
+
+class TestTable(object):
+
+    @pytest.mark.parametrize('rows', sorted(ROWS))
+    def test_write(self, benchmark, devnull, rows):
+        benchmark.group = 'Table.write'
+        table = Table([
+            Column('Name'), Column('Value'), Column('Description', Column.Grow)
+        ], width=80)
+        for i in range(rows):
+            # Every tenth description is wrapped onto several lines
+            table.append("name{}".format(i), i, TEXT if i % 10 == 0 else
+                         TEXT[:i % 40])
+
+        benchmark.pedantic(table.write, args=(devnull,), rounds=ROWS[rows])
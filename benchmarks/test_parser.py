@@ -0,0 +1,56 @@
+import pytest
+from pypsi.cmdline import StatementParser
+from pypsi.features import BashFeatures
+
+
+ROUNDS = 200
+LINES = {
+    'short': "echo hello world",
+    'long': "cmd " + ' '.join(
+        "--option{0}=value{0}".format(i) for i in range(200)
+    ) + " | grep value > out.txt",
+    'quoted': "echo " + ' '.join(
+        "\"quoted {0} 'arg'\" 'single {0}'".format(i) for i in range(100)
+    ),
+    'escaped': "echo " + ' '.join(
+        "a\\ b\\\"c\\'{0}\\\\".format(i) for i in range(100)
+    ),
+}
+
+
+@pytest.fixture(params=sorted(LINES))
+def line(request):
+    return LINES[request.param]
+
+
+def tokens_of(line):
+    '''
+    Create a setup function for benchmark.pedantic() that tokenizes the
+    line for every round, since condense() and build() modify the tokens.
+    '''
+    def setup():
+        parser = StatementParser(BashFeatures())
+        return (parser, parser.tokenize(line)), {}
+    return setup
+
+
+class TestParser(object):
+
+    def test_tokenize(self, benchmark, line):
+        benchmark.group = 'tokenize'
+        # tokenize() appends to the parser's tokens, so every round needs a
+        # new parser.
+        benchmark.pedantic(lambda parser: parser.tokenize(line),
+                           setup=lambda: ((StatementParser(BashFeatures()),),
+                                          {}),
+                           rounds=ROUNDS)
+
+    def test_condense(self, benchmark, line):
+        benchmark.group = 'condense'
+        benchmark.pedantic(lambda parser, tokens: parser.condense(tokens),
+                           setup=tokens_of(line), rounds=ROUNDS)
+
+    def test_build(self, benchmark, line):
+        benchmark.group = 'build'
+        benchmark.pedantic(lambda parser, tokens: parser.build(tokens),
+                           setup=tokens_of(line), rounds=ROUNDS)
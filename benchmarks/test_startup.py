@@ -0,0 +1,45 @@
+import pytest
+from pypsi.commands.echo import EchoCommand
+from pypsi.commands.jobs import WaitCommand
+from pypsi.commands.tail import TailCommand
+from pypsi.commands.xargs import XArgsCommand
+from pypsi.lazy import LazyCommand
+from pypsi.shell import Shell
+
+
+COMMANDS = 120
+CLASSES = (EchoCommand, TailCommand, XArgsCommand, WaitCommand)
+
+
+def make_commands(mode):
+    if mode == 'stubs':
+        return [
+            LazyCommand('pypsi.commands.tail:TailCommand', 'cmd{}'.format(i))
+            for i in range(COMMANDS)
+        ]
+
+    commands = [
+        CLASSES[i % len(CLASSES)](name='cmd{}'.format(i))
+        for i in range(COMMANDS)
+    ]
+    if mode == 'eager-usage':
+        # Commands used to format their usage in their constructor
+        for cmd in commands:
+            cmd.usage  # pylint: disable=pointless-statement
+    return commands
+
+
+class TestStartup(object):
+
+    @pytest.mark.parametrize('mode', ('eager-usage', 'lazy-usage', 'stubs'))
+    def test_shell(self, benchmark, mode):
+        benchmark.group = 'startup {} commands'.format(COMMANDS)
+
+        def start():
+            shell = Shell()
+            shell.register_many(make_commands(mode))
+            shell.restore()
+            return shell
+
+        shell = benchmark(start)
+        assert len(shell.commands) == COMMANDS
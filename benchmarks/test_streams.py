@@ -0,0 +1,93 @@
+import io
+import os
+import pytest
+from pypsi.cmdline import CommandInvocation
+from pypsi.core import Command, pypsi_print
+from pypsi.os import make_ansi_stream
+from pypsi.pipes import ThreadLocalStream, BufferedStream
+
+
+LINES = 10000
+
+
+class CountingFileIO(io.FileIO):
+    '''
+    A raw file that counts its write() calls, which are write syscalls.
+    '''
+
+    syscalls = 0
+
+    def write(self, b):
+        CountingFileIO.syscalls += 1
+        return super().write(b)
+
+
+class PrintCommand(Command):
+
+    def __init__(self, name='print', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        for i in range(LINES):
+            pypsi_print("line", i)
+        return 0
+
+
+class TestThreadLocalStream(object):
+
+    @pytest.mark.parametrize('wrapper', ('raw', 'ansi', 'local', 'proxy'))
+    def test_write(self, benchmark, wrapper):
+        # Look up the write method on every call, as print() does
+        benchmark.group = 'stream write {} lines'.format(LINES)
+        target = io.StringIO()
+        if wrapper == 'raw':
+            stream = target
+        elif wrapper == 'ansi':
+            stream = make_ansi_stream(target)
+        elif wrapper == 'local':
+            stream = ThreadLocalStream(target)
+        else:
+            stream = ThreadLocalStream(io.StringIO())
+            stream._proxy(target)
+
+        def run():
+            target.seek(0)
+            target.truncate()
+            for i in range(LINES):
+                print("line", file=stream)
+            stream.flush()
+
+        benchmark(run)
+        assert target.getvalue().count("\n") == LINES
+
+
+class TestBufferedStream(object):
+
+    @pytest.mark.parametrize('buffering', ('none', 'block'))
+    def test_print(self, benchmark, shell, buffering):
+        # Redirect a command's output to a file and count the write syscalls
+        benchmark.group = 'redirected print {} lines'.format(LINES)
+        benchmark.extra_info['buffering'] = buffering
+        shell.bootstrap()
+
+        def run():
+            stdout = io.TextIOWrapper(
+                io.BufferedWriter(CountingFileIO(os.devnull, 'w'))
+            )
+            invoke = CommandInvocation('print', stdout=stdout)
+            invoke.cmd = PrintCommand()
+            return invoke(shell)
+
+        default = BufferedStream.DefaultBuffering
+        BufferedStream.DefaultBuffering = buffering
+        try:
+            assert benchmark(run) == 0
+            CountingFileIO.syscalls = 0
+            run()
+        finally:
+            BufferedStream.DefaultBuffering = default
+
+        benchmark.extra_info['syscalls'] = CountingFileIO.syscalls
+        print("\n{} buffering: {} write syscalls".format(
+            buffering, CountingFileIO.syscalls
+        ))
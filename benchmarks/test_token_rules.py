@@ -0,0 +1,50 @@
+import pytest
+from pypsi.cmdline import StatementParser
+from pypsi.features import PypsiFeatures
+from pypsi.plugins.hexcode import HexCodePlugin
+from pypsi.plugins.variable import VariablePlugin
+from pypsi.shell import Shell
+
+
+ROUNDS = 200
+LINES = {
+    'plain': "echo " + ' '.join("arg{}".format(i) for i in range(40)),
+    'escapes': "echo " + ' '.join("a\\ b\\ {}".format(i) for i in range(40)),
+    'hexcode': "echo " + ' '.join("\\x41\\x42{}".format(i)
+                                  for i in range(40)),
+    'mixed': "echo " + ' '.join("arg\\x41$a\\ {}".format(i)
+                                for i in range(40)),
+}
+
+
+class RuleShell(Shell):
+    hexcode = HexCodePlugin()
+    var = VariablePlugin(env=False, locals={'a': 'A'})
+
+
+def process(shell, parser, tokens):
+    '''
+    Process tokens from the first plugin until the escape sequences are
+    removed.
+    '''
+    parser.clean_escapes(shell.on_tokenize(tokens, 'input'))
+
+
+class TestTokenRules(object):
+
+    def teardown(self):
+        self.shell.restore()
+
+    @pytest.mark.parametrize('fused', (False, True),
+                             ids=('sequential', 'fused'))
+    @pytest.mark.parametrize('name', sorted(LINES))
+    def test_on_tokenize(self, benchmark, name, fused):
+        benchmark.group = 'on_tokenize ' + name
+        self.shell = RuleShell(features=PypsiFeatures(),
+                               fuse_token_rules=fused)
+
+        def setup():
+            parser = StatementParser(self.shell.features)
+            return (self.shell, parser, parser.tokenize(LINES[name])), {}
+
+        benchmark.pedantic(process, setup=setup, rounds=ROUNDS)
@@ -36,6 +36,7 @@ from pypsi.commands.exit import ExitCommand
 from pypsi.plugins.variable import VariablePlugin
 from pypsi.plugins.history import HistoryPlugin
 from pypsi.plugins.alias import AliasPlugin
+from pypsi.plugins.metrics import MetricsPlugin
 from pypsi.commands.echo import EchoCommand
 from pypsi.commands.include import IncludeCommand
 from pypsi.commands.help import HelpCommand, Topic
@@ -43,6 +44,8 @@ from pypsi.commands.tip import TipCommand
 from pypsi.commands.tail import TailCommand
 from pypsi.commands.chdir import ChdirCommand
 from pypsi.commands.pwd import PwdCommand
+from pypsi.commands.jobs import JobsCommand, FgCommand, WaitCommand
+from pypsi.commands.profile import ProfileCommand
 from pypsi.plugins.comment import CommentPlugin
 
 from pypsi import wizard as wiz
@@ -176,7 +179,12 @@ class DemoShell(Shell):
     comment_plugin = CommentPlugin()
     chdir_cmd = ChdirCommand()
     pwd_cmd = PwdCommand()
+    jobs_cmd = JobsCommand()
+    fg_cmd = FgCommand()
+    wait_cmd = WaitCommand()
+    profile_cmd = ProfileCommand()
     alias_plugin = AliasPlugin()
+    metrics_plugin = MetricsPlugin()
 
     def __init__(self):
         # You must call the Shell.__init__() method.
@@ -0,0 +1,316 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+from pypsi.cmdline import (StatementSyntaxError, IORedirectionError,
+                           CommandNotFoundError)
+from pypsi.pipes import AsyncPipe
+from pypsi.shell import Shell
+
+
+class AsyncShell(Shell):
+    '''
+    A shell that executes statements on an :mod:`asyncio` event loop, so that
+    a single event loop can execute many statements concurrently, see
+    :meth:`execute_async`.
+
+    Commands can implement :meth:`~pypsi.core.Command.run` as a coroutine
+    function or as an asynchronous generator. Asynchronous commands run as
+    tasks on the event loop and adjacent asynchronous pipe stages are
+    connected by an :class:`~pypsi.pipes.AsyncPipe`. Synchronous commands keep
+    working: they run on the :attr:`~pypsi.shell.Shell.pipe_pool` worker
+    threads, so they never block the event loop.
+
+    The synchronous :meth:`~pypsi.shell.Shell.execute` method still works and
+    runs asynchronous commands to completion with :func:`asyncio.run`.
+    '''
+
+    async def execute_async(self, raw):
+        '''
+        Parse and execute a statement on the running event loop.
+
+        :param str raw: the raw command line to parse.
+        :returns int: the return code of the statement.
+        '''
+
+        try:
+            statement = self.parse(raw)
+        except StatementSyntaxError as e:
+            self.error(str(e))
+            return 1
+
+        if not statement:
+            # The line was empty, a comment, or just contained whitespace.
+            return None
+
+        return await self.execute_statement_async(statement)
+
+    async def execute_statement_async(self, statement):
+        '''
+        Execute a parsed statement on the running event loop. This is the
+        :mod:`asyncio` version of :meth:`~pypsi.shell.Shell.execute_statement`.
+
+        :param pypsi.cmdline.Statement statement: the statement to execute,
+            its command invocations must not have been setup yet
+        :returns int: the return code of the statement.
+        '''
+        if statement.has_background():
+            return await self.execute_background_async(statement)
+
+        rc = None
+
+        # Setup the invocations
+        for invoke in statement:
+            try:
+                invoke.setup(self)
+            except Exception as e:
+                for sub in statement:
+                    sub.close_streams()
+
+                if isinstance(e, (IORedirectionError, CommandNotFoundError)):
+                    self.error(str(e))
+                    return -1
+                raise
+
+        # Current pipe being built
+        pipe = []
+
+        for invoke in statement:
+            if invoke.chain_pipe():
+                pipe.append(invoke)
+                continue
+
+            if pipe:
+                invoke.stdin = self.connect_pipe_stages(pipe, invoke)
+            stages = [(sub, self.start_invocation(sub)) for sub in pipe]
+            pipe = []
+
+            try:
+                rc = await self.start_invocation(invoke)
+            except asyncio.CancelledError:
+                await self.stop_pipe_stages(stages)
+                raise
+            except Exception as e:
+                # Print stage-specific unhandled exceptions.
+                for sub, result in await self.stop_pipe_stages(stages):
+                    if isinstance(result, Exception):
+                        self.print_pipe_error(sub, result)
+
+                rc = self.handle_invocation_error(e)
+            else:
+                # The stages have finished writing, or will fail with a
+                # broken pipe now that the last invocation is done.
+                await asyncio.gather(*[task for (_, task) in stages],
+                                     return_exceptions=True)
+
+            self.errno = rc
+
+            # Check if the statement's next invocation be executed.
+            if not invoke.should_continue(rc):
+                break
+
+        return rc
+
+    async def execute_background_async(self, statement):
+        '''
+        The :mod:`asyncio` version of
+        :meth:`~pypsi.shell.Shell.execute_background`, background jobs run as
+        tasks on the running event loop.
+
+        :param pypsi.cmdline.Statement statement: the statement to execute
+        :returns int: the return code of the last foreground command, or 0 if
+            the statement ends with ``&``
+        '''
+        rc = None
+        for part, background in statement.split_background():
+            if background:
+                job = self.jobs.start_async(self, part)
+                self.on_job_started(job)
+                rc = 0
+            else:
+                rc = await self.execute_statement_async(part)
+        return rc
+
+    def connect_pipe_stages(self, pipe, consumer):
+        '''
+        Connect the stdin and stdout of each invocation in a pipe. Adjacent
+        asynchronous invocations are connected by an
+        :class:`~pypsi.pipes.AsyncPipe` and all others by
+        :meth:`~pypsi.shell.Shell.connect_pipe`.
+
+        :param list pipe: the invocations whose output is piped
+        :param pypsi.cmdline.CommandInvocation consumer: the invocation that
+            reads the last invocation's stdout
+        :returns: the last invocation's stdout stream
+        '''
+        stdin = None
+        for i, invoke in enumerate(pipe):
+            reader = pipe[i + 1] if i + 1 < len(pipe) else consumer
+            if invoke.is_async() and reader.is_async():
+                async_pipe = AsyncPipe()
+                next_stdin, stdout = async_pipe.reader, async_pipe.writer
+            else:
+                next_stdin, stdout = self.connect_pipe(invoke, reader)
+
+            if stdin:
+                invoke.stdin = stdin
+            invoke.stdout = stdout
+            stdin = next_stdin
+        return stdin
+
+    def start_invocation(self, invoke):
+        '''
+        Start running an invocation. Asynchronous invocations run as a task
+        on the running event loop and synchronous invocations run on a
+        :attr:`~pypsi.shell.Shell.pipe_pool` worker thread. Either way, the
+        invocation runs in a copy of the current :mod:`contextvars` context,
+        so it inherits the current task's streams.
+
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        :returns asyncio.Future: the invocation's return code
+        '''
+        if invoke.is_async():
+            if self.invocation_plugins:
+                return asyncio.ensure_future(self.call_invocation_async(invoke))
+            return asyncio.ensure_future(invoke.call_async(self))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        context = contextvars.copy_context()
+
+        def set_result(rc, exc):
+            if future.done():
+                return
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(rc)
+
+        def run():
+            try:
+                rc = context.run(self.run_invocation, invoke)
+            except BaseException as e:
+                loop.call_soon_threadsafe(set_result, None, e)
+            else:
+                loop.call_soon_threadsafe(set_result, rc, None)
+
+        if self.pipe_pool:
+            self.pipe_pool.submit(run)
+        else:
+            threading.Thread(target=run, daemon=True).start()
+        return future
+
+    async def call_invocation_async(self, invoke):
+        '''
+        Run an asynchronous invocation and call the invocation hooks before
+        and after it, see :meth:`~pypsi.shell.Shell.call_invocation`.
+
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        :returns int: the invocation's return code
+        '''
+        self.on_invocation_start(invoke)
+        start = time.perf_counter()
+        try:
+            rc = await invoke.call_async(self)
+        except BaseException:
+            self.on_invocation_end(invoke, None, time.perf_counter() - start,
+                                   sys.exc_info())
+            raise
+        self.on_invocation_end(invoke, rc, time.perf_counter() - start)
+        return rc
+
+    async def stop_pipe_stages(self, stages):
+        '''
+        Stop the running stages of a pipe by closing their streams and
+        cancelling their tasks, and wait for them to finish.
+
+        :param list stages: ``(invoke, future)`` tuples, as returned by
+            :meth:`start_invocation`
+        :returns list: ``(invoke, result)`` tuples, where the result is the
+            return code or the exception raised by the stage
+        '''
+        for invoke, future in stages:
+            if not future.done():
+                try:
+                    invoke.close_streams()
+                except:
+                    pass
+                future.cancel()
+
+        results = await asyncio.gather(*[future for (_, future) in stages],
+                                       return_exceptions=True)
+        return [(invoke, result)
+                for ((invoke, _), result) in zip(stages, results)]
+
+    async def cmdloop_async(self):
+        '''
+        The :mod:`asyncio` version of :meth:`~pypsi.shell.Shell.cmdloop`.
+        User input is read in the event loop's default executor so that other
+        tasks keep running while the shell waits for input.
+        '''
+
+        loop = asyncio.get_running_loop()
+        self.running = True
+        self.set_readline_completer()
+        self.on_cmdloop_begin()
+        rc = 0
+        try:
+            while self.running:
+                try:
+                    raw = await loop.run_in_executor(
+                        None, input, self.get_current_prompt()
+                    )
+                except EOFError:
+                    print()
+                    self.on_input_canceled()
+                    if not self.features.eof_is_sigint:
+                        self.running = False
+                        print("exiting....")
+                except KeyboardInterrupt:
+                    print()
+                    self.on_input_canceled()
+                else:
+                    rc = None
+                    try:
+                        rc = await self.execute_async(raw)
+                        rc = rc or 0
+                    except SystemExit as e:
+                        rc = e.code
+                        print("exiting....")
+                        self.running = False
+                    except (KeyboardInterrupt, EOFError):
+                        rc = None
+                        print()
+                    finally:
+                        if rc is not None:
+                            self.errno = rc
+
+                        self.on_statement_finished(rc)
+        finally:
+            self.on_cmdloop_end()
+            self.reset_readline_completer()
+        return rc
+
+    def cmdloop(self):
+        '''
+        Run :meth:`cmdloop_async` on a new event loop.
+        '''
+        return asyncio.run(self.cmdloop_async())
@@ -0,0 +1,99 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+'''
+Command line entry point that runs a script through a pypsi shell without an
+interactive prompt, see :meth:`pypsi.shell.Shell.run_batch`::
+
+    $ pypsi-batch mypackage.shell:MyShell script.txt
+    $ generate-commands | pypsi-batch --stop-on-error mypackage.shell:MyShell
+'''
+
+import argparse
+import importlib
+import sys
+
+
+def load_shell(spec):
+    '''
+    Load a shell class from a ``module:Class`` specification.
+
+    :param str spec: the module and class name, separated by ``:``
+    :returns type: the shell class
+    :raises ValueError: ``spec`` is not a valid specification
+    '''
+    module_name, _, class_name = spec.partition(':')
+    if not module_name or not class_name:
+        raise ValueError("invalid shell: {} (expected module:Class)".format(
+            spec
+        ))
+
+    module = importlib.import_module(module_name)
+    try:
+        return getattr(module, class_name)
+    except AttributeError:
+        raise ValueError("invalid shell: {}: no such class".format(spec))
+
+
+def main(argv=None):
+    '''
+    Run a script through a shell.
+
+    :param list argv: the command line arguments, defaults to
+        :data:`sys.argv`
+    :returns int: the script's return code
+    '''
+    parser = argparse.ArgumentParser(
+        prog='pypsi-batch',
+        description='execute a script with a pypsi shell'
+    )
+    parser.add_argument(
+        'shell', metavar='SHELL', help='shell class, as module:Class'
+    )
+    parser.add_argument(
+        'script', metavar='SCRIPT', nargs='?',
+        help='script to execute, defaults to stdin'
+    )
+    parser.add_argument(
+        '-e', '--stop-on-error', action='store_true',
+        help='stop at the first statement that fails'
+    )
+    parser.add_argument(
+        '-l', '--last-rc', action='store_true',
+        help='exit with the return code of the last statement, instead of the '
+             'first statement that failed'
+    )
+    ns = parser.parse_args(argv)
+
+    try:
+        shell = load_shell(ns.shell)()
+    except (ImportError, ValueError) as e:
+        parser.error(str(e))
+
+    shell.bootstrap()
+    try:
+        if ns.script:
+            with open(ns.script, 'r') as fp:
+                rc = shell.run_batch(fp, ns.stop_on_error, not ns.last_rc)
+        else:
+            rc = shell.run_batch(sys.stdin, ns.stop_on_error, not ns.last_rc)
+    finally:
+        shell.restore()
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
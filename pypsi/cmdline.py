@@ -20,15 +20,26 @@
 Classes used for parsing user input.
 '''
 
+import array
+import asyncio
+import collections
+import copy
+import functools
+import inspect
+import re
 import sys
+import threading
 from pypsi.utils import safe_open
+from pypsi.pipes import write_object, awrite_object, BufferedStream
+from pypsi.features import RegexTokenizer
 
 
 __all__ = (
-    'Token', 'StringToken', 'OperatorToken', 'WhitespaceToken',
+    'Token', 'SpanToken', 'StringToken', 'OperatorToken', 'WhitespaceToken',
     'IORedirectionError', 'StatementParser', 'StatementSyntaxError',
     'CommandNotFoundError', 'CommandInvocation', 'Expression', 'Statement',
-    'TrailingEscapeError'
+    'TrailingEscapeError', 'StatementCache', 'CompletionState', 'TokenRule',
+    'TokenRewriter'
 )
 
 
@@ -48,6 +59,8 @@ class Token(object):
     Base class for all tokens.
     '''
 
+    __slots__ = ('index', 'features')
+
     def __init__(self, index, features=None):
         '''
         :param int index: the starting index of this token
@@ -56,14 +69,120 @@ class Token(object):
         self.features = features or None
 
 
-class WhitespaceToken(Token):
+class SpanToken(Token):
     '''
-    Whitespace token that can contain any number of whitespace characters.
+    Base class for tokens that hold a run of characters. Tokens that are
+    created by the :class:`StatementParser` do not copy each character as it
+    is added. Instead, the token references the source line and the
+    ``(start, end)`` offsets of its characters, along with the offsets of any
+    escape characters that are removed from the text. The characters are only
+    copied into a new string the first time the token's value is read, at
+    which point the token no longer references the source line.
     '''
 
-    def __init__(self, index, c=' ', features=None):
+    __slots__ = ('_value', '_line', '_start', '_end', '_skips')
+
+    def __init__(self, index, value='', features=None, line=None, start=None):
+        '''
+        :param str value: the initial value, which precedes the span
+        :param str line: the source line, or :const:`None` to store characters
+            in a string as they are added
+        :param int start: offset in the source line where the span starts
+        '''
         super().__init__(index, features)
-        self.text = c
+        self._value = value
+        self._line = line
+        self._start = self._end = start
+        #: offsets of skipped escape characters within the span
+        self._skips = None
+
+    def _span_end(self):
+        return self._end
+
+    def _get_value(self):
+        if self._line is not None:
+            line, start, end = self._line, self._start, self._span_end()
+            if self._skips:
+                parts = []
+                for skip in self._skips:
+                    parts.append(line[start:skip])
+                    start = skip + 1
+                parts.append(line[start:end])
+                self._value += ''.join(parts)
+            else:
+                self._value += line[start:end]
+            self._line = self._skips = None
+        return self._value
+
+    def _set_value(self, value):
+        self._value = value
+        self._line = self._skips = None
+
+    def _consume(self, c):
+        # Add a character that is part of the token's value.
+        if self._line is None:
+            self._value += c
+        else:
+            self._end += 1
+
+    def _skip(self):
+        # The last character in the span is an escape character that is not
+        # part of the token's value.
+        if self._skips is None:
+            self._skips = array.array('L')
+        self._skips.append(self._end - 1)
+
+    def extend(self, line, start, end):
+        '''
+        Add a run of characters to this token. The characters must not change
+        the state of the token, that is, ``add_char`` would return
+        ``TokenContinue`` for each of them.
+
+        :param str line: the source line
+        :param int start: offset of the first character in the run
+        :param int end: offset after the last character in the run
+        '''
+        if self._line is line and self._end == start:
+            self._end = end
+        else:
+            self._value = self._get_value() + line[start:end]
+
+    def copy(self):
+        '''
+        :returns SpanToken: a copy of this token that can be modified
+            independently
+        '''
+        token = copy.copy(self)
+        if self._skips is not None:
+            token._skips = array.array('L', self._skips)
+        return token
+
+    def detach(self):
+        '''
+        Copy the referenced characters so that the token no longer references
+        the source line. This is called when a token continues on a new line
+        of input.
+        '''
+        self._get_value()
+
+
+class WhitespaceToken(SpanToken):
+    '''
+    Whitespace token that can contain any number of whitespace characters.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, index, c=' ', features=None, line=None):
+        '''
+        :param str c: the first character
+        :param str line: the source line, where ``line[index]`` is the first
+            character
+        '''
+        super().__init__(index, c, features, line,
+                         None if line is None else index + 1)
+
+    text = property(SpanToken._get_value, SpanToken._set_value)
 
     def add_char(self, c):
         '''
@@ -73,7 +192,7 @@ class WhitespaceToken(Token):
         :returns int: TokenEnd or TokenContinue
         '''
         if c in (' ', '\t', '\xa0'):
-            self.text += c
+            self._consume(c)
             return TokenContinue
         return TokenEnd
 
@@ -84,31 +203,51 @@ class WhitespaceToken(Token):
         return isinstance(other, WhitespaceToken)
 
 
-class StringToken(Token):
+class StringToken(SpanToken):
     '''
     A string token. This token may be bound by matching quotes and/or contain
     escaped whitespace characters.
     '''
 
-    def __init__(self, index, c, quote=None, features=None):
+    __slots__ = (
+        'quote', '_escape_char', 'escape', 'open_quote', 'escapes_removed'
+    )
+
+    def __init__(self, index, c, quote=None, features=None, line=None):
         '''
         :param str c: the current string or character
         :param str quote: the surrounding quotes, `None` if there isn't any
+        :param str line: the source line, where ``line[index]`` is ``c``
         '''
-        super().__init__(index, features)
+        super().__init__(index, features=features)
         self.quote = quote
         self._escape_char = features.escape_char if features else ''
         self.escape = False
-        self.text = ''
         self.open_quote = False
+        #: Whether escape sequences have already been removed from the text
+        self.escapes_removed = False
 
         if c in ('"', "'"):
             self.quote = c
             self.open_quote = True
         elif self._escape_char and c == self._escape_char:
             self.escape = True
-        elif c:
-            self.text += c
+        elif c and line is None:
+            self._value = c
+
+        if line is not None:
+            # The opening quote is not part of the span, a pending escape
+            # character is.
+            self._line = line
+            self._start = index + 1 if self.open_quote else index
+            self._end = index + 1
+
+    text = property(SpanToken._get_value, SpanToken._set_value)
+
+    def _span_end(self):
+        # A pending escape character is not part of the text until the next
+        # character is added.
+        return self._end - 1 if self.escape else self._end
 
     def add_char(self, c):
         '''
@@ -121,35 +260,38 @@ class StringToken(Token):
         if self.escape:
             self.escape = False
             if self.quote:
-                if c == self.quote:
-                    self.text += c
-                elif c is self._escape_char:
-                    self.text += self._escape_char + self._escape_char
-                else:
-                    self.text += self._escape_char
-                    self.text += c
-            elif c in (' ', '\t', "'", "\"") or c in OperatorToken.Operators:
-                self.text += c
+                drop = c == self.quote
+            else:
+                drop = (c in (' ', '\t', "'", "\"") or
+                        c in OperatorToken.Operators)
+
+            if self._line is None:
+                self._value += c if drop else self._escape_char + c
             else:
-                self.text += self._escape_char
-                self.text += c
+                if drop:
+                    self._skip()
+                self._end += 1
         elif self.quote:
             if c == self.quote:
                 ret = TokenTerm
                 self.open_quote = False
             elif c == self._escape_char:
                 self.escape = True
+                if self._line is not None:
+                    self._end += 1
             else:
-                self.text += c
+                self._consume(c)
         else:
             if c == self._escape_char:
                 self.escape = True
+                if self._line is not None:
+                    self._end += 1
             elif c in (' ', '\t', ';', '|', '&', '>', '<', '\xa0'):
                 ret = TokenEnd
             elif c in ('"', "'"):
                 ret = TokenEnd
             else:
-                self.text += c
+                self._consume(c)
 
         return ret
 
@@ -177,7 +319,7 @@ class StringToken(Token):
         )
 
 
-class OperatorToken(Token):
+class OperatorToken(SpanToken):
     '''
     An operator token. An operator can consist of one or more repetitions of
     the same operator character. For example, the string ">>" would be parsed
@@ -185,15 +327,25 @@ class OperatorToken(Token):
     separate `OperatorToken` objects.
     '''
 
+    __slots__ = ('_char',)
+
     #: Valid operator characters
     Operators = '<>|&;'
 
-    def __init__(self, index, operator):
+    def __init__(self, index, operator, line=None):
         '''
         :param str operator: the operator
+        :param str line: the source line, where ``line[index]`` is
+            ``operator``
         '''
-        super().__init__(index)
-        self.operator = operator
+        if line is None:
+            super().__init__(index, operator)
+        else:
+            super().__init__(index, '', line=line, start=index)
+            self._end = index + 1
+        self._char = operator[:1]
+
+    operator = property(SpanToken._get_value, SpanToken._set_value)
 
     def add_char(self, c):
         '''
@@ -202,8 +354,8 @@ class OperatorToken(Token):
         :param str c: the current character
         :returns int: TokenEnd or TokenContinue
         '''
-        if c == self.operator[0]:
-            self.operator += c
+        if c == self._char:
+            self._consume(c)
             return TokenContinue
         return TokenEnd
 
@@ -223,6 +375,54 @@ class OperatorToken(Token):
         )
 
 
+class ScanPatterns(object):
+    '''
+    Precompiled regular expressions used by :meth:`StatementParser.scan`.
+    Each pattern matches the longest run of characters that the current token
+    would accept without changing its state, so that only the character that
+    ends the run needs to be passed to the token's ``add_char`` method.
+    '''
+
+    #: Whitespace characters
+    Whitespace = ' \t\xa0'
+    #: Quote characters
+    Quotes = '"\''
+
+    def __init__(self, escape_char):
+        '''
+        :param str escape_char: the escape character, may be empty
+        '''
+        special = self.Whitespace + self.Quotes + OperatorToken.Operators
+        #: run of whitespace characters
+        self.whitespace = re.compile('[{}]*'.format(re.escape(self.Whitespace)))
+        #: run of repeated operator characters, keyed by the operator
+        self.operators = {
+            c: re.compile(re.escape(c) + '*') for c in OperatorToken.Operators
+        }
+        #: run of characters in an unquoted string
+        self.unquoted = re.compile(
+            '[^{}]*'.format(re.escape(special + escape_char))
+        )
+        #: escape sequence, the escaped character is the first group
+        self.escape = re.compile(re.escape(escape_char) + '(.)', re.DOTALL)
+        #: run of characters inside of a quoted string, keyed by the quote
+        self.quoted = {
+            q: re.compile('[^{}]*'.format(re.escape(q + escape_char)))
+            for q in self.Quotes
+        }
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get(escape_char):
+        '''
+        Get the cached patterns for an escape character.
+
+        :param str escape_char: the escape character
+        :returns ScanPatterns: the compiled patterns
+        '''
+        return ScanPatterns(escape_char)
+
+
 class IORedirectionError(Exception):
 
     def __init__(self, path, message):
@@ -254,6 +454,8 @@ class Statement(object):
     instances.
     '''
 
+    __slots__ = ('invokes',)
+
     def __init__(self, invokes=None):
         '''
         :param list[CommandInvocation] invokes: list of command invocations
@@ -296,12 +498,128 @@ class Statement(object):
     def __eq__(self, other):
         return isinstance(other, Statement) and self.invokes == other.invokes
 
+    def copy(self):
+        '''
+        :returns Statement: a new statement containing a copy of each command
+            invocation
+        '''
+        return Statement([invoke.copy() for invoke in self.invokes])
+
+    def __str__(self):
+        return ' '.join(str(invoke) for invoke in self.invokes)
+
+    def has_background(self):
+        '''
+        :returns bool: whether the statement contains the background (&)
+            operator
+        '''
+        return any(invoke.chain_background() for invoke in self.invokes)
+
+    def split_background(self):
+        '''
+        Split the statement into the lists of commands that are terminated by
+        the background (&) or unconditional (;) operators. For example,
+        ``a && b & c ; d`` is split into ``a && b``, which runs in the
+        background, and ``c ;`` and ``d``, which run in the foreground. The
+        background operator is removed from the last command of each
+        background list.
+
+        :returns list: ``(statement, background)`` tuples
+        '''
+        parts = []
+        invokes = []
+        for invoke in self.invokes:
+            invokes.append(invoke)
+            if invoke.chain in ('&', ';'):
+                background = invoke.chain_background()
+                if background:
+                    invoke.chain = None
+                parts.append((Statement(invokes), background))
+                invokes = []
+
+        if invokes:
+            parts.append((Statement(invokes), False))
+        return parts
+
+
+class StatementCache(object):
+    '''
+    A bounded, least recently used cache of parsed :class:`Statement` objects.
+    The cache stores statement templates and returns a fresh copy on every
+    hit, so that the returned statement's command invocations can be setup
+    and executed without modifying the cached template.
+    '''
+
+    def __init__(self, size=256):
+        '''
+        :param int size: the maximum number of cached statements, caching is
+            disabled if this is ``0``
+        '''
+        #: Maximum number of cached statements
+        self.size = size
+        #: Number of lookups that returned a cached statement
+        self.hits = 0
+        #: Number of lookups that did not find a cached statement
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Lookup a cached statement.
+
+        :param key: the cache key
+        :returns Statement: a copy of the cached statement or :const:`None` if
+            the key is not cached
+        '''
+        with self._lock:
+            statement = self._entries.get(key)
+            if statement is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return statement.copy()
+
+    def put(self, key, statement):
+        '''
+        Cache a copy of a statement, evicting the least recently used
+        statement if the cache is full.
+
+        :param key: the cache key
+        :param Statement statement: the statement to cache
+        '''
+        if self.size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = statement.copy()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove all cached statements.
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class CommandInvocation(object):
     '''
     An invocation of a command.
     '''
 
+    __slots__ = (
+        'name', 'args', 'stdout', 'stderr', 'stdin', 'chain', 'cmd',
+        'fallback_cmd', 'stdout_buffer'
+    )
+
     def __init__(self, name, args=None, stdout=None, stderr=None, stdin=None,
                  chain=None):
         #: Command name
@@ -314,12 +632,16 @@ class CommandInvocation(object):
         self.stderr = stderr
         #: stderr redirection
         self.stdin = stdin
-        #: The chain operator, if any is specified: &&, ||, |, ;.
+        #: The chain operator, if any is specified: &&, ||, |, ;, &.
         self.chain = chain
         #: The resolved pypsi command (:class:`~pypsi.core.Command`)
         self.cmd = None
         #: The fallback command to use if :attr:`cmd` is :const:`None`.
         self.fallback_cmd = None
+        #: The :class:`~pypsi.pipes.BufferedStream` that stdout is written to
+        #: while the command is running, which is kept once the command has
+        #: finished to report how much output the command wrote.
+        self.stdout_buffer = None
 
     def __eq__(self, other):
         return (
@@ -334,13 +656,24 @@ class CommandInvocation(object):
             self.fallback_cmd == other.fallback_cmd
         )
 
+    def copy(self):
+        '''
+        :returns CommandInvocation: a new, unresolved invocation with the same
+            name, arguments, redirections, and chain operator
+        '''
+        return CommandInvocation(
+            self.name, list(self.args), stdout=self.stdout, stderr=self.stderr,
+            stdin=self.stdin, chain=self.chain
+        )
+
     def __str__(self):
-        s = "{name} {args}".format(name=self.name, args=' '.join(self.args))
+        s = ' '.join([self.name] + self.args)
         if self.stdout:
-            if isinstance(self.stdout, tuple) and self.stdout[1] == 'a':
-                s += " >> " + self.stdout[0]
+            if isinstance(self.stdout, tuple):
+                path, mode = self.stdout
+                s += (" >> " if mode == 'a' else " > ") + path
             else:
-                s += " > " + self.stdout
+                s += " > " + str(self.stdout)
 
         if self.stdin:
             s += " < " + self.stdin
@@ -361,7 +694,7 @@ class CommandInvocation(object):
         '''
 
         if self.name in shell.commands:
-            self.cmd = shell.commands[self.name]
+            self.cmd = shell.get_command(self.name)
         elif shell.fallback_cmd:
             self.fallback_cmd = shell.fallback_cmd
         else:
@@ -446,27 +779,38 @@ class CommandInvocation(object):
         '''
         # pylint: disable=no-member,protected-access
 
+        self.stdout_buffer = None
         if self.stdout:
-            sys.stdout._proxy(self.stdout)
+            self.stdout_buffer = BufferedStream.wrap(self.stdout)
+            sys.stdout._proxy(self.stdout_buffer)
         if self.stderr:
-            sys.stderr._proxy(self.stderr)
+            # Keep stdout and stderr in order when they share a stream
+            sys.stderr._proxy(
+                self.stdout_buffer if self.stderr is self.stdout else
+                self.stderr
+            )
         if self.stdin:
             sys.stdin._proxy(self.stdin)
 
     def cleanup_io(self):
         '''
-        Close proxied streams and unproxy them.
+        Flush buffered output, close proxied streams and unproxy them.
         '''
         # pylint: disable=no-member,protected-access
 
-        self.close_streams()
+        try:
+            if (self.stdout_buffer is not None and
+                    not getattr(self.stdout, 'closed', False)):
+                self.stdout_buffer.flush()
+        finally:
+            self.close_streams()
 
-        if self.stdout:
-            sys.stdout._unproxy()
-        if self.stderr:
-            sys.stderr._unproxy()
-        if self.stdin:
-            sys.stdin._unproxy()
+            if self.stdout:
+                sys.stdout._unproxy()
+            if self.stderr:
+                sys.stderr._unproxy()
+            if self.stdin:
+                sys.stdin._unproxy()
 
     def chain_and(self):
         '''
@@ -496,6 +840,13 @@ class CommandInvocation(object):
 
         return self.chain == '|'
 
+    def chain_background(self):
+        '''
+        :returns: :const:`True` if the chain operator is BACKGROUND (&)
+        '''
+
+        return self.chain == '&'
+
     def __call__(self, shell):
         '''
         Invoke the command by proxying streams, running the command, and
@@ -510,10 +861,103 @@ class CommandInvocation(object):
                 rc = self.fallback_cmd.fallback(shell, self.name, self.args)
             else:
                 rc = self.cmd.run(shell, self.args)
+
+            if inspect.isgenerator(rc):
+                rc = self.write_objects(rc)
+            elif inspect.isasyncgen(rc):
+                rc = asyncio.run(self.awrite_objects(rc))
+            elif inspect.isawaitable(rc):
+                rc = asyncio.run(rc)
+        finally:
+            self.cleanup_io()
+        return rc
+
+    async def call_async(self, shell):
+        '''
+        Invoke the command as an :mod:`asyncio` coroutine. Commands whose
+        :meth:`~pypsi.core.Command.run` method is a coroutine function are
+        awaited and asynchronous generators are written to stdout with
+        :func:`~pypsi.pipes.awrite_object`. This should only be called when
+        :meth:`is_async` is :const:`True`, since a synchronous command would
+        block the event loop.
+
+        :returns: the commnd's return code.
+        '''
+
+        self.setup_io()
+        try:
+            if self.fallback_cmd:
+                rc = self.fallback_cmd.fallback(shell, self.name, self.args)
+            else:
+                rc = self.cmd.run(shell, self.args)
+
+            if inspect.isasyncgen(rc):
+                rc = await self.awrite_objects(rc)
+            elif inspect.isawaitable(rc):
+                rc = await rc
+            elif inspect.isgenerator(rc):
+                rc = self.write_objects(rc)
         finally:
             self.cleanup_io()
         return rc
 
+    def write_objects(self, gen):
+        '''
+        Write the objects yielded by a command's generator to stdout, see
+        :func:`pypsi.pipes.write_object`.
+
+        :param generator gen: the generator returned by the command
+        :returns int: the generator's return value, or 0 if it returned
+            :const:`None`
+        '''
+        while True:
+            try:
+                obj = next(gen)
+            except StopIteration as e:
+                return 0 if e.value is None else e.value
+            write_object(obj)
+
+    async def awrite_objects(self, gen):
+        '''
+        Write the objects yielded by a command's asynchronous generator to
+        stdout, see :func:`pypsi.pipes.awrite_object`.
+
+        :param async_generator gen: the generator returned by the command
+        :returns int: 0, asynchronous generators can't return a value
+        '''
+        async for obj in gen:
+            await awrite_object(obj)
+        return 0
+
+    def is_async(self):
+        '''
+        :returns bool: whether the command is implemented as a coroutine
+            function or an asynchronous generator, see :meth:`call_async`
+        '''
+        if self.fallback_cmd:
+            func = self.fallback_cmd.fallback
+        else:
+            func = self.cmd.run
+        return (inspect.iscoroutinefunction(func) or
+                inspect.isasyncgenfunction(func))
+
+    def pipe_type(self):
+        '''
+        :returns str: the type of data that the command reads from and writes
+            to pipes, see :attr:`pypsi.core.Command.pipe`
+        '''
+        cmd = self.cmd or self.fallback_cmd
+        return getattr(cmd, 'pipe', None) or 'str'
+
+    def isolation(self):
+        '''
+        :returns str: where the command runs, see
+            :attr:`pypsi.core.Command.isolation`
+        '''
+        if self.fallback_cmd:
+            return 'thread'
+        return getattr(self.cmd, 'isolation', None) or 'thread'
+
     def should_continue(self, prev_rc):
         '''
         :returns: whether this invocation is chained and, using the previous
@@ -524,6 +968,7 @@ class CommandInvocation(object):
         return (
             not self.chain or (
                 self.chain_uncond() or
+                self.chain_background() or
                 (self.chain_or() and prev_rc != 0) or
                 (self.chain_and() and prev_rc == 0)
             )
@@ -575,6 +1020,8 @@ class StatementParser(object):
         self.features = features
         self.tokens = []
         self.token = None
+        #: The line currently being tokenized
+        self.line = None
 
     def process(self, index, c):
         '''
@@ -597,24 +1044,136 @@ class StatementParser(object):
                 pass
         else:
             if c in (' ', '\t', '\xa0'):
-                self.token = WhitespaceToken(index)
+                self.token = WhitespaceToken(index, line=self.line)
             elif c in ('>', '<', '|', '&', ';'):
-                self.token = OperatorToken(index, c)
+                self.token = OperatorToken(index, c, line=self.line)
+            else:
+                self.token = StringToken(index, c, features=self.features,
+                                         line=self.line)
+
+    def scan(self, line, start=0):
+        '''
+        Process a line of input one run of characters at a time. This produces
+        the exact same tokens as calling :meth:`process` for each character,
+        but the characters that do not change the state of the current token
+        are consumed in a single step using the precompiled
+        :class:`ScanPatterns`. Only the character that ends a run is passed to
+        the token's ``add_char`` method.
+
+        :param str line: the line of text to process
+        :param int start: index of the first character to process
+        '''
+        escape_char = self.features.escape_char if self.features else ''
+        patterns = ScanPatterns.get(escape_char)
+        index = start
+        end = len(line)
+
+        while index < end:
+            token = self.token
+            if token is None:
+                # Start a new token, identical to process()
+                c = line[index]
+                if c in ScanPatterns.Whitespace:
+                    self.token = WhitespaceToken(index, line=line)
+                elif c in OperatorToken.Operators:
+                    self.token = OperatorToken(index, c, line=line)
+                else:
+                    self.token = StringToken(index, c, features=self.features,
+                                             line=line)
+                index += 1
+                continue
+
+            if isinstance(token, WhitespaceToken):
+                run = patterns.whitespace.match(line, index).end()
+            elif isinstance(token, OperatorToken):
+                run = patterns.operators[
+                    token._char  # pylint: disable=protected-access
+                ].match(line, index).end()
+            elif token.escape:
+                # The escaped character is always consumed by add_char()
+                run = index
+            elif token.quote:
+                run = patterns.quoted[token.quote].match(line, index).end()
             else:
-                self.token = StringToken(index, c, features=self.features)
+                run = patterns.unquoted.match(line, index).end()
+
+            if run > index:
+                token.extend(line, index, run)
+
+            index = run
+            if index >= end:
+                break
+
+            action = token.add_char(line[index])
+            if action == TokenEnd:
+                self.tokens.append(token)
+                self.token = None
+            elif action == TokenTerm:
+                self.tokens.append(token)
+                self.token = None
+                index += 1
+            else:
+                index += 1
+
+    def copy(self):
+        '''
+        Copy the tokenizer state. The copy can continue processing input
+        without modifying this parser's current token.
+
+        :returns StatementParser: the new parser
+        '''
+        parser = StatementParser(self.features)
+        parser.tokens = list(self.tokens)
+        parser.token = self.token.copy() if self.token else None
+        return parser
 
     def tokenize(self, line):
         '''
-        Transform a `str` into a `list` of :class:`Token` objects.
+        Transform a `str` into a `list` of :class:`Token` objects. The
+        tokenizer backend is selected by the parser features'
+        :attr:`~pypsi.features.PypsiFeatures.tokenizer` attribute. This is
+        equivalent to calling :meth:`feed` and then :meth:`finish`.
 
         :param str line: the line of text to tokenize
         :returns: `list` of :class:`Token` objects
         '''
-        index = 0
-        for c in line:
-            self.process(index, c)
-            index += 1
+        self.feed(line)
+        return self.finish()
+
+    def feed(self, line, start=0):
+        '''
+        Process the characters of a line of input without finishing the
+        current token.
+
+        :param str line: the line of text to process
+        :param int start: index of the first character to process, the
+            characters before it must have already been processed by this
+            parser
+        '''
+        if self.token:
+            # The current token continues from a previous line of input
+            self.token.detach()
+
+        self.line = line
+        if self.features and self.features.tokenizer == RegexTokenizer:
+            self.scan(line, start)
+        else:
+            index = start
+            for c in line[start:]:
+                self.process(index, c)
+                index += 1
+        self.line = None
+
+    def finish(self):
+        '''
+        Finish the current token at the end of a line of input.
 
+        :raises UnclosedQuotationError: the current token is an unclosed
+            quotation and the parser features support multiline input
+        :raises TrailingEscapeError: the line ended with an escape character
+            and the parser features support multiline input
+        :returns: `list` of :class:`Token` objects
+        '''
         if self.token and self.features:
             if isinstance(self.token, StringToken):
                 if self.token.escape:
@@ -643,6 +1202,64 @@ class StatementParser(object):
 
         return self.tokens
 
+    def parse_stream(self, iterable, on_tokenize=None, on_error=None):
+        '''
+        Parse a stream of input lines, such as a script file, into statements.
+        When the parser features support multiline input, a statement that
+        contains an unclosed quotation or ends with an escape character
+        continues on the next line and the tokenizer state is carried over.
+        Lines are read lazily: the next line is not read until the previous
+        statement has been consumed, so executing a statement can affect how
+        the following lines are parsed.
+
+        :param iterable: lines of input, trailing newline characters are
+            removed
+        :param on_tokenize: optional callable that receives the tokens of each
+            statement and returns the tokens to build the statement from, or
+            :const:`None` to skip the statement
+        :param on_error: optional callable that receives each
+            :class:`StatementSyntaxError`, parsing continues with the next
+            statement. If not specified, the error is raised.
+        :raises StatementSyntaxError: a statement is invalid or the stream
+            ended in the middle of a statement
+        :returns: a generator of :class:`Statement` objects
+        '''
+        pending = None
+        for line in iterable:
+            try:
+                tokens = self.tokenize(line.rstrip('\r\n'))
+            except (UnclosedQuotationError, TrailingEscapeError) as e:
+                # The statement continues on the next line
+                pending = e
+                continue
+
+            pending = None
+            self.tokens = []
+            self.token = None
+
+            if on_tokenize:
+                tokens = on_tokenize(tokens)
+                if not tokens:
+                    continue
+
+            try:
+                statement = self.build(tokens)
+            except StatementSyntaxError as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+            else:
+                if statement:
+                    yield statement
+
+        if pending is not None:
+            # The stream ended in the middle of a statement
+            self.tokens = []
+            self.token = None
+            if on_error is None:
+                raise pending
+            on_error(pending)
+
     def clean_escapes(self, tokens):
         '''
         Remove all escape sequences.
@@ -650,26 +1267,18 @@ class StatementParser(object):
         :param list tokens: :class:`Token` objects to remove escape sequences
         '''
         escape_char = self.features.escape_char if self.features else ''
+        if not escape_char:
+            return
+
+        pattern = ScanPatterns.get(escape_char).escape
         for token in tokens:
             if not isinstance(token, StringToken) or (
-                    escape_char not in token.text or token.quote):
+                    token.quote or token.escapes_removed or
+                    escape_char not in token.text):
                 continue
 
-            text = ''
-            escape = False
-            for c in token.text:
-                if escape:
-                    text += c
-                    escape = False
-                elif c == escape_char:
-                    escape = True
-                else:
-                    text += c
-
-            if escape:
-                text += escape_char
-
-            token.text = text
+            # A trailing escape character is not matched and is kept
+            token.text = pattern.sub(r'\1', token.text)
 
     def condense(self, tokens):
         '''
@@ -741,7 +1350,7 @@ class StatementParser(object):
                     cmd.args.append(token.text)
                 elif isinstance(token, OperatorToken):
                     done = False
-                    if token.operator in ('||', '&&', ';'):
+                    if token.operator in ('||', '&&', ';', '&'):
                         cmd.chain = token.operator
                         done = True
                     elif token.operator == '|':
@@ -794,7 +1403,7 @@ class StatementParser(object):
             prev = token
 
         if isinstance(prev, StringToken) or (
-                isinstance(prev, OperatorToken) and prev.operator == ';'):
+                isinstance(prev, OperatorToken) and prev.operator in (';', '&')):
             pass
         elif prev:
             raise StatementSyntaxError(
@@ -808,6 +1417,419 @@ class StatementParser(object):
         return statement
 
 
+class CompletionState(object):
+    '''
+    The command name and arguments of a partially typed statement, which is
+    used for tab completion. The state is updated incrementally: when the
+    line buffer starts with the previously processed line, which is the case
+    while the user is typing, only the new characters are tokenized and only
+    the new tokens are processed.
+    '''
+
+    def __init__(self, features=None):
+        '''
+        :param pypsi.features.PypsiFeatures features: the tokenizer features
+        '''
+        #: Tokenizer state after processing :attr:`line`
+        self.parser = StatementParser(features)
+        #: The processed line buffer
+        self.line = ''
+        #: The number of finished tokens that have been processed
+        self.count = 0
+        #: The command name, :const:`None` after a chain operator
+        self.cmd_name = ''
+        #: The current location: ``'name'``, ``'path'`` or :const:`None`
+        self.loc = None
+        #: The command arguments
+        self.args = []
+        #: Whether the next string token starts a new argument
+        self.next_arg = True
+        #: The open quotation of the last token, if any
+        self.in_quote = None
+
+    def copy(self):
+        '''
+        :returns CompletionState: a copy that can be updated independently
+        '''
+        state = CompletionState(self.parser.features)
+        state.parser = self.parser.copy()
+        state.line = self.line
+        state.count = self.count
+        state.cmd_name = self.cmd_name
+        state.loc = self.loc
+        state.args = list(self.args)
+        state.next_arg = self.next_arg
+        state.in_quote = self.in_quote
+        return state
+
+    def update(self, line):
+        '''
+        Process a line buffer. If the line does not start with the previously
+        processed line, the state is reset and the entire line is processed.
+
+        :param str line: the line buffer content up to the cursor
+        '''
+        if not line.startswith(self.line):
+            self.__init__(self.parser.features)
+
+        self.parser.feed(line, len(self.line))
+        self.line = line
+        for token in self.parser.tokens[self.count:]:
+            self.add_token(token)
+        self.count = len(self.parser.tokens)
+
+    def current(self):
+        '''
+        Get the state that includes the unfinished token at the end of the
+        line buffer.
+
+        :returns CompletionState: the current state
+        '''
+        state = self.copy()
+        for token in state.parser.finish()[state.count:]:
+            state.add_token(token)
+        return state
+
+    def add_token(self, token):
+        '''
+        Process a finished token. Escape sequences are removed from the
+        token's text.
+
+        :param Token token: the token to process
+        '''
+        if isinstance(token, StringToken):
+            self.parser.clean_escapes([token])
+            self.in_quote = token.quote if token.open_quote else None
+            if not self.cmd_name:
+                self.cmd_name = token.text
+                self.loc = 'name'
+            elif self.loc == 'name':
+                self.cmd_name += token.text
+            else:
+                if self.next_arg:
+                    self.args.append(token.text)
+                    self.next_arg = False
+                else:
+                    self.args[-1] += token.text
+        elif isinstance(token, OperatorToken):
+            self.in_quote = None
+            if token.operator in ('|', ';', '&&', '||'):
+                self.cmd_name = None
+                self.args = []
+                self.next_arg = True
+            elif token.operator in ('>', '<', '>>'):
+                self.loc = 'path'
+                self.args = []
+        elif isinstance(token, WhitespaceToken):
+            self.in_quote = None
+            if self.loc == 'name':
+                self.loc = None
+            self.next_arg = True
+
+
+class TokenRule(object):
+    '''
+    A rule that rewrites part of a :class:`StringToken`'s text. Plugins
+    provide rules through :meth:`~pypsi.core.Plugin.get_token_rules` and the
+    rules of several plugins are combined by a :class:`TokenRewriter` so that
+    each token is scanned only once.
+    '''
+
+    def __init__(self, pattern, replace, requires='', triggers=None,
+                 quoted=True, split=False):
+        '''
+        :param str pattern: regular expression that matches the text to
+            rewrite, which must not contain named groups
+        :param replace: callable that receives the match and the token and
+            returns the replacement text or, if ``split`` is :const:`True`, a
+            :class:`Token` to insert in place of the text. Returning
+            :const:`None` means that the token can't be rewritten in a single
+            scan and is processed by calling the plugins instead.
+        :param str requires: the rule only applies to tokens whose text
+            contains this string
+        :param str triggers: characters that begin a match, defaults to
+            ``requires``. Replacement text from an earlier plugin's rules that
+            contains one of these characters would need to be scanned again,
+            so the token is processed by calling the plugins instead.
+        :param bool quoted: whether the rule applies to quoted tokens
+        :param bool split: whether the rule splits the token, ``replace`` is
+            only called once the token is known to be rewritable
+        '''
+        self.pattern = pattern
+        self.regex = re.compile(pattern, re.DOTALL)
+        self.replace = replace
+        self.requires = requires
+        self.triggers = requires if triggers is None else triggers
+        self.quoted = quoted
+        self.split = split
+
+
+class _RewriteFallback(Exception):
+    # Raised when a token must be processed by the plugins instead
+    pass
+
+
+class TokenRewriter(object):
+    '''
+    A token processing stage that runs the :class:`TokenRule` objects of
+    several plugins in a single scan of each :class:`StringToken`. The rules
+    of each plugin are combined, in order, into one regular expression and
+    the result is identical to calling each plugin's ``on_tokenize`` method
+    in order. Tokens that the rules can't rewrite in a single scan are passed
+    to the plugins' ``on_tokenize`` methods.
+    '''
+
+    def __init__(self, plugins, rules, escape_char='', clean=False):
+        '''
+        :param list plugins: the plugins that are replaced by this stage, in
+            order
+        :param list rules: the list of :class:`TokenRule` objects for each
+            plugin
+        :param str escape_char: the escape character
+        :param bool clean: also remove escape sequences from unquoted tokens,
+            as :meth:`StatementParser.clean_escapes` would. This is only valid
+            if no other plugin processes the tokens before the statement is
+            built.
+        '''
+        self.plugins = list(plugins)
+        self.stages = [list(stage) for stage in rules]
+        self.escape_char = escape_char
+        self.clean = bool(clean and escape_char)
+        if self.clean:
+            self.stages.append([TokenRule(
+                re.escape(escape_char) + '(.)', lambda m, token: m.group(1),
+                requires=escape_char, quoted=False
+            )])
+
+        #: The characters that the rules of the following stages match
+        self.triggers = []
+        # Searches replacement text for the characters in triggers
+        self._trigger_search = []
+        for i in range(len(self.stages)):
+            later = ''.join(
+                rule.triggers for stage in self.stages[i + 1:] for rule in stage
+            )
+            triggers = later + escape_char if later else ''
+            self.triggers.append(triggers)
+            self._trigger_search.append(re.compile(
+                '[' + re.escape(triggers) + ']'
+            ).search if triggers else None)
+
+        #: Whether any rule of the following stages applies to quoted tokens
+        self.quoted_later = [
+            any(rule.quoted for stage in self.stages[i + 1:] for rule in stage)
+            for i in range(len(self.stages))
+        ]
+
+        rules = [rule for stage in self.stages for rule in stage]
+        #: The strings that the rules require, see :attr:`TokenRule.requires`
+        self.required = tuple(sorted(
+            set(rule.requires for rule in rules if rule.requires)
+        ))
+        # Tokens that contain none of the required strings are skipped
+        # without calling rewrite().
+        self._search = None
+        if self.required and all(rule.requires for rule in rules):
+            self._search = re.compile('|'.join(
+                re.escape(s) for s in self.required
+            )).search
+        self._patterns = {}
+
+    def get_pattern(self, first, quoted, present):
+        '''
+        Get the combined regular expression of the rules that apply to a
+        token.
+
+        :param int first: the index of the first stage to run
+        :param bool quoted: whether the token is quoted
+        :param tuple present: whether the token's text contains each of the
+            strings in :attr:`required`
+        :returns tuple: the compiled expression, or :const:`None` if no rule
+            applies, the ``(stage, rule, has_groups)`` tuple for each group
+            number and whether any of the rules splits the token
+        '''
+        key = (first, quoted, present)
+        entry = self._patterns.get(key)
+        if entry:
+            return entry
+
+        found = dict(zip(self.required, present))
+        found[''] = True
+        patterns = []
+        groups = {}
+        group = 1
+        split = False
+        for stage in range(first, len(self.stages)):
+            for rule in self.stages[stage]:
+                if not found[rule.requires] or (quoted and not rule.quoted):
+                    continue
+                groups[group] = (stage, rule, bool(rule.regex.groups))
+                split = split or rule.split
+                patterns.append('(' + rule.pattern + ')')
+                group += rule.regex.groups + 1
+
+        if not patterns:
+            entry = (None, groups, split)
+        else:
+            if self.escape_char:
+                # Escape sequences that no rule rewrites are kept as they are,
+                # the escaped character never starts a match.
+                patterns.append('(' + re.escape(self.escape_char) + '.)')
+                groups[group] = None
+            entry = (re.compile('|'.join(patterns), re.DOTALL), groups,
+                     split)
+
+        self._patterns[key] = entry
+        return entry
+
+    def on_tokenize(self, shell, tokens, origin):
+        '''
+        Rewrite a list of tokens.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param list tokens: the list of :class:`Token` objects
+        :param str origin: the origin of the input
+        :returns list: the rewritten list of :class:`Token` objects
+        '''
+        search = self._search
+        ret = []
+        for token in tokens:
+            if isinstance(token, StringToken) and (
+                    not search or search(token.text)):
+                ret.extend(self.rewrite(shell, token, origin))
+            else:
+                ret.append(token)
+        return ret
+
+    def rewrite(self, shell, token, origin, first=0):
+        '''
+        Rewrite a single string token.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param StringToken token: the token to rewrite
+        :param str origin: the origin of the input
+        :param int first: the index of the first stage to run
+        :returns list: the list of resulting tokens
+        '''
+        text = token.text
+        regex, groups, split = self.get_pattern(
+            first, bool(token.quote),
+            tuple(map(text.__contains__, self.required))
+        )
+        if not regex:
+            return [token]
+
+        clean = self.clean and not token.quote
+        if not split:
+            trigger_search = self._trigger_search
+
+            def replace(match):
+                entry = groups[match.lastindex]
+                if not entry:
+                    return match.group()
+
+                stage, rule, has_groups = entry
+                if has_groups:
+                    match = rule.regex.match(text, match.start())
+                result = rule.replace(match, token)
+                search = trigger_search[stage]
+                if result is None or (search and search(result)):
+                    raise _RewriteFallback()
+                return result
+
+            try:
+                token.text = regex.sub(replace, text)
+            except _RewriteFallback:
+                return self.fallback(shell, token, origin, first)
+            token.escapes_removed = clean
+            return [token]
+
+        pieces = []
+        pos = 0
+        for match in regex.finditer(text):
+            entry = groups[match.lastindex]
+            if not entry:
+                continue
+
+            stage, rule, has_groups = entry
+            if has_groups:
+                # Match the rule's own expression so that its groups are
+                # numbered as the rule expects.
+                match = rule.regex.match(text, match.start())
+
+            pieces.append(text[pos:match.start()])
+            pos = match.end()
+            if rule.split:
+                # Split rules, which may have side effects, are only called
+                # once the token is known to be rewritable.
+                pieces.append((match, stage, rule))
+                continue
+
+            result = rule.replace(match, token)
+            search = self._trigger_search[stage]
+            if result is None or (search and search(result)):
+                return self.fallback(shell, token, origin, first)
+            pieces.append(result)
+        pieces.append(text[pos:])
+
+        ret = []
+        part = []
+        start = 0
+        for piece in pieces:
+            if piece.__class__ is str:
+                part.append(piece)
+                continue
+
+            match, stage, rule = piece
+            if match.start() > start:
+                ret.append(self.make_token(token, start, part, clean))
+            sub = rule.replace(match, token)
+            if sub.quote and not self.quoted_later[stage]:
+                ret.append(sub)
+            else:
+                ret.extend(self.rewrite(shell, sub, origin, stage + 1))
+            part = []
+            start = match.end()
+
+        if len(text) > start:
+            ret.append(self.make_token(token, start, part, clean))
+        return ret
+
+    def make_token(self, token, start, pieces, clean):
+        '''
+        Create a token from the rewritten text of part of a token that was
+        split.
+
+        :param StringToken token: the token that was split
+        :param int start: offset of the part within the token's text
+        :param list pieces: the rewritten text
+        :param bool clean: whether escape sequences were removed
+        :returns StringToken: the new token
+        '''
+        ret = StringToken(token.index + start, '', token.quote,
+                          features=token.features)
+        ret.text = ''.join(pieces)
+        ret.escapes_removed = clean
+        return ret
+
+    def fallback(self, shell, token, origin, first=0):
+        '''
+        Process a token by calling the plugins' ``on_tokenize`` methods.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param StringToken token: the token to process
+        :param str origin: the origin of the input
+        :param int first: the index of the first plugin to call
+        :returns list: the list of resulting tokens
+        '''
+        tokens = [token]
+        for plugin in self.plugins[first:]:
+            tokens = plugin.on_tokenize(shell, tokens, origin)
+            if not tokens:
+                return []
+        return tokens
+
+
 class Expression(object):
     '''
     Holds a string-based expression in the form of ``operand operator value``.
@@ -823,6 +1845,8 @@ class Expression(object):
     - ``some_var=2`` => ``['some_var=2']``
     '''
 
+    __slots__ = ('operand', 'operator', 'value')
+
     Operators = '-+=/*'
     Whitespace = ' \t'
 
@@ -45,7 +45,7 @@ class EchoCommand(Command):
         )
 
         super().__init__(
-            name=name, usage=self.parser.format_help(), topic=topic,
+            name=name, usage=self.parser.format_help, topic=topic,
             brief=brief, **kwargs
         )
 
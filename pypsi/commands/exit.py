@@ -40,7 +40,7 @@ class ExitCommand(Command):
         )
 
         super().__init__(
-            name=name, usage=self.parser.format_help(), topic=topic,
+            name=name, usage=self.parser.format_help, topic=topic,
             brief=brief, **kwargs
         )
 
@@ -52,7 +52,7 @@ class HelpCommand(Command):
         )
 
         super().__init__(
-            name=name, brief=brief, usage=self.parser.format_help(),
+            name=name, brief=brief, usage=self.parser.format_help,
             topic=topic, **kwargs
         )
 
@@ -180,7 +180,7 @@ class HelpCommand(Command):
     def print_topic(self, shell, id):
         if id not in shell.ctx.topic_lookup:
             if id in shell.commands:
-                cmd = shell.commands[id]
+                cmd = shell.get_command(id)
                 print(AnsiCodes.yellow, cmd.usage, AnsiCodes.reset, sep='')
                 return 0
 
@@ -47,7 +47,7 @@ class IncludeCommand(Command):
 
         super().__init__(
             name=name, topic=topic, brief=brief,
-            usage=self.parser.format_help(), **kwargs
+            usage=self.parser.format_help, **kwargs
         )
         self.stack = []
 
@@ -0,0 +1,186 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import sys
+from pypsi.core import Command, PypsiArgParser, CommandShortCircuit
+
+
+JobsCmdUsage = "%(prog)s [-h]"
+FgCmdUsage = "%(prog)s [-h] [JOB]"
+WaitCmdUsage = "%(prog)s [-h] [JOB [JOB ...]]"
+
+
+def get_job(cmd, shell, spec):
+    '''
+    Get a job from a job spec, which is either the job id or the job id
+    prefixed with ``%``.
+
+    :param pypsi.core.Command cmd: the command that referenced the job
+    :param pypsi.shell.Shell shell: the active shell
+    :param str spec: the job spec, or :const:`None` for the current job
+    :returns pypsi.jobs.Job: the job or :const:`None` if it does not exist, in
+        which case an error has been printed
+    '''
+    if spec is None:
+        job = shell.jobs.current()
+        if not job:
+            cmd.error(shell, "no current job")
+        return job
+
+    try:
+        job = shell.jobs.get(int(spec[1:] if spec.startswith('%') else spec))
+    except ValueError:
+        job = None
+
+    if not job:
+        cmd.error(shell, spec, ": no such job")
+    return job
+
+
+def collect_job(cmd, shell, job):
+    '''
+    Wait for a job to finish, print its captured output and remove it from
+    the shell's job table.
+
+    :param pypsi.core.Command cmd: the command that is collecting the job
+    :param pypsi.shell.Shell shell: the active shell
+    :param pypsi.jobs.Job job: the job
+    :returns int: the job's return code
+    '''
+    job.wait()
+    shell.jobs.remove(job)
+    if job.output:
+        sys.stdout.write(job.output)
+
+    if job.exc_info:
+        cmd.error(shell, "[", job.id, "] ", job.exc_info[1])
+        return -1
+    return job.rc
+
+
+class JobsCommand(Command):
+    '''
+    List the background jobs. Jobs that are done are removed once they are
+    listed.
+    '''
+
+    def __init__(self, name='jobs', topic='shell',
+                 brief='list the background jobs', **kwargs):
+        self.parser = PypsiArgParser(
+            prog=name,
+            description=brief,
+            usage=JobsCmdUsage
+        )
+
+        super().__init__(
+            name=name, usage=self.parser.format_help, topic=topic,
+            brief=brief, **kwargs
+        )
+
+    def run(self, shell, args):
+        try:
+            self.parser.parse_args(args)
+        except CommandShortCircuit as e:
+            return e.code
+
+        for job in shell.jobs:
+            state = job.state()
+            if job.done() and not job.exc_info:
+                state += "({})".format(job.rc)
+            print("[{}]  {:<12}{}".format(job.id, state, job.text))
+            if job.done():
+                shell.jobs.remove(job)
+        return 0
+
+
+class FgCommand(Command):
+    '''
+    Wait for a background job to finish and print its captured output.
+    '''
+
+    def __init__(self, name='fg', topic='shell',
+                 brief='wait for a background job', **kwargs):
+        self.parser = PypsiArgParser(
+            prog=name,
+            description=brief,
+            usage=FgCmdUsage
+        )
+
+        self.parser.add_argument(
+            'job', metavar='JOB', nargs='?',
+            help='job id, defaults to the current job'
+        )
+
+        super().__init__(
+            name=name, usage=self.parser.format_help, topic=topic,
+            brief=brief, **kwargs
+        )
+
+    def run(self, shell, args):
+        try:
+            ns = self.parser.parse_args(args)
+        except CommandShortCircuit as e:
+            return e.code
+
+        job = get_job(self, shell, ns.job)
+        if not job:
+            return 1
+
+        print(job.text)
+        return collect_job(self, shell, job)
+
+
+class WaitCommand(Command):
+    '''
+    Wait for background jobs to finish and print their captured output.
+    '''
+
+    def __init__(self, name='wait', topic='shell',
+                 brief='wait for background jobs', **kwargs):
+        self.parser = PypsiArgParser(
+            prog=name,
+            description=brief,
+            usage=WaitCmdUsage
+        )
+
+        self.parser.add_argument(
+            'jobs', metavar='JOB', nargs='*',
+            help='job ids, defaults to all jobs'
+        )
+
+        super().__init__(
+            name=name, usage=self.parser.format_help, topic=topic,
+            brief=brief, **kwargs
+        )
+
+    def run(self, shell, args):
+        try:
+            ns = self.parser.parse_args(args)
+        except CommandShortCircuit as e:
+            return e.code
+
+        if ns.jobs:
+            jobs = [get_job(self, shell, spec) for spec in ns.jobs]
+            if not all(jobs):
+                return 1
+        else:
+            jobs = list(shell.jobs)
+
+        rc = 0
+        for job in jobs:
+            rc = collect_job(self, shell, job)
+        return rc
@@ -15,9 +15,12 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
+import re
 import sys
 from pypsi.plugins.block import BlockCommand
 from pypsi.core import Command, PypsiArgParser, CommandShortCircuit
+from pypsi.cmdline import StatementParser, StatementSyntaxError
+from pypsi.plugins.variable import bind_vars
 from pypsi.format import Table, Column, title_str
 from pypsi.completers import command_completer
 
@@ -26,6 +29,74 @@ from pypsi.completers import command_completer
 # =>
 # something | cmd1 ; cmd2 | something
 
+class MacroPlan(object):
+    '''
+    A single macro statement that has been parsed once and can be executed
+    many times. While the statement is parsed, the positional argument
+    variables ``$1-9`` are bound to slot markers, which are replaced with the
+    macro's arguments each time the plan is bound.
+    '''
+
+    #: The values bound to the variables ``$1-9`` while parsing
+    Slots = tuple('\0{}\0'.format(i) for i in range(1, 10))
+    #: Matches a slot marker, the group is the argument number
+    SlotPattern = re.compile('\0([1-9])\0')
+
+    def __init__(self, text, key=None, statement=None, version=None):
+        '''
+        :param str text: the preprocessed statement
+        :param tuple key: the parsed statement cache key of the statement
+            (see :meth:`pypsi.shell.Shell.get_parse_cache_key`), or
+            :const:`None` if the statement can't be compiled
+        :param pypsi.cmdline.Statement statement: the parsed statement or
+            :const:`None` if the line did not contain a statement
+        :param int version: the version of the shell's variables when the
+            key was computed
+        '''
+        self.text = text
+        self.key = key
+        self.statement = statement
+        self.version = version
+
+    def bind_str(self, s, values):
+        if '\0' not in s:
+            return s
+        return self.SlotPattern.sub(lambda m: values[int(m.group(1)) - 1], s)
+
+    def bind(self, args):
+        '''
+        Create a new statement with the argument slots replaced.
+
+        :param list args: the macro arguments
+        :returns pypsi.cmdline.Statement: the bound statement
+        '''
+        values = list(args[:9])
+        values += [''] * (9 - len(values))
+
+        statement = self.statement.copy()
+        for invoke in statement:
+            invoke.name = self.bind_str(invoke.name, values)
+            invoke.args = [self.bind_str(arg, values) for arg in invoke.args]
+            for attr in ('stdout', 'stderr', 'stdin'):
+                value = getattr(invoke, attr)
+                if isinstance(value, tuple):
+                    value = (self.bind_str(value[0], values),) + value[1:]
+                elif isinstance(value, str):
+                    value = self.bind_str(value, values)
+                setattr(invoke, attr, value)
+        return statement
+
+    def execute(self, shell, args):
+        '''
+        Bind the arguments and execute the statement.
+
+        :returns int: the statement return code
+        '''
+        if not self.statement:
+            return None
+        return shell.execute_statement(self.bind(args))
+
+
 class Macro(Command):
     '''
     Recorded macro that executes statements sequentially. If the
@@ -41,23 +112,137 @@ class Macro(Command):
     - ``$2`` = "arg 2"
     - ``$3`` = "arg3"
 
-    Once the macro has finished executing, the variables are argument variables
-    are removed.
+    The argument variables are bound with
+    :func:`pypsi.plugins.variable.bind_vars`, so they are only visible to the
+    macro's statements and the shell's variables are not modified.
+
+    The macro body is preprocessed and compiled into a :class:`MacroPlan` per
+    statement the first time it runs and again whenever the shell's
+    :attr:`~pypsi.shell.Shell.parse_generation` changes, that is, when a
+    plugin is registered or an alias is changed. Running a compiled statement
+    binds the arguments directly into the parsed statement. Before a
+    statement is executed, and only if a shell variable has been modified
+    since, its parsed statement cache key is checked again and the statement
+    is parsed again if a variable that it references has changed, including
+    by an earlier statement of the macro. If a statement can not be compiled,
+    for example because it references a
+    :class:`~pypsi.plugins.variable.ManagedVariable`, it is executed through
+    :meth:`pypsi.shell.Shell.execute`.
     '''
 
     def __init__(self, lines, **kwargs):
         super().__init__(**kwargs)
         self.lines = lines
+        #: The compiled plan of each statement, see :meth:`compile`
+        self.plans = None
+        #: The shell's parse generation that :attr:`plans` were compiled in
+        self.generation = None
 
     def run(self, shell, args):
         rc = None
-        self.add_var_args(shell, args)
+        values = self.get_arg_vars(args)
+        for index, line in enumerate(self.lines):
+            if self.is_recording_block(shell):
+                # An earlier statement began a block, which records the
+                # remaining statements as input lines.
+                plan = MacroPlan(None)
+            else:
+                plan = self.get_plan(shell, index)
+
+            if plan.key is None:
+                with bind_vars(values):
+                    rc = shell.execute(line)
+            else:
+                rc = plan.execute(shell, args)
+        return rc
 
+    def get_arg_vars(self, args):
+        '''
+        Get the argument variables, ``$0-9``, of a macro call.
+
+        :param list args: the macro arguments
+        :returns dict: the variable values, by name
+        '''
+        values = {'0': self.name}
+        for i in range(9):
+            values[str(i + 1)] = args[i] if i < len(args) else ''
+        return values
+
+    def compile(self, shell):
+        '''
+        Preprocess and compile every statement of the macro body into
+        :attr:`plans`.
+        '''
+        generation = shell.parse_generation
+        plans = []
         for line in self.lines:
-            rc = shell.execute(line)
+            text = shell.preprocess(line, 'input')
+            plans.append(self.compile_text(shell, text))
+        self.plans = plans
+        self.generation = generation
+
+    def compile_text(self, shell, text):
+        '''
+        Compile a preprocessed statement with the argument variables bound to
+        the :attr:`MacroPlan.Slots`.
+
+        :param str text: the preprocessed statement
+        :returns MacroPlan: the compiled plan
+        '''
+        if text is None:
+            return MacroPlan(None)
+
+        version = self.get_vars_version(shell)
+        with bind_vars(self.get_arg_vars(MacroPlan.Slots)):
+            key = shell.get_parse_cache_key(text)
+            if key is None:
+                return MacroPlan(text)
+
+            parser = StatementParser(shell.features)
+            try:
+                tokens = shell.on_tokenize(parser.tokenize(text), 'input')
+                statement = parser.build(tokens) if tokens else None
+            except StatementSyntaxError:
+                return MacroPlan(text)
+
+        return MacroPlan(text, key, statement, version)
+
+    def get_plan(self, shell, index):
+        '''
+        Get the compiled plan of a statement, compiling the macro body if the
+        shell's parse generation has changed and compiling the statement
+        again if a variable that it references has changed. This must be
+        called right before the statement is executed.
+
+        :param int index: the statement's index in the macro body
+        :returns MacroPlan: the compiled plan
+        '''
+        if self.plans is None or self.generation != shell.parse_generation:
+            self.compile(shell)
+
+        plan = self.plans[index]
+        version = self.get_vars_version(shell)
+        if plan.key is None or plan.version == version:
+            return plan
+
+        with bind_vars(self.get_arg_vars(MacroPlan.Slots)):
+            key = shell.get_parse_cache_key(plan.text)
+
+        if key == plan.key:
+            plan.version = version
+        else:
+            plan = self.compile_text(shell, plan.text)
+            self.plans[index] = plan
+        return plan
 
-        self.remove_var_args(shell)
-        return rc
+    def get_vars_version(self, shell):
+        if 'vars' in shell.ctx:
+            return shell.ctx.vars._version  # pylint: disable=protected-access
+        return None
+
+    def is_recording_block(self, shell):
+        return ('recording_block' in shell.ctx and
+                shell.ctx.recording_block is not None)
 
     def add_var_args(self, shell, args):
         if 'vars' in shell.ctx:
@@ -115,7 +300,7 @@ class MacroCommand(BlockCommand):
         )
 
         super().__init__(
-            name=name, usage=self.parser.format_help(), brief=brief,
+            name=name, usage=self.parser.format_help, brief=brief,
             topic=topic, **kwargs
         )
         self.base_macros = macros or {}
@@ -242,8 +427,7 @@ class MacroCommand(BlockCommand):
         shell.eof_is_sigint = shell.ctx.macro_orig_eof_is_sigint
 
     def add_macro(self, shell, name, lines):
-        shell.register(
-            Macro(lines=lines, name=name, topic='__hidden__')
-        )
+        macro = Macro(lines=lines, name=name, topic='__hidden__')
+        shell.register(macro)
         shell.ctx.macros[name] = lines
         return 0
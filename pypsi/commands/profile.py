@@ -0,0 +1,176 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import argparse
+import cProfile
+import pstats
+import sys
+import threading
+from pypsi.core import Command, PypsiArgParser, CommandShortCircuit
+from pypsi.format import Table, Column
+
+
+ProfileCmdUsage = """{name} [-h] [-s SORTKEY] [-n COUNT] [-o FILE] STATEMENT"""
+
+
+class ThreadProfiler(object):
+    '''
+    Profiles functions that run on several threads at the same time. Each
+    call to :meth:`runcall` is profiled by a new :class:`cProfile.Profile`,
+    since a profile can only be enabled on one thread.
+    '''
+
+    def __init__(self):
+        #: The profiles of each call to :meth:`runcall`
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def runcall(self, func, *args, **kwargs):
+        '''
+        Profile a function call.
+
+        :param callable func: the function
+        :returns: the function's return value
+        '''
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        return profile.runcall(func, *args, **kwargs)
+
+    def stats(self):
+        '''
+        :returns pstats.Stats: the combined statistics of every call
+        '''
+        with self._lock:
+            profiles = list(self.profiles)
+        return pstats.Stats(*profiles, stream=sys.stdout)
+
+
+class ProfileCommand(Command):
+    '''
+    Execute a statement under :mod:`cProfile` and print the functions that
+    took the most time or save the statistics to a file that can be loaded
+    with :class:`pstats.Stats`. Pipe stages that run on threads are profiled
+    too, commands that run in worker processes are not.
+
+    A statement that contains operators, such as a pipe, must be quoted:
+    ``profile "cat data.txt | grep error"``.
+    '''
+
+    def __init__(self, name='profile', topic='shell',
+                 brief='profile the execution of a statement', **kwargs):
+        self.parser = PypsiArgParser(
+            prog=name,
+            description=brief,
+            usage=ProfileCmdUsage.format(name=name)
+        )
+
+        self.parser.add_argument(
+            '-s', '--sort', default='cumulative', metavar='SORTKEY',
+            choices=sorted(pstats.Stats.sort_arg_dict_default),
+            help='sort key of the printed statistics, defaults to cumulative'
+        )
+
+        self.parser.add_argument(
+            '-n', '--count', default=20, type=int, metavar='COUNT',
+            help='number of functions to print'
+        )
+
+        self.parser.add_argument(
+            '-o', '--output', metavar='FILE',
+            help='save the statistics to a file instead of printing them'
+        )
+
+        self.parser.add_argument(
+            'statement', nargs=argparse.REMAINDER, metavar='STATEMENT',
+            help='statement to profile'
+        )
+
+        super().__init__(
+            name=name, usage=self.parser.format_help, topic=topic,
+            brief=brief, **kwargs
+        )
+
+    def run(self, shell, args):
+        try:
+            ns = self.parser.parse_args(args)
+        except CommandShortCircuit as e:
+            return e.code
+
+        if not ns.statement:
+            self.error(shell, "missing statement")
+            return 1
+
+        if shell.pipe_profiler is not None:
+            self.error(shell, "a statement is already being profiled")
+            return 1
+
+        if len(ns.statement) == 1:
+            text = ns.statement[0]
+        else:
+            text = ' '.join([
+                '"{}"'.format(arg.replace('"', '\\"'))
+                if not arg or any(c.isspace() or c == '"' for c in arg)
+                else arg
+                for arg in ns.statement
+            ])
+
+        profiler = ThreadProfiler()
+        shell.pipe_profiler = profiler
+        try:
+            rc = profiler.runcall(shell.execute, text)
+        finally:
+            shell.pipe_profiler = None
+
+        stats = profiler.stats()
+        stats.sort_stats(ns.sort)
+        if ns.output:
+            try:
+                stats.dump_stats(ns.output)
+            except OSError as e:
+                self.error(shell, ns.output, ": ", e.strerror)
+                return 1
+        else:
+            self.print_stats(shell, stats, ns.count)
+
+        return rc or 0
+
+    def print_stats(self, shell, stats, count):
+        '''
+        Print the first entries of sorted statistics as a table.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param pstats.Stats stats: the sorted statistics
+        :param int count: the number of entries to print
+        '''
+        # pylint: disable=no-member
+        print(stats.total_calls, "function calls in",
+              "{:.3f}".format(stats.total_tt), "seconds")
+
+        table = Table(
+            columns=(
+                Column('ncalls'), Column('tottime'), Column('cumtime'),
+                Column('function', Column.Grow)
+            ),
+            width=shell.width
+        )
+        for func in stats.fcn_list[:count]:
+            cc, nc, tt, ct, _ = stats.stats[func]
+            calls = str(nc) if nc == cc else "{}/{}".format(nc, cc)
+            table.append(calls, "{:.4f}".format(tt), "{:.4f}".format(ct),
+                         pstats.func_std_string(func))
+        table.write(sys.stdout)
@@ -56,7 +56,7 @@ class TailCommand(Command):
         )
 
         super().__init__(
-            name=name, usage=self.parser.format_help(), topic=topic,
+            name=name, usage=self.parser.format_help, topic=topic,
             brief=brief, **kwargs
         )
 
@@ -44,7 +44,7 @@ class TipCommand(Command):
 
         super().__init__(
             name=name, brief=brief, topic=topic,
-            usage=self.parser.format_help(), **kwargs
+            usage=self.parser.format_help, **kwargs
         )
 
     def load_tips(self, path):
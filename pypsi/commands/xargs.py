@@ -15,17 +15,42 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
-import sys
 import argparse
+import collections
+import concurrent.futures
+import contextvars
+import io
+import itertools
+import os
+import sys
 from pypsi.core import Command, PypsiArgParser, CommandShortCircuit
+from pypsi.cmdline import (StatementParser, StatementSyntaxError, Statement,
+                           CommandInvocation)
+from pypsi.pipes import ThreadLocalStream
 
 
-XArgsUsage = """{name} [-h] [-I REPSTR] COMMAND"""
+XArgsUsage = """{name} [-h] [-I REPSTR] [-n MAX_ARGS] [-P MAX_PROCS] [-k] \
+COMMAND"""
 
 
 class XArgsCommand(Command):
     '''
     Execute a command for each line of input from :data:`sys.stdin`.
+
+    The command is parsed once and each invocation is built by replacing the
+    ``REPSTR`` token in the command's arguments with the input lines, without
+    parsing the command again. An argument that is exactly ``REPSTR`` is
+    replaced by one argument per input line and ``REPSTR`` inside a larger
+    argument is replaced by the input lines separated by spaces. If the
+    command does not contain ``REPSTR``, the input lines are appended to the
+    command's arguments. If the command is a single argument, such as
+    ``"echo line: {}"``, it is parsed as a statement.
+
+    The ``-n`` option passes up to ``MAX_ARGS`` lines to each invocation and
+    the ``-P`` option runs up to ``MAX_PROCS`` invocations at the same time.
+    When invocations run at the same time, their output is interleaved unless
+    the ``-k`` option is given, which writes each invocation's output in the
+    order of the input.
     '''
 
     def __init__(self, name='xargs', topic='shell',
@@ -42,13 +67,29 @@ class XArgsCommand(Command):
             dest='token'
         )
 
+        self.parser.add_argument(
+            '-n', '--max-args', default=1, type=int, metavar='MAX_ARGS',
+            help='number of input lines passed to each invocation'
+        )
+
+        self.parser.add_argument(
+            '-P', '--max-procs', default=1, type=int, metavar='MAX_PROCS',
+            help='number of invocations run at the same time, 0 uses the '
+                 'number of CPUs'
+        )
+
+        self.parser.add_argument(
+            '-k', '--keep-order', action='store_true',
+            help='write the output of invocations in the order of the input'
+        )
+
         self.parser.add_argument(
             'command', nargs=argparse.REMAINDER, help="command to execute",
             metavar='COMMAND'
         )
 
         super().__init__(
-            name=name, topic=topic, usage=self.parser.format_help(),
+            name=name, topic=topic, usage=self.parser.format_help,
             brief=brief, **kwargs
         )
 
@@ -62,12 +103,142 @@ class XArgsCommand(Command):
             self.error(shell, "missing command")
             return 1
 
-        base = ' '.join([
-            '"{}"'.format(c.replace('"', '\\"')) for c in ns.command
-        ])
+        if ns.max_args < 1:
+            self.error(shell, "MAX_ARGS must be greater than 0")
+            return 1
+
+        if ns.max_procs < 0:
+            self.error(shell, "MAX_PROCS must not be negative")
+            return 1
+
+        try:
+            template = self.compile(shell, ns.command)
+        except StatementSyntaxError as e:
+            self.error(shell, str(e))
+            return 1
+
+        if not template:
+            self.error(shell, "missing command")
+            return 1
+
+        lines = (line.strip() for line in iter(sys.stdin.readline, ''))
+        lines = (line for line in lines if line)
+        statements = (
+            self.bind(template, ns.token, batch)
+            for batch in iter(
+                lambda: list(itertools.islice(lines, ns.max_args)), []
+            )
+        )
+
+        procs = ns.max_procs or os.cpu_count() or 1
+        if procs == 1:
+            rcs = (shell.execute_statement(s) for s in statements)
+        else:
+            rcs = self.execute_parallel(shell, statements, procs,
+                                        ns.keep_order)
+
+        failed = False
+        for rc in rcs:
+            failed = failed or bool(rc)
+        # GNU xargs returns 123 when any invocation fails
+        return 123 if failed else 0
+
+    def compile(self, shell, command):
+        '''
+        Create the statement template for a command.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param list command: the command name and arguments
+        :returns pypsi.cmdline.Statement: the statement template
+        '''
+        if len(command) == 1 and len(command[0].split()) > 1:
+            parser = StatementParser(shell.features)
+            return parser.build(parser.tokenize(command[0]))
+        return Statement([CommandInvocation(command[0], list(command[1:]))])
+
+    def bind(self, template, token, items):
+        '''
+        Create a new statement from the template with the token replaced by
+        the input lines.
+
+        :param pypsi.cmdline.Statement template: the statement template
+        :param str token: the token to replace
+        :param list items: the input lines
+        :returns pypsi.cmdline.Statement: the statement to execute
+        '''
+        joined = None
+        replaced = False
+        statement = template.copy()
+        for invoke in statement:
+            args = []
+            for arg in [invoke.name] + invoke.args:
+                if arg == token:
+                    args.extend(items)
+                    replaced = True
+                elif token in arg:
+                    if joined is None:
+                        joined = ' '.join(items)
+                    args.append(arg.replace(token, joined))
+                    replaced = True
+                else:
+                    args.append(arg)
+            invoke.name, invoke.args = args[0], args[1:]
+
+        if not replaced:
+            statement[-1].args.extend(items)
+        return statement
+
+    def execute_parallel(self, shell, statements, procs, keep_order):
+        '''
+        Execute statements on a pool of threads.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param statements: the statements to execute
+        :param int procs: the number of statements to run at the same time
+        :param bool keep_order: whether to capture the output of each
+            statement and write it in the order of the statements
+        :returns: a generator that yields the return code of each statement
+        '''
+        stdout = sys.stdout
+        pending = collections.deque()
+
+        def execute(statement):
+            # pylint: disable=protected-access
+            if not keep_order or not isinstance(stdout, ThreadLocalStream):
+                return shell.execute_statement(statement), None
+
+            output = io.StringIO()
+            stdout._proxy(output)
+            try:
+                return shell.execute_statement(statement), output.getvalue()
+            finally:
+                stdout._unproxy()
+
+        def collect(future):
+            rc, output = future.result()
+            if output:
+                stdout.write(output)
+            return rc
+
+        with concurrent.futures.ThreadPoolExecutor(procs) as executor:
+            for statement in statements:
+                # Each invocation inherits the streams of this thread
+                context = contextvars.copy_context()
+                pending.append(executor.submit(context.run, execute,
+                                               statement))
 
-        for line in sys.stdin:
-            cmd = base.replace(ns.token, line.strip())
-            shell.execute(cmd)
+                # Bound the number of statements waiting to run
+                while len(pending) >= procs * 2:
+                    if keep_order:
+                        yield collect(pending.popleft())
+                    else:
+                        done, _ = concurrent.futures.wait(
+                            pending,
+                            return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            pending.remove(future)
+                            yield collect(future)
 
-        return 0
+            while pending:
+                yield collect(pending.popleft())
@@ -91,6 +91,59 @@ class Plugin(object):
         '''
         return tokens
 
+    def parse_cache_key(self, shell, line):  # pylint: disable=unused-argument
+        '''
+        Called before an input line is tokenized to build the shell's parsed
+        statement cache key. The returned value must be hashable and capture
+        all the state that :meth:`on_tokenize` depends on for the line, so
+        that a cached statement is only reused when this plugin would produce
+        the same tokens. Return :const:`None` if the output of
+        :meth:`on_tokenize` for the line can not be cached.
+
+        The default implementation returns an empty tuple if the plugin does
+        not override :meth:`on_tokenize` and :const:`None` otherwise.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param str line: the preprocessed input line
+        :returns: the hashable dependency key or :const:`None`
+        '''
+        if type(self).on_tokenize is Plugin.on_tokenize:
+            return ()
+        return None
+
+    def prompt_cache_key(self, shell, prompt):
+        '''
+        Called before the prompt is rendered to build the shell's rendered
+        prompt cache key. The returned value must be hashable and capture all
+        the state that :meth:`on_tokenize` depends on for the prompt, with an
+        origin of ``'prompt'``. Return :const:`None` if the prompt must be
+        rendered every time it is displayed.
+
+        The default implementation returns :meth:`parse_cache_key`.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param str prompt: the prompt template
+        :returns: the hashable dependency key or :const:`None`
+        '''
+        return self.parse_cache_key(shell, prompt)
+
+    def get_token_rules(self, shell):  # pylint: disable=unused-argument
+        '''
+        Get the rules that implement :meth:`on_tokenize` as rewrites of the
+        text of :class:`~pypsi.cmdline.StringToken` objects. When the shell is
+        created with ``fuse_token_rules=True``, the rules of consecutive
+        plugins are combined into a single
+        :class:`~pypsi.cmdline.TokenRewriter` stage that scans each token once
+        instead of calling each plugin's :meth:`on_tokenize`. The rules must
+        produce the same tokens as :meth:`on_tokenize`, which is still called
+        for tokens that the rules can't rewrite.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :returns list: the list of :class:`~pypsi.cmdline.TokenRule` objects
+            or :const:`None` if the plugin does not provide rules
+        '''
+        return None
+
     def on_input_canceled(self, shell):  # pylint: disable=unused-argument
         '''
         Called when the user can canceled entering a statement via SIGINT
@@ -110,6 +163,49 @@ class Plugin(object):
         '''
         return 0
 
+    def on_statement_timing(self, shell, timing):  # pylint: disable=unused-argument
+        '''
+        Called with the timing of each phase of a statement once it has been
+        executed by :meth:`pypsi.shell.Shell.execute`. Statements are only
+        timed when at least one registered plugin overrides this method, or
+        when :attr:`pypsi.shell.Shell.time_statements` is :const:`True`.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param pypsi.timing.StatementTiming timing: the statement timing
+        :returns int: 0 on success, -1 on error
+        '''
+        return 0
+
+    def on_invocation_start(self, shell, invoke):  # pylint: disable=unused-argument
+        '''
+        Called before a command invocation runs. Pipe stages run at the same
+        time, so this can be called concurrently from several threads. This
+        is only called if the plugin overrides :meth:`on_invocation_start` or
+        :meth:`on_invocation_end`.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        :returns int: 0 on success, -1 on error
+        '''
+        return 0
+
+    def on_invocation_end(self, shell, invoke, rc, elapsed, exc_info):  # pylint: disable=unused-argument,too-many-arguments
+        '''
+        Called once a command invocation has finished, on the same thread as
+        :meth:`on_invocation_start`, except for invocations that run in a
+        worker process.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        :param int rc: the invocation's return code, :const:`None` if it
+            raised an exception
+        :param float elapsed: the number of seconds the invocation ran for
+        :param tuple exc_info: the exception raised by the invocation, as
+            returned by :func:`sys.exc_info`, or :const:`None`
+        :returns int: 0 on success, -1 on error
+        '''
+        return 0
+
 
 class Command(object):
     '''
@@ -141,21 +237,57 @@ class Command(object):
     '''
 
     def __init__(self, name, usage=None, brief=None,
-                 topic=None, pipe='str'):
+                 topic=None, pipe='str', isolation='thread'):
         '''
         :param str name: the name of the command which the user will reference
             in the shell
-        :param str usage: the usage message to be displayed to the user
+        :param str usage: the usage message to be displayed to the user, or
+            a callable that returns the usage message, such as the
+            ``format_help`` method of the command's
+            :class:`PypsiArgParser`. The callable is called the first time
+            :attr:`usage` is accessed.
         :param str brief: a brief description of the command
         :param str topic: the topic that this command belongs to
         :param str pipe: the type of data that will be read from and written to
-            any pipes
+            any pipes, either ``'str'`` or ``'obj'``
+        :param str isolation: where the command runs when it is a pipe stage,
+            either ``'thread'`` or ``'process'``
         '''
         self.name = name
-        self.usage = usage or ''
+        self.usage = usage
         self.brief = brief or ''
         self.topic = topic or ''
+        #: The type of data that is read from and written to pipes. When two
+        #: adjacent commands in a pipe are both ``'obj'``, they are connected
+        #: by a :class:`~pypsi.pipes.ObjectPipe` and pass Python objects
+        #: directly, see :func:`~pypsi.pipes.write_object` and
+        #: :func:`~pypsi.pipes.read_objects`. Otherwise, they are connected by
+        #: a text pipe.
         self.pipe = pipe or 'str'
+        #: Where the command runs when it is executed in a pipe. ``'thread'``
+        #: commands run on a thread of the shell's process. ``'process'``
+        #: commands run in a :class:`~pypsi.pipes.PipeProcessPool` worker
+        #: process, so that CPU-bound commands can run in parallel. The
+        #: command is pickled, so changes it makes to itself are not seen by
+        #: the shell, and :meth:`run` is called with a ``shell`` of
+        #: :const:`None`.
+        self.isolation = isolation or 'thread'
+
+    @property
+    def usage(self):
+        '''
+        The usage message to be displayed to the user. If the command was
+        created with a usage callable, it is called the first time the usage
+        is accessed and the message is cached.
+        '''
+        usage = self._usage
+        if callable(usage):
+            usage = self._usage = usage() or ''
+        return usage
+
+    @usage.setter
+    def usage(self, value):
+        self._usage = value or ''
 
     def complete(self, shell, args, prefix):  # pylint: disable=unused-argument
         '''
@@ -195,6 +327,16 @@ class Command(object):
         '''
         Execute the command. All commands need to implement this method.
 
+        This method can also be a generator, in which case each yielded object
+        is written to stdout with :func:`~pypsi.pipes.write_object` and the
+        generator's return value is the return code, ``0`` by default.
+
+        This method can also be a coroutine function or an asynchronous
+        generator, which :class:`~pypsi.asyncshell.AsyncShell` runs on its
+        event loop, see :meth:`~pypsi.cmdline.CommandInvocation.call_async`.
+        Asynchronous commands should read stdin with
+        :func:`~pypsi.pipes.aread_objects` or :func:`~pypsi.pipes.areadline`.
+
         :param pypsi.shell.Shell shell: the active shell
         :param list args: list of string arguments
         :returns int: 0 on success, less than 0 on error, and greater than 0 on
@@ -388,7 +530,7 @@ class PypsiArgParser(argparse.ArgumentParser):
         self.exit(1)
 
 
-def pypsi_print(*args, sep=' ', end='\n', file=None, flush=True, width=None,
+def pypsi_print(*args, sep=' ', end='\n', file=None, flush=None, width=None,
                 wrap=True, wrap_prefix=None, replace_errors=True):
     '''
     Wraps the functionality of the Python builtin `print` function. The
@@ -399,7 +541,9 @@ def pypsi_print(*args, sep=' ', end='\n', file=None, flush=True, width=None,
     :param str end: string to print at the end of the output
     :param file file: output stream, if this is :const:`None`, the default is
         :data:`sys.stdout`
-    :param bool flush: whether to flush the output stream
+    :param bool flush: whether to flush the output stream, if this is
+        :const:`None` the stream is flushed unless it is a block buffered
+        :class:`~pypsi.pipes.BufferedStream`
     :param int width: override the stream's width
     :param bool wrap: whether to word wrap the output
     :param str wrap_prefix: prefix string to print prior to every new line that
@@ -409,7 +553,6 @@ def pypsi_print(*args, sep=' ', end='\n', file=None, flush=True, width=None,
     '''
 
     file = file or sys.stdout
-    last = len(args) - 1
 
     def write_safe(data):
         '''
@@ -442,34 +585,33 @@ def pypsi_print(*args, sep=' ', end='\n', file=None, flush=True, width=None,
             else:
                 parts.append(str(arg))
 
+        # Build the wrapped output and write it to the file at once
         txt = sep.join(parts)
+        out = []
         for (line, endl) in get_lines(txt):
             if line:
                 first = True
-                wrapno = 0
                 for wrapped in wrap_line(line, width, wrap_prefix=wrap_prefix):
                     if not wrapped:
                         continue
 
-                    wrapno += 1
                     if not first:
-                        file.write('\n')
+                        out.append('\n')
                     else:
                         first = False
 
-                    write_safe(wrapped)
+                    out.append(wrapped)
 
             if not line or endl:
-                file.write('\n')
-    else:
-        last = len(args) - 1
-        for (i, arg) in enumerate(args):
-            write_safe(str(arg))
+                out.append('\n')
 
-            if sep and i != last:
-                write_safe(sep)
+        if end:
+            out.append(end)
+        write_safe(''.join(out))
+    else:
+        txt = (sep or '').join(str(arg) for arg in args)
+        write_safe(txt + end if end else txt)
 
-    if end:
-        write_safe(end)
-    if flush:
+    if flush or (flush is None and
+                 getattr(file, 'buffering', None) != 'block'):
         file.flush()
@@ -16,13 +16,31 @@
 #
 
 
+#: Tokenize input one character at a time
+#: (:meth:`~pypsi.cmdline.StatementParser.process`).
+CharTokenizer = 'char'
+#: Tokenize input by scanning whole runs of characters with precompiled
+#: regular expressions (:meth:`~pypsi.cmdline.StatementParser.scan`).
+RegexTokenizer = 'regex'
+
+
 class PypsiFeatures(object):
 
-    def __init__(self, multiline=False, escape_char='\\'):
+    def __init__(self, multiline=False, escape_char='\\',
+                 tokenizer=CharTokenizer):
         self.multiline = multiline
         self.escape_char = escape_char
         self.eof_is_sigint = False
         self.preserve_quotes = False
+        self.tokenizer = tokenizer
+
+    def cache_key(self):
+        '''
+        :returns tuple: the feature values that affect how a statement is
+            parsed, used as part of the shell's parsed statement cache key
+        '''
+        return (self.multiline, self.escape_char, self.preserve_quotes,
+                self.tokenizer)
 
 
 def BashFeatures():
@@ -34,4 +52,5 @@ def PowerShellFeatures():
 
 
 def TabCompletionFeatures(features=None):
-    return PypsiFeatures(multiline=False, escape_char=features.escape_char)
+    return PypsiFeatures(multiline=False, escape_char=features.escape_char,
+                         tokenizer=features.tokenizer)
@@ -0,0 +1,225 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import asyncio
+import collections
+import io
+import sys
+import threading
+from pypsi.pipes import ThreadLocalStream
+
+
+class Job(object):
+    '''
+    A statement that is running in the background, started with the ``&``
+    operator.
+    '''
+
+    def __init__(self, id, text):
+        '''
+        :param int id: the job id
+        :param str text: the statement being executed
+        '''
+        #: The job id, which is referenced as ``%id`` by the job commands
+        self.id = id
+        #: The statement being executed
+        self.text = text
+        #: The statement's return code, once the job is done
+        self.rc = None
+        #: Exception info, as returned by :meth:`sys.exc_info` if an exception
+        #: occurred.
+        self.exc_info = None
+        #: The statement's output, if :attr:`JobTable.capture_output` was
+        #: enabled when the job started, otherwise :const:`None`
+        self.output = None
+        #: The :class:`asyncio.Task` running the statement, if it was started
+        #: with :meth:`JobTable.start_async`
+        self.task = None
+        self._done = threading.Event()
+
+    def finish(self, rc=None, exc_info=None, output=None):
+        '''
+        Mark the job as done.
+
+        :param int rc: the statement's return code
+        :param tuple exc_info: the exception raised by the statement, if any
+        :param str output: the statement's captured output
+        '''
+        self.rc = rc
+        self.exc_info = exc_info
+        self.output = output
+        self._done.set()
+
+    def done(self):
+        '''
+        :returns bool: whether the job has finished
+        '''
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        Wait for the job to finish.
+
+        :param float timeout: the maximum number of seconds to wait
+        :returns bool: whether the job has finished
+        '''
+        return self._done.wait(timeout)
+
+    def state(self):
+        '''
+        :returns str: ``'Running'``, ``'Done'`` or, if the job raised an
+            exception, ``'Failed'``
+        '''
+        if not self.done():
+            return 'Running'
+        return 'Failed' if self.exc_info else 'Done'
+
+
+class JobTable(object):
+    '''
+    The background jobs of a shell, see :attr:`pypsi.shell.Shell.jobs`. Jobs
+    are kept in the table once they are done, so that their return code and
+    output can be collected, until they are removed with :meth:`remove`.
+    '''
+
+    def __init__(self, capture_output=False):
+        '''
+        :param bool capture_output: whether to capture the output of jobs,
+            see :attr:`Job.output`
+        '''
+        #: Whether the stdout and stderr of new jobs are captured, instead of
+        #: being written to the shell's streams
+        self.capture_output = capture_output
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, text):
+        '''
+        Add a new job. The job's id is one greater than the largest id in the
+        table.
+
+        :param str text: the statement being executed
+        :returns Job: the new job
+        '''
+        with self._lock:
+            job_id = max(self._jobs, default=0) + 1
+            job = self._jobs[job_id] = Job(job_id, text)
+        return job
+
+    def start(self, shell, statement):
+        '''
+        Execute a statement on a new thread. The statement must not contain
+        the background operator, see
+        :meth:`~pypsi.cmdline.Statement.split_background`.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :param pypsi.cmdline.Statement statement: the statement to execute,
+            its command invocations must not have been setup yet
+        :returns Job: the new job
+        '''
+        job = self.add(str(statement) + " &")
+        output = io.StringIO() if self.capture_output else None
+
+        def run():
+            _capture(output)
+            rc = exc_info = None
+            try:
+                rc = shell.execute_statement(statement)
+            except BaseException:
+                exc_info = sys.exc_info()
+            finally:
+                _release(output)
+                job.finish(rc, exc_info, output and output.getvalue())
+
+        threading.Thread(target=run, daemon=True).start()
+        return job
+
+    def start_async(self, shell, statement):
+        '''
+        Execute a statement as a task on the running :mod:`asyncio` event
+        loop, see :meth:`pypsi.asyncshell.AsyncShell.execute_statement_async`.
+        The statement must not contain the background operator.
+
+        :param pypsi.asyncshell.AsyncShell shell: the active shell
+        :param pypsi.cmdline.Statement statement: the statement to execute,
+            its command invocations must not have been setup yet
+        :returns Job: the new job
+        '''
+        job = self.add(str(statement) + " &")
+        output = io.StringIO() if self.capture_output else None
+
+        async def run():
+            # The task runs in its own context, so the captured streams are
+            # local to the job.
+            _capture(output)
+            rc = exc_info = None
+            try:
+                rc = await shell.execute_statement_async(statement)
+            except BaseException:
+                exc_info = sys.exc_info()
+            finally:
+                _release(output)
+                job.finish(rc, exc_info, output and output.getvalue())
+
+        job.task = asyncio.ensure_future(run())
+        return job
+
+    def get(self, job_id):
+        '''
+        :param int job_id: the job id
+        :returns Job: the job, or :const:`None` if it does not exist
+        '''
+        return self._jobs.get(job_id)
+
+    def current(self):
+        '''
+        :returns Job: the most recently started job, or :const:`None` if the
+            table is empty
+        '''
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def remove(self, job):
+        '''
+        Remove a job from the table.
+
+        :param Job job: the job
+        '''
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._jobs.values()))
+
+    def __len__(self):
+        return len(self._jobs)
+
+
+def _capture(output):
+    # Redirect stdout and stderr of the current thread or task
+    if output is not None:
+        for stream in (sys.stdout, sys.stderr):
+            if isinstance(stream, ThreadLocalStream):
+                stream._proxy(output)  # pylint: disable=protected-access
+
+
+def _release(output):
+    if output is not None:
+        for stream in (sys.stdout, sys.stderr):
+            if isinstance(stream, ThreadLocalStream):
+                stream._unproxy()  # pylint: disable=protected-access
@@ -0,0 +1,202 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+'''
+Lazy command registration. A :class:`LazyCommand` is a lightweight stub that
+is registered in place of a command, so that the command's module is only
+imported, and the command created, the first time it is used.
+'''
+
+import importlib
+import threading
+from pypsi.core import Command
+
+try:
+    from importlib import metadata
+except ImportError:
+    # Python 3.7
+    import importlib_metadata as metadata
+
+
+#: The entry point group that :func:`discover_commands` searches by default
+DefaultEntryPointGroup = 'pypsi.commands'
+
+
+class LazyCommand(Command):
+    '''
+    A stub for a command that is loaded the first time it is executed, tab
+    completed or its usage is requested. Once loaded, the command is setup
+    for a shell and replaces the stub in the shell's command table the first
+    time the shell uses it, see :meth:`resolve` and
+    :meth:`pypsi.shell.Shell.get_command`. The stub only holds the command's
+    name, brief description and topic, so that the command can be listed and
+    tab completed by name without loading it.
+
+    .. code-block:: python
+
+        class MyShell(Shell):
+            tail = LazyCommand('pypsi.commands.tail:TailCommand', 'tail',
+                               brief='display the last lines of a file',
+                               topic='shell')
+    '''
+
+    def __init__(self, target, name, brief=None, topic=None, **kwargs):
+        '''
+        :param target: the command to load, either a ``module:attribute``
+            string, an entry point, a command class or a callable that
+            returns the command
+        :param str name: the name of the command
+        :param str brief: a brief description of the command, :const:`None`
+            loads the command to retrieve it
+        :param str topic: the topic that this command belongs to,
+            :const:`None` loads the command to retrieve it
+        :param kwargs: additional keyword arguments for the command's
+            constructor
+        '''
+        super().__init__(name=name)
+        #: The command to load
+        self.target = target
+        self.kwargs = kwargs
+        self._brief = brief
+        self._topic = topic
+        self._command = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        '''
+        Whether the command has been loaded.
+        '''
+        return self._command is not None
+
+    @property
+    def brief(self):
+        return self._brief if self._brief is not None else self.load().brief
+
+    @brief.setter
+    def brief(self, value):
+        self._brief = value
+
+    @property
+    def topic(self):
+        return self._topic if self._topic is not None else self.load().topic
+
+    @topic.setter
+    def topic(self, value):
+        self._topic = value
+
+    @property
+    def usage(self):
+        return self.load().usage
+
+    @usage.setter
+    def usage(self, value):
+        # The usage always comes from the loaded command
+        pass
+
+    def load(self):
+        '''
+        Import and create the command, if it hasn't been loaded yet.
+
+        :returns pypsi.core.Command: the command
+        '''
+        if self._command is not None:
+            return self._command
+
+        with self._lock:
+            if self._command is None:
+                self._command = self.create()
+        return self._command
+
+    def create(self):
+        '''
+        Create the command from :attr:`target`.
+
+        :returns pypsi.core.Command: the new command
+        '''
+        target = self.target
+        if isinstance(target, str):
+            module_name, _, attr = target.partition(':')
+            target = getattr(importlib.import_module(module_name), attr)
+        elif not callable(target) and hasattr(target, 'load'):
+            # importlib.metadata.EntryPoint
+            target = target.load()
+
+        if isinstance(target, Command):
+            return target
+        return target(name=self.name, **self.kwargs)
+
+    def resolve(self, shell):
+        '''
+        Load the command and, if the stub is still registered to the shell,
+        setup the command for the shell and replace the stub in the shell's
+        command table. The stub does not hold a reference to the shells that
+        it is registered to, so a shell that has been discarded is never
+        setup.
+
+        :param pypsi.shell.Shell shell: the active shell
+        :returns pypsi.core.Command: the command
+        '''
+        cmd = self.load()
+        with self._lock:
+            if shell.commands.get(self.name) is self:
+                cmd.setup(shell)
+                shell.commands[self.name] = cmd
+        return cmd
+
+    def setup(self, shell):
+        if self._command is not None:
+            self.resolve(shell)
+        return 0
+
+    def run(self, shell, args):
+        return self.resolve(shell).run(shell, args)
+
+    def complete(self, shell, args, prefix):
+        return self.resolve(shell).complete(shell, args, prefix)
+
+    def fallback(self, shell, name, args):
+        return self.resolve(shell).fallback(shell, name, args)
+
+
+def discover_commands(group=DefaultEntryPointGroup):
+    '''
+    Find the commands that installed packages provide through entry points,
+    without importing them. Each entry point's name is the command name and
+    its value references the command class, for example in ``setup.py``:
+
+    .. code-block:: python
+
+        entry_points={
+            'pypsi.commands': ['tail = mypackage.commands:TailCommand']
+        }
+
+    The returned stubs can be registered with
+    :meth:`pypsi.shell.Shell.register_many`. Listing the commands with the
+    help command loads them, since their brief description and topic are
+    only known once they are loaded.
+
+    :param str group: the entry point group
+    :returns list[LazyCommand]: a stub for every entry point in the group
+    '''
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        entry_points = entry_points.select(group=group)
+    else:
+        # Python < 3.10
+        entry_points = entry_points.get(group, ())
+
+    return [LazyCommand(ep, ep.name) for ep in entry_points]
@@ -57,6 +57,7 @@ class ScopedNamespaceContext(object):
         self.case_sensitive = case_sensitive
         self.locals = locals
         self.parent = parent
+        self.version = 0
 
 
 class ScopedNamespace(object):
@@ -112,6 +113,7 @@ class ScopedNamespace(object):
                 name = name.lower()
 
             ctx.locals[name] = value
+            ctx.version += 1
 
     def __getitem__(self, name):
         return self.__getattribute__(name)
@@ -125,6 +127,7 @@ class ScopedNamespace(object):
             name = name.lower()
 
         del ctx.locals[name]
+        ctx.version += 1
 
     def __delitem__(self, name):
         self.__delattr__(name)
@@ -137,3 +140,11 @@ class ScopedNamespace(object):
 
     def __iter__(self):
         return iter(self._ctx.locals)
+
+    @property
+    def _version(self):
+        '''
+        The number of times an attribute has been set or deleted. This can be
+        used to detect if any attribute has changed.
+        '''
+        return self._ctx.version
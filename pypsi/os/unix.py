@@ -35,6 +35,11 @@ class UnixAnsiStream(object):
         self._stream = stream
         self.width = width
         self._isatty = isatty
+        # Bind the stream's write methods directly to skip __getattr__
+        for name in ('write', 'flush'):
+            method = getattr(stream, name, None)
+            if method is not None:
+                setattr(self, name, method)
 
     def isatty(self):
         return self._stream.isatty() if self._isatty is None else self._isatty
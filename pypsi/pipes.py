@@ -16,7 +16,19 @@
 #
 
 
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import errno
+import functools
+import io
+import multiprocessing
+import multiprocessing.reduction
+import os
+import queue
 import threading
+import time
 import sys
 from pypsi.ansi import AnsiCode, AnsiCodes
 from pypsi.os import make_ansi_stream
@@ -29,6 +41,10 @@ class ThreadLocalStream(object):
     :attr:`sys.stdin` and making access to them thread-local. This allows each
     thread to, potentially, each thread to write to a different stream.
 
+    Proxies are stored in a :class:`contextvars.ContextVar`, so they are also
+    local to each :mod:`asyncio` task, which allows concurrent statements
+    running on a single event loop to write to different streams.
+
     A single stream, such as stdout, is wrapped in Pypsi as such:
 
     stdout -> thread local stream -> os-specific ansi stream
@@ -52,7 +68,7 @@ class ThreadLocalStream(object):
             kwargs = kw
 
         self._target = make_ansi_stream(target, **kwargs)
-        self._proxies = {}
+        self._proxies = contextvars.ContextVar('pypsi_stream', default=None)
 
     def _get_target(self):
         '''
@@ -61,14 +77,30 @@ class ThreadLocalStream(object):
         :returns tuple: (target, width, isatty).
         '''
 
-        return self._proxies.get(threading.current_thread().ident,
-                                 self._target)
+        target = self._proxies.get()
+        return self._target if target is None else target
 
     def __getattr__(self, name):
         return getattr(self._get_target(), name)
 
+    # write(), flush() and isatty() are called for every print() so they are
+    # defined directly, rather than being resolved through __getattr__.
+
+    def write(self, s):
+        target = self._proxies.get()
+        return (self._target if target is None else target).write(s)
+
+    def flush(self):
+        target = self._proxies.get()
+        return (self._target if target is None else target).flush()
+
+    def isatty(self):
+        target = self._proxies.get()
+        return (self._target if target is None else target).isatty()
+
     def __hasattr__(self, name):
-        attrs = ('_proxy', '_unproxy', '_get_target', '_proxies', '_target')
+        attrs = ('_proxy', '_unproxy', '_get_target', '_proxies', '_target',
+                 'write', 'flush', 'isatty')
         return name in attrs or hasattr(self._get_target(), name)
 
     def _proxy(self, target, **kwargs):
@@ -80,22 +112,21 @@ class ThreadLocalStream(object):
         :param bool isatty: whether the target stream is a tty stream.
         '''
 
-        self._proxies[threading.current_thread().ident] = make_ansi_stream(
-            target, **kwargs
-        )
+        self._proxies.set(make_ansi_stream(target, **kwargs))
 
     def _unproxy(self, ident=None):
         '''
-        Delete the proxy for a thread.
+        Delete the proxy for the current thread or task.
 
-        :param int ident: the thread's :attr:`~threading.Thread.ident`
-            attribute, or :const:`None` if the current thread's  proxy is being
-            deleted.
+        :param int ident: kept for backwards compatibility, proxies are
+            local to a context and the proxy of another thread can not be
+            deleted, so this is only accepted if it is :const:`None` or the
+            current thread's :attr:`~threading.Thread.ident`. The proxy is
+            not deleted otherwise.
         '''
 
-        ident = ident or threading.current_thread().ident
-        if ident in self._proxies:
-            del self._proxies[ident]
+        if ident is None or ident == threading.get_ident():
+            self._proxies.set(None)
 
     def ansi_format(self, tmpl, **kwargs):
         '''
@@ -168,6 +199,128 @@ class ThreadLocalStream(object):
         return ''.join(r)
 
 
+class BufferedStream(object):
+    '''
+    A write-coalescing buffer in front of an output stream. Writes are
+    collected in memory and written to the target stream as a single string
+    once the buffer is full or, for a line buffered stream, once a newline is
+    written. Command invocations write stdout through a buffered stream, see
+    :meth:`pypsi.cmdline.CommandInvocation.setup_io`, which is flushed when
+    the invocation finishes. A buffered stream can be shared by several
+    threads, such as the invocations run by ``xargs -P``, writes and flushes
+    are serialized by a lock.
+
+    The buffering policy is one of:
+
+    - ``'line'``: flush at every newline, the default for tty streams.
+    - ``'block'``: flush once :attr:`buffer_size` characters are buffered,
+      the default for files and pipes. :func:`pypsi.core.pypsi_print` does
+      not flush block buffered streams unless it is asked to explicitly.
+    - ``'auto'``: ``'line'`` if the target is a tty, otherwise ``'block'``.
+    - ``'none'``: do not buffer, see :meth:`wrap`.
+    '''
+
+    #: The buffering policy of new buffered streams
+    DefaultBuffering = 'auto'
+    #: The default buffer size, in characters
+    DefaultBufferSize = io.DEFAULT_BUFFER_SIZE
+
+    def __init__(self, stream, buffering=None, buffer_size=None):
+        '''
+        :param file stream: the target stream
+        :param str buffering: the buffering policy, defaults to
+            :attr:`DefaultBuffering`
+        :param int buffer_size: the buffer size, in characters, defaults to
+            :attr:`DefaultBufferSize`
+        '''
+        buffering = buffering or BufferedStream.DefaultBuffering
+        if buffering == 'auto':
+            try:
+                buffering = 'line' if stream.isatty() else 'block'
+            except (AttributeError, ValueError):
+                buffering = 'block'
+
+        #: The target stream
+        self.stream = stream
+        #: The buffering policy, either ``'line'`` or ``'block'``
+        self.buffering = buffering
+        #: The number of buffered characters that triggers a flush
+        self.buffer_size = buffer_size or BufferedStream.DefaultBufferSize
+        #: The number of characters written to the target stream
+        self.written = 0
+        self._parts = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def wrap(cls, stream, buffering=None):
+        '''
+        Create a buffered stream for a stream, unless buffering is disabled
+        or the stream is an object pipe.
+
+        :param file stream: the target stream
+        :param str buffering: the buffering policy, defaults to
+            :attr:`DefaultBuffering`
+        :returns: the buffered stream or, if the stream is not buffered, the
+            original stream
+        '''
+        buffering = buffering or cls.DefaultBuffering
+        if buffering == 'none' or isinstance(stream, (cls, ObjectPipeWriter)):
+            return stream
+        return cls(stream, buffering)
+
+    def write(self, data):
+        with self._lock:
+            self._parts.append(data)
+            self._size += len(data)
+            if self._size >= self.buffer_size or (
+                    self.buffering == 'line' and '\n' in data):
+                self._flush()
+        return len(data)
+
+    def flush(self):
+        '''
+        Write the buffered data to the target stream and flush it.
+        '''
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # The lock must be held
+        if self._parts:
+            data = ''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            self.stream.write(data)
+            self.written += len(data)
+        self.stream.flush()
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_pipe_stage(shell, invoke):
+    '''
+    Run a pipe stage in the current thread. If the shell has a
+    :attr:`~pypsi.shell.Shell.pipe_profiler`, the stage is run with its
+    ``runcall()`` method. The shell's invocation hooks are called, see
+    :meth:`~pypsi.shell.Shell.call_invocation`.
+
+    :param pypsi.shell.Shell shell: the active shell
+    :param pypsi.cmdline.CommandInvocation invoke: the invocation to run
+    :returns int: the invocation's return code
+    '''
+    profiler = getattr(shell, 'pipe_profiler', None)
+    run = invoke if profiler is None else functools.partial(profiler.runcall,
+                                                            invoke)
+    if getattr(shell, 'invocation_plugins', None):
+        return shell.call_invocation(invoke, run, shell)
+    return run(shell)
+
+
 class InvocationThread(threading.Thread):
     '''
     An invocation of a command from the command line interface.
@@ -193,6 +346,8 @@ class InvocationThread(threading.Thread):
         self.exc_info = None
         #: The invocation return code.
         self.rc = None
+        #: Seconds the invocation ran for, once it has finished.
+        self.elapsed = None
 
         if stdin:
             self.invoke.stdin = stdin
@@ -206,13 +361,14 @@ class InvocationThread(threading.Thread):
         Run the command invocation.
         '''
 
+        start = time.perf_counter()
         try:
-            self.rc = self.invoke(self.shell)
+            self.rc = run_pipe_stage(self.shell, self.invoke)
         except:
             self.exc_info = sys.exc_info()
             self.rc = None
         finally:
-            pass
+            self.elapsed = time.perf_counter() - start
 
     def stop(self):
         '''
@@ -225,3 +381,1040 @@ class InvocationThread(threading.Thread):
                 self.invoke.close_streams()
             except:
                 pass
+
+
+class PooledInvocation(object):
+    '''
+    An invocation of a command that runs on a :class:`PipeWorkerPool` worker
+    thread. This class has the same interface as :class:`InvocationThread`.
+    '''
+
+    def __init__(self, pool, shell, invoke, stdin=None, stdout=None,
+                 stderr=None):
+        '''
+        :param PipeWorkerPool pool: the pool that runs the invocation.
+        :param pypsi.shell.Shell shell: the active shell.
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation to
+            execute.
+        :param stream stdin: override the invocation's stdin stream.
+        :param stream stdout: override the invocation's stdout stream.
+        :param stream stderr; override the invocation's stder stream.
+        '''
+        self.pool = pool
+        #: The active Shell
+        self.shell = shell
+        #: The :class:`~pypsi.cmdline.CommandInvocation` to execute.
+        self.invoke = invoke
+        #: Exception info, as returned by :meth:`sys.exc_info` if an exception
+        #: occurred.
+        self.exc_info = None
+        #: The invocation return code.
+        self.rc = None
+        #: Seconds the invocation ran for, once it has finished.
+        self.elapsed = None
+        self._started = False
+        self._done = threading.Event()
+
+        if stdin:
+            self.invoke.stdin = stdin
+        if stdout:
+            self.invoke.stdout = stdout
+        if stderr:
+            self.invoke.stderr = stderr
+
+    def start(self):
+        '''
+        Submit the invocation to the pool.
+        '''
+        self._started = True
+        self.pool.submit(self.run)
+
+    def run(self):
+        '''
+        Run the command invocation.
+        '''
+        start = time.perf_counter()
+        try:
+            self.rc = run_pipe_stage(self.shell, self.invoke)
+        except:
+            self.exc_info = sys.exc_info()
+            self.rc = None
+        finally:
+            self.elapsed = time.perf_counter() - start
+            self._done.set()
+
+    def is_alive(self):
+        return self._started and not self._done.is_set()
+
+    def join(self, timeout=None):
+        if self._started:
+            self._done.wait(timeout)
+
+    def stop(self):
+        '''
+        Attempt to stop the invocation by explitily closing the stdin, stdout,
+        and stderr streams.
+        '''
+        if self.is_alive():
+            try:
+                self.invoke.close_streams()
+            except:
+                pass
+
+
+class PipeWorkerPool(object):
+    '''
+    A pool of reusable worker threads that run pipe stages, so that a thread
+    isn't created and destroyed for every stage of every pipe. Every stage of
+    a pipe must run at the same time, so a task is never queued: when all
+    :attr:`max_workers` workers are busy, the task runs on a new thread that
+    is not kept in the pool. Workers that are idle for :attr:`idle_timeout`
+    seconds exit.
+    '''
+
+    def __init__(self, max_workers=8, idle_timeout=60.0):
+        '''
+        :param int max_workers: the maximum number of worker threads kept in
+            the pool
+        :param float idle_timeout: the number of seconds that an idle worker
+            waits for a task before it exits
+        '''
+        #: The maximum number of worker threads
+        self.max_workers = max_workers
+        #: Seconds an idle worker waits for a task before it exits
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = []
+        self._workers = 0
+        self._busy = 0
+        self._peak_busy = 0
+        self._submitted = 0
+        self._reused = 0
+        self._overflow = 0
+
+    def submit(self, task):
+        '''
+        Run a task on a worker thread.
+
+        :param callable task: the function to call, which must not raise an
+            exception
+        '''
+        with self._lock:
+            self._submitted += 1
+            if self._idle:
+                worker = self._idle.pop()
+                self._reused += 1
+            elif self._workers < self.max_workers:
+                worker = self._spawn()
+            else:
+                worker = None
+                self._overflow += 1
+
+            if worker is not None:
+                self._busy += 1
+                self._peak_busy = max(self._peak_busy, self._busy)
+                worker.tasks.put(task)
+
+        if worker is None:
+            threading.Thread(target=task, daemon=True).start()
+
+    def _spawn(self):
+        # The lock must be held
+        worker = _PipeWorker(self)
+        self._workers += 1
+        worker.start()
+        return worker
+
+    def _work(self, worker):
+        while True:
+            try:
+                task = worker.tasks.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if worker in self._idle:
+                        self._idle.remove(worker)
+                        self._workers -= 1
+                        return
+                # A task was submitted while the timeout expired
+                continue
+
+            try:
+                task()
+            finally:
+                # A reused worker must not write to the previous task's
+                # streams.
+                for stream in (sys.stdout, sys.stderr, sys.stdin):
+                    if isinstance(stream, ThreadLocalStream):
+                        stream._unproxy()  # pylint: disable=protected-access
+
+                with self._lock:
+                    self._busy -= 1
+                    self._idle.append(worker)
+
+    def stats(self):
+        '''
+        Get the pool's usage statistics.
+
+        :returns dict: ``max_workers``, ``workers`` (threads in the pool),
+            ``busy`` and ``idle`` workers, ``peak_busy`` (the maximum number
+            of busy workers), ``submitted`` tasks, ``reused`` (tasks that ran
+            on an existing worker), ``overflow`` (tasks that ran on a new
+            thread because the pool was saturated) and ``saturation`` (busy
+            workers as a fraction of ``max_workers``)
+        '''
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'workers': self._workers,
+                'busy': self._busy,
+                'idle': len(self._idle),
+                'peak_busy': self._peak_busy,
+                'submitted': self._submitted,
+                'reused': self._reused,
+                'overflow': self._overflow,
+                'saturation': (self._busy / self.max_workers
+                               if self.max_workers else 1.0)
+            }
+
+
+class _PipeWorker(threading.Thread):
+    # A worker thread of a PipeWorkerPool
+
+    def __init__(self, pool):
+        super().__init__(daemon=True)
+        self.pool = pool
+        self.tasks = queue.SimpleQueue()
+
+    def run(self):
+        self.pool._work(self)  # pylint: disable=protected-access
+
+
+class ProcessInvocation(object):
+    '''
+    An invocation of a command that runs in a :class:`PipeProcessPool` worker
+    process, so that CPU-bound pipe stages are not limited by the GIL. This
+    class has the same interface as :class:`InvocationThread`.
+
+    The invocation's streams are passed to the worker process as file
+    descriptors. Streams that are not backed by a file descriptor, such as
+    an :class:`ObjectPipe`, are relayed through an OS pipe by a thread. If
+    the invocation's stdin is not redirected the command reads nothing, and
+    if its stdout or stderr is not redirected it writes to the shell's
+    current stream.
+    '''
+
+    def __init__(self, pool, shell, invoke, stdin=None, stdout=None,
+                 stderr=None):
+        '''
+        :param PipeProcessPool pool: the pool that runs the invocation, a
+            worker must have been reserved with
+            :meth:`PipeProcessPool.acquire`.
+        :param pypsi.shell.Shell shell: the active shell.
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation to
+            execute.
+        :param stream stdin: override the invocation's stdin stream.
+        :param stream stdout: override the invocation's stdout stream.
+        :param stream stderr; override the invocation's stder stream.
+        '''
+        self.pool = pool
+        #: The active Shell
+        self.shell = shell
+        #: The :class:`~pypsi.cmdline.CommandInvocation` to execute.
+        self.invoke = invoke
+        #: Exception info, as returned by :meth:`sys.exc_info` if an exception
+        #: occurred.
+        self.exc_info = None
+        #: The invocation return code.
+        self.rc = None
+        #: Seconds the invocation ran for, once it has finished.
+        self.elapsed = None
+        self._started = False
+        self._start_time = None
+        self._future = None
+        self._relays = []
+        self._done = threading.Event()
+
+        if stdin:
+            self.invoke.stdin = stdin
+        if stdout:
+            self.invoke.stdout = stdout
+        if stderr:
+            self.invoke.stderr = stderr
+
+    def start(self):
+        '''
+        Submit the invocation to the pool.
+        '''
+        self._started = True
+        self._start_time = time.perf_counter()
+        if self.shell.invocation_plugins:
+            self.shell.on_invocation_start(self.invoke)
+        try:
+            shared = (self.invoke.stderr is not None and
+                      self.invoke.stderr is self.invoke.stdout)
+            stdin = self._pass_input(self.invoke.stdin)
+            stdout = self._pass_output(self.invoke.stdout, sys.stdout)
+            if shared:
+                stderr = stdout
+            else:
+                stderr = self._pass_output(self.invoke.stderr, sys.stderr)
+
+            self._future = self.pool.submit(
+                run_isolated, self.invoke.cmd, self.invoke.name,
+                self.invoke.args, stdin, stdout, stderr
+            )
+        except:
+            self.exc_info = sys.exc_info()
+            self._finish()
+        else:
+            self._future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        try:
+            self.rc = future.result()
+        except BaseException as e:
+            self.exc_info = (type(e), e, e.__traceback__)
+            self.rc = None
+        finally:
+            self._finish()
+
+    def _finish(self):
+        self.elapsed = time.perf_counter() - self._start_time
+        self.pool.release()
+        try:
+            if self.shell.invocation_plugins:
+                self.shell.on_invocation_end(self.invoke, self.rc,
+                                             self.elapsed, self.exc_info)
+        finally:
+            self._done.set()
+
+    def _pass_input(self, stream):
+        # Get the file descriptor that the worker process reads from
+        if stream is None:
+            return None
+
+        fd = _get_fileno(stream)
+        if fd is not None:
+            dup = multiprocessing.reduction.DupFd(fd)
+            stream.close()
+            return dup
+
+        r, w = os.pipe()
+        dup = multiprocessing.reduction.DupFd(r)
+        os.close(r)
+        self._relay(stream, os.fdopen(w, 'w'))
+        return dup
+
+    def _pass_output(self, stream, default):
+        # Get the file descriptor that the worker process writes to
+        owned = stream is not None
+        if not owned:
+            stream = default
+            if isinstance(stream, ThreadLocalStream):
+                stream = stream._get_target()  # pylint: disable=protected-access
+
+        fd = _get_fileno(stream)
+        if fd is not None:
+            stream.flush()
+            dup = multiprocessing.reduction.DupFd(fd)
+            if owned:
+                stream.close()
+            return dup
+
+        r, w = os.pipe()
+        dup = multiprocessing.reduction.DupFd(w)
+        os.close(w)
+        self._relay(os.fdopen(r, 'r'), stream, close_target=owned)
+        return dup
+
+    def _relay(self, source, target, close_target=True):
+        def relay():
+            try:
+                for line in iter(source.readline, ''):
+                    target.write(line)
+                    target.flush()
+            except (OSError, ValueError):
+                # The reader or writer closed its end of the pipe
+                pass
+            finally:
+                source.close()
+                if close_target:
+                    try:
+                        target.close()
+                    except OSError:
+                        pass
+
+        t = threading.Thread(target=relay, daemon=True)
+        t.start()
+        self._relays.append(t)
+
+    def is_alive(self):
+        return self._started and (
+            not self._done.is_set() or any(t.is_alive() for t in self._relays)
+        )
+
+    def join(self, timeout=None):
+        if self._started:
+            self._done.wait(timeout)
+            # Wait for the output to be relayed
+            for t in self._relays:
+                t.join(timeout)
+
+    def stop(self):
+        '''
+        Attempt to stop the invocation by cancelling it, if it hasn't started
+        yet, and closing the stdin, stdout, and stderr streams.
+        '''
+        if self.is_alive():
+            if self._future:
+                self._future.cancel()
+            try:
+                self.invoke.close_streams()
+            except:
+                pass
+
+
+class PipeProcessPool(object):
+    '''
+    A pool of worker processes that run pipe stages whose command has an
+    :attr:`~pypsi.core.Command.isolation` of ``'process'``, see
+    :class:`ProcessInvocation`. The worker processes are started the first
+    time a stage is submitted.
+
+    Every stage of a pipe must run at the same time, so a stage is never
+    queued waiting for a worker: :meth:`acquire` fails when all
+    :attr:`max_workers` workers are busy and the stage runs on a thread
+    instead. Process pipes require passing file descriptors between
+    processes, which is not supported on Windows, where :attr:`supported` is
+    :const:`False` and every stage runs on a thread.
+    '''
+
+    #: Whether file descriptors can be passed to worker processes
+    supported = (
+        sys.platform != 'win32' and multiprocessing.reduction.HAVE_SEND_HANDLE
+    )
+
+    def __init__(self, max_workers=None, mp_context=None):
+        '''
+        :param int max_workers: the number of worker processes, defaults to
+            the number of CPUs
+        :param multiprocessing.context.BaseContext mp_context: the
+            multiprocessing context used to start the workers, defaults to
+            ``forkserver`` if available and ``spawn`` otherwise, so that the
+            workers are not forked from a process that is running threads
+        '''
+        #: The maximum number of worker processes
+        self.max_workers = max_workers or os.cpu_count() or 1
+        if mp_context is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context('forkserver')
+            else:
+                mp_context = multiprocessing.get_context('spawn')
+        #: The multiprocessing context used to start the workers
+        self.mp_context = mp_context
+        self._executor = None
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._peak_busy = 0
+        self._submitted = 0
+        self._rejected = 0
+
+    def acquire(self):
+        '''
+        Reserve a worker process for a stage.
+
+        :returns bool: whether a worker was reserved, :const:`False` if all
+            the workers are busy or process pipes are not supported
+        '''
+        with self._lock:
+            if not self.supported or self._busy >= self.max_workers:
+                self._rejected += 1
+                return False
+            self._busy += 1
+            self._peak_busy = max(self._peak_busy, self._busy)
+            return True
+
+    def release(self):
+        '''
+        Release a worker reserved with :meth:`acquire`.
+        '''
+        with self._lock:
+            self._busy -= 1
+
+    def submit(self, func, *args):
+        '''
+        Run a function in a worker process.
+
+        :returns concurrent.futures.Future: the function's result
+        '''
+        with self._lock:
+            self._submitted += 1
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers, mp_context=self.mp_context
+                )
+            executor = self._executor
+        return executor.submit(func, *args)
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the worker processes.
+        '''
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        '''
+        Get the pool's usage statistics.
+
+        :returns dict: ``max_workers``, ``busy`` workers, ``peak_busy`` (the
+            maximum number of busy workers), ``submitted`` stages and
+            ``rejected`` stages that ran on a thread instead
+        '''
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'busy': self._busy,
+                'peak_busy': self._peak_busy,
+                'submitted': self._submitted,
+                'rejected': self._rejected
+            }
+
+
+def _get_fileno(stream):
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        # io.UnsupportedOperation is both an OSError and a ValueError
+        return None
+
+
+def run_isolated(cmd, name, args, stdin=None, stdout=None, stderr=None):
+    '''
+    Run a command in a :class:`PipeProcessPool` worker process. The command
+    is run with a ``shell`` of :const:`None` since the shell is not available
+    in the worker process.
+
+    :param pypsi.core.Command cmd: the command
+    :param str name: the command name
+    :param list args: the command arguments
+    :param stdin: the :func:`multiprocessing.reduction.DupFd` to read from,
+        or :const:`None` to read nothing
+    :param stdout: the :func:`multiprocessing.reduction.DupFd` to write to
+    :param stderr: the :func:`multiprocessing.reduction.DupFd` to write
+        errors to, which may be ``stdout``
+    :returns int: the command's return code
+    '''
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from pypsi.cmdline import CommandInvocation
+
+    for attr in ('stdout', 'stderr', 'stdin'):
+        if not isinstance(getattr(sys, attr), ThreadLocalStream):
+            setattr(sys, attr, ThreadLocalStream(getattr(sys, attr)))
+
+    def open_fd(dup, mode):
+        return os.fdopen(dup.detach(), mode) if dup else None
+
+    stdout_fp = open_fd(stdout, 'w')
+    invoke = CommandInvocation(
+        name, args,
+        stdin=open_fd(stdin, 'r') or open(os.devnull, 'r', encoding='utf-8'),
+        stdout=stdout_fp,
+        stderr=stdout_fp if stderr is stdout else open_fd(stderr, 'w')
+    )
+    invoke.cmd = cmd
+    return invoke(None)
+
+
+class ObjectPipe(object):
+    '''
+    A bounded, in-memory pipe that passes Python objects between two pipe
+    stages, without encoding them as text. The pipe is used through its two
+    ends, :attr:`reader` and :attr:`writer`, which also implement enough of
+    the file API to be used as text streams, so that commands that are not
+    aware of objects can still read from and write to the pipe.
+
+    Like an OS pipe, :meth:`put` blocks while the pipe is full, raises
+    :class:`BrokenPipeError` once the reader is closed, and :meth:`get`
+    returns :data:`ObjectPipe.EOF` once the writer is closed and the pipe is
+    empty.
+    '''
+
+    #: The default maximum number of objects held by the pipe
+    DefaultMaxSize = 1024
+
+    #: Returned by :meth:`get` when the writer is closed
+    EOF = object()
+
+    def __init__(self, maxsize=None):
+        '''
+        :param int maxsize: the maximum number of objects held by the pipe,
+            defaults to :attr:`DefaultMaxSize`
+        '''
+        self.maxsize = maxsize or ObjectPipe.DefaultMaxSize
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._reader_closed = False
+        self._writer_closed = False
+        #: The read end of the pipe (:class:`ObjectPipeReader`)
+        self.reader = ObjectPipeReader(self)
+        #: The write end of the pipe (:class:`ObjectPipeWriter`)
+        self.writer = ObjectPipeWriter(self)
+
+    def put(self, obj):
+        '''
+        Add an object to the pipe, blocking while the pipe is full.
+
+        :param object obj: the object
+        :raises BrokenPipeError: the read end of the pipe is closed
+        '''
+        with self._cond:
+            while (len(self._items) >= self.maxsize and
+                   not self._reader_closed):
+                self._cond.wait()
+
+            if self._reader_closed:
+                raise BrokenPipeError(errno.EPIPE, "Broken pipe")
+
+            self._items.append(obj)
+            self._cond.notify_all()
+
+    def get(self):
+        '''
+        Remove the next object from the pipe, blocking while the pipe is
+        empty.
+
+        :returns object: the object or :data:`EOF` if the pipe is empty and
+            the write end is closed
+        '''
+        with self._cond:
+            while not self._items and not self._writer_closed:
+                self._cond.wait()
+
+            if not self._items:
+                return ObjectPipe.EOF
+
+            obj = self._items.popleft()
+            self._cond.notify_all()
+            return obj
+
+    def close_reader(self):
+        '''
+        Close the read end of the pipe.
+        '''
+        with self._cond:
+            self._reader_closed = True
+            self._items.clear()
+            self._cond.notify_all()
+
+    def close_writer(self):
+        '''
+        Close the write end of the pipe.
+        '''
+        with self._cond:
+            self._writer_closed = True
+            self._cond.notify_all()
+
+
+class ObjectPipeWriter(object):
+    '''
+    The write end of an :class:`ObjectPipe`. Objects are written with
+    :meth:`write_object`. Text written with :meth:`write` is split into lines
+    and each line, without the line ending, is written as a `str` object.
+    '''
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.closed = False
+        self._buffer = ''
+
+    def write_object(self, obj):
+        '''
+        Write an object to the pipe.
+        '''
+        if self._buffer:
+            self._flush_buffer()
+        self.pipe.put(obj)
+
+    def write(self, s):
+        text = self._buffer + s
+        lines = text.split('\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self.pipe.put(line)
+        return len(s)
+
+    def _flush_buffer(self):
+        line, self._buffer = self._buffer, ''
+        self.pipe.put(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            if self._buffer:
+                self._flush_buffer()
+        except BrokenPipeError:
+            pass
+        finally:
+            self.pipe.close_writer()
+
+
+class ObjectPipeReader(object):
+    '''
+    The read end of an :class:`ObjectPipe`. Objects are read with
+    :meth:`read_object` or by iterating the reader. Reading text with
+    :meth:`readline` or :meth:`read` converts each object to a line of text.
+    '''
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.closed = False
+
+    def read_object(self):
+        '''
+        Read the next object from the pipe.
+
+        :returns object: the object or :data:`ObjectPipe.EOF` if the write end
+            of the pipe is closed and all objects have been read
+        '''
+        return self.pipe.get()
+
+    def __iter__(self):
+        while True:
+            obj = self.pipe.get()
+            if obj is ObjectPipe.EOF:
+                break
+            yield obj
+
+    def readline(self):
+        obj = self.pipe.get()
+        if obj is ObjectPipe.EOF:
+            return ''
+        return str(obj) + '\n'
+
+    def read(self):
+        return ''.join(str(obj) + '\n' for obj in self)
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.pipe.close_reader()
+
+
+def write_object(obj, file=None):
+    '''
+    Write an object to a stream. If the stream is an object pipe, the object
+    is passed as is to the next pipe stage. Otherwise, the object is printed
+    as a line of text.
+
+    :param object obj: the object to write
+    :param file file: the output stream, defaults to :data:`sys.stdout`
+    '''
+    file = file or sys.stdout
+    write = getattr(file, 'write_object', None)
+    if write:
+        write(obj)
+    else:
+        print(obj, file=file)
+
+
+def read_objects(file=None):
+    '''
+    Iterate over the objects read from a stream. If the stream is an object
+    pipe, the objects written by the previous pipe stage are returned as is.
+    Otherwise, each line of text, without the line ending, is returned.
+
+    :param file file: the input stream, defaults to :data:`sys.stdin`
+    :returns: a generator that yields the objects
+    '''
+    file = file or sys.stdin
+    read = getattr(file, 'read_object', None)
+    if read:
+        while True:
+            obj = read()
+            if obj is ObjectPipe.EOF:
+                break
+            yield obj
+    else:
+        for line in iter(file.readline, ''):
+            yield line[:-1] if line.endswith('\n') else line
+
+
+class AsyncPipe(object):
+    '''
+    An in-memory pipe that connects two :mod:`asyncio` pipe stages running on
+    the same event loop. Like :class:`ObjectPipe`, Python objects are passed
+    as is and text is passed as lines, through the pipe's :attr:`reader` and
+    :attr:`writer` ends.
+
+    Writing to the pipe never blocks the event loop, so a stage can write
+    with :func:`print`. Instead, a producer waits for the consumer to catch
+    up, once the pipe holds :attr:`maxsize` objects, by awaiting
+    :meth:`drain`, which :func:`awrite_object` does after every object.
+    '''
+
+    #: The default number of objects held by the pipe before :meth:`drain`
+    #: waits
+    DefaultMaxSize = 1024
+
+    #: Returned by :meth:`get` when the writer is closed
+    EOF = ObjectPipe.EOF
+
+    def __init__(self, maxsize=None):
+        '''
+        :param int maxsize: the number of objects held by the pipe before
+            :meth:`drain` waits, defaults to :attr:`DefaultMaxSize`
+        '''
+        self.maxsize = maxsize or AsyncPipe.DefaultMaxSize
+        self._items = collections.deque()
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._reader_closed = False
+        self._writer_closed = False
+        #: The read end of the pipe (:class:`AsyncPipeReader`)
+        self.reader = AsyncPipeReader(self)
+        #: The write end of the pipe (:class:`AsyncPipeWriter`)
+        self.writer = AsyncPipeWriter(self)
+
+    def put_nowait(self, obj):
+        '''
+        Add an object to the pipe without waiting.
+
+        :param object obj: the object
+        :raises BrokenPipeError: the read end of the pipe is closed
+        '''
+        if self._reader_closed:
+            raise BrokenPipeError(errno.EPIPE, "Broken pipe")
+
+        self._items.append(obj)
+        self._readable.set()
+        if len(self._items) >= self.maxsize:
+            self._writable.clear()
+
+    async def drain(self):
+        '''
+        Wait until the pipe holds less than :attr:`maxsize` objects.
+
+        :raises BrokenPipeError: the read end of the pipe is closed
+        '''
+        while len(self._items) >= self.maxsize and not self._reader_closed:
+            await self._writable.wait()
+
+        if self._reader_closed:
+            raise BrokenPipeError(errno.EPIPE, "Broken pipe")
+
+    async def put(self, obj):
+        '''
+        Add an object to the pipe and wait until the pipe is not full.
+
+        :param object obj: the object
+        :raises BrokenPipeError: the read end of the pipe is closed
+        '''
+        self.put_nowait(obj)
+        await self.drain()
+
+    async def get(self):
+        '''
+        Remove the next object from the pipe, waiting while the pipe is empty.
+
+        :returns object: the object or :data:`EOF` if the pipe is empty and
+            the write end is closed
+        '''
+        while not self._items and not self._writer_closed:
+            self._readable.clear()
+            await self._readable.wait()
+
+        if not self._items:
+            return AsyncPipe.EOF
+
+        obj = self._items.popleft()
+        if len(self._items) < self.maxsize:
+            self._writable.set()
+        return obj
+
+    def close_reader(self):
+        '''
+        Close the read end of the pipe.
+        '''
+        self._reader_closed = True
+        self._items.clear()
+        self._writable.set()
+
+    def close_writer(self):
+        '''
+        Close the write end of the pipe.
+        '''
+        self._writer_closed = True
+        self._readable.set()
+
+
+class AsyncPipeWriter(ObjectPipeWriter):
+    '''
+    The write end of an :class:`AsyncPipe`. Objects and text are written the
+    same way as :class:`ObjectPipeWriter`, without waiting, and
+    :meth:`awrite_object` and :meth:`drain` wait for the reader to catch up.
+    '''
+
+    def write_object(self, obj):
+        if self._buffer:
+            self._flush_buffer()
+        self.pipe.put_nowait(obj)
+
+    def write(self, s):
+        text = self._buffer + s
+        lines = text.split('\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self.pipe.put_nowait(line)
+        return len(s)
+
+    def _flush_buffer(self):
+        line, self._buffer = self._buffer, ''
+        self.pipe.put_nowait(line)
+
+    async def awrite_object(self, obj):
+        '''
+        Write an object to the pipe and wait until the pipe is not full.
+        '''
+        self.write_object(obj)
+        await self.pipe.drain()
+
+    async def drain(self):
+        '''
+        Wait until the pipe is not full.
+        '''
+        await self.pipe.drain()
+
+
+class AsyncPipeReader(object):
+    '''
+    The read end of an :class:`AsyncPipe`. Objects are read with
+    :meth:`aread_object` or with ``async for``, and text with
+    :meth:`areadline` and :meth:`aread`. The blocking :meth:`readline` and
+    :meth:`read` methods are not supported since they would block the event
+    loop, use :func:`areadline` or :func:`aread_objects` instead.
+    '''
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.closed = False
+
+    async def aread_object(self):
+        '''
+        Read the next object from the pipe.
+
+        :returns object: the object or :data:`AsyncPipe.EOF` if the write end
+            of the pipe is closed and all objects have been read
+        '''
+        return await self.pipe.get()
+
+    async def __aiter__(self):
+        while True:
+            obj = await self.pipe.get()
+            if obj is AsyncPipe.EOF:
+                break
+            yield obj
+
+    async def areadline(self):
+        obj = await self.pipe.get()
+        if obj is AsyncPipe.EOF:
+            return ''
+        return str(obj) + '\n'
+
+    async def aread(self):
+        return ''.join([str(obj) + '\n' async for obj in self])
+
+    def readline(self):
+        raise io.UnsupportedOperation("readline() would block the event loop")
+
+    def read(self):
+        raise io.UnsupportedOperation("read() would block the event loop")
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.pipe.close_reader()
+
+
+async def awrite_object(obj, file=None):
+    '''
+    The :mod:`asyncio` version of :func:`write_object`. If the stream is an
+    :class:`AsyncPipe`, this waits until the next pipe stage has caught up.
+    Writing to any other stream may block the event loop until the next pipe
+    stage, which runs on its own thread, reads from it.
+
+    :param object obj: the object to write
+    :param file file: the output stream, defaults to :data:`sys.stdout`
+    '''
+    file = file or sys.stdout
+    write = getattr(file, 'awrite_object', None)
+    if write:
+        await write(obj)
+    else:
+        write_object(obj, file)
+
+
+async def aread_objects(file=None):
+    '''
+    The :mod:`asyncio` version of :func:`read_objects`. Reading from a stream
+    that is not an :class:`AsyncPipe` is run in the event loop's default
+    executor.
+
+    :param file file: the input stream, defaults to :data:`sys.stdin`
+    :returns: an asynchronous generator that yields the objects
+    '''
+    file = file or sys.stdin
+    aread = getattr(file, 'aread_object', None)
+    read = getattr(file, 'read_object', None)
+    if aread or read:
+        loop = asyncio.get_running_loop()
+        while True:
+            if aread:
+                obj = await aread()
+            else:
+                obj = await loop.run_in_executor(None, read)
+            if obj is ObjectPipe.EOF:
+                break
+            yield obj
+    else:
+        while True:
+            line = await areadline(file)
+            if not line:
+                break
+            yield line[:-1] if line.endswith('\n') else line
+
+
+async def areadline(file=None):
+    '''
+    Read a line of text from a stream without blocking the event loop. Reading
+    from a stream that is not an :class:`AsyncPipe` is run in the event
+    loop's default executor.
+
+    :param file file: the input stream, defaults to :data:`sys.stdin`
+    :returns str: the line, or an empty string at the end of the stream
+    '''
+    file = file or sys.stdin
+    read = getattr(file, 'areadline', None)
+    if read:
+        return await read()
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, file.readline)
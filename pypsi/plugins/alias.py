@@ -51,6 +51,7 @@ class AliasCommand(Command):
             for name in ns.delete:
                 if name in shell.ctx.aliases:
                     del shell.ctx.aliases[name]
+                    shell.invalidate_parse_cache()
                     rc = 0
                 else:
                     self.error(shell, "alias does not exist: ", name)
@@ -63,6 +64,7 @@ class AliasCommand(Command):
                 rc = 1
             else:
                 shell.ctx.aliases[exp.operand] = exp.value
+                shell.invalidate_parse_cache()
                 rc = 0
         return rc
 
@@ -78,6 +80,13 @@ class AliasPlugin(Plugin):
         shell.register(self.cmd)
         return 0
 
+    def parse_cache_key(self, shell, line):
+        return tuple(sorted(shell.ctx.aliases.items()))
+
+    def prompt_cache_key(self, shell, prompt):
+        # Aliases are not expanded in the prompt
+        return ()
+
     def on_tokenize(self, shell, tokens, origin):
         if origin != 'input':
             return tokens
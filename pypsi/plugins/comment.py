@@ -41,6 +41,9 @@ class CommentPlugin(Plugin):
     def setup(self, shell):
         pass
 
+    def parse_cache_key(self, shell, line):
+        return ()
+
     def on_tokenize(self, shell, tokens, origin):
         index = 0
         for token in tokens:
@@ -15,8 +15,9 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
+import re
 from pypsi.core import Plugin
-from pypsi.cmdline import StringToken
+from pypsi.cmdline import StringToken, TokenRule
 
 
 class HexCodePlugin(Plugin):
@@ -32,6 +33,24 @@ class HexCodePlugin(Plugin):
     def __init__(self, preprocess=5, **kwargs):
         super().__init__(preprocess=preprocess, **kwargs)
 
+    def parse_cache_key(self, shell, line):
+        return ()
+
+    def get_token_rules(self, shell):
+        escape_char = shell.features.escape_char
+        if not escape_char:
+            return []
+
+        escape = re.escape(escape_char)
+        return [
+            TokenRule(escape + 'x[0-9a-fA-F]{2}',
+                      lambda m, token: chr(int(m.group()[-2:], base=16)),
+                      requires=escape_char),
+            # Incomplete and invalid sequences are handled by on_tokenize()
+            TokenRule(escape + 'x.{0,2}', lambda m, token: None,
+                      requires=escape_char)
+        ]
+
     def on_tokenize(self, shell, tokens, origin):
         escape_char = shell.features.escape_char
         for token in tokens:
@@ -38,7 +38,7 @@ class HistoryCommand(Command):
                  topic='shell', **kwargs):
         self.setup_parser(brief)
         super().__init__(
-            name=name, usage=self.parser.format_help(), topic=topic,
+            name=name, usage=self.parser.format_help, topic=topic,
             brief=brief, **kwargs
         )
 
@@ -0,0 +1,447 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+'''
+Operational metrics of the commands that a shell runs, which can be exported
+as a table, as JSON, or in the Prometheus text exposition format.
+'''
+
+import bisect
+import json
+import sys
+import threading
+from pypsi.core import Plugin, Command, PypsiArgParser, CommandShortCircuit
+from pypsi.format import Table, Column
+
+
+MetricsCmdUsage = "%(prog)s [-h] [-f {table,json,prometheus}] [-o FILE] [-r]"
+
+#: The default upper bounds, in seconds, of the latency histogram buckets
+DefaultBuckets = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class CommandMetrics(object):
+    '''
+    The metrics of a single command.
+    '''
+
+    __slots__ = (
+        'invocations', 'failures', 'exceptions', 'pipe_stages', 'pipe_chars',
+        'buckets', 'latency_sum'
+    )
+
+    def __init__(self, bucket_count):
+        '''
+        :param int bucket_count: the number of latency histogram buckets,
+            including the final ``+Inf`` bucket
+        '''
+        #: The number of invocations
+        self.invocations = 0
+        #: The number of invocations that returned a non-zero return code
+        self.failures = 0
+        #: The number of invocations that raised an exception
+        self.exceptions = 0
+        #: The number of invocations that ran as a pipe stage
+        self.pipe_stages = 0
+        #: The number of characters written to pipes by the pipe stages
+        self.pipe_chars = 0
+        #: The number of invocations in each latency bucket, these counts
+        #: are not cumulative
+        self.buckets = [0] * bucket_count
+        #: The total run time of all invocations, in seconds
+        self.latency_sum = 0.0
+
+    def merge(self, other):
+        '''
+        Add the metrics of another :class:`CommandMetrics` to this one.
+
+        :param CommandMetrics other: the metrics to add
+        '''
+        self.invocations += other.invocations
+        self.failures += other.failures
+        self.exceptions += other.exceptions
+        self.pipe_stages += other.pipe_stages
+        self.pipe_chars += other.pipe_chars
+        self.latency_sum += other.latency_sum
+        for i, count in enumerate(list(other.buckets)):
+            self.buckets[i] += count
+
+
+class _Shard(object):
+    # The metrics recorded by a single thread, which are only ever modified
+    # by that thread.
+
+    def __init__(self):
+        self.commands = {}
+        self.statements = 0
+        self.failed_statements = 0
+
+
+class MetricsRegistry(object):
+    '''
+    Thread safe storage of command and statement metrics. Every thread
+    records metrics in its own shard, so pipe stages running at the same
+    time never wait on each other. The shards are merged when the metrics
+    are read with :meth:`snapshot`.
+    '''
+
+    def __init__(self, buckets=DefaultBuckets):
+        '''
+        :param tuple buckets: the upper bounds, in seconds, of the latency
+            histogram buckets
+        '''
+        #: The upper bounds of the latency histogram buckets
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+
+    def _get_shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+
+        shard = self._local.shard = _Shard()
+        with self._lock:
+            # Fold the shards of threads that have exited into a single shard
+            # so that short lived pipe threads don't accumulate.
+            shards = []
+            for thread, other in self._shards:
+                if thread.is_alive():
+                    shards.append((thread, other))
+                else:
+                    self._merge(self._retired, other)
+            shards.append((threading.current_thread(), shard))
+            self._shards = shards
+        return shard
+
+    def _merge(self, target, shard):
+        target.statements += shard.statements
+        target.failed_statements += shard.failed_statements
+        for name, metrics in list(shard.commands.items()):
+            if name not in target.commands:
+                target.commands[name] = CommandMetrics(len(self.buckets) + 1)
+            target.commands[name].merge(metrics)
+
+    def observe_invocation(self, name, rc, elapsed, exception=False,
+                           pipe=False, pipe_chars=0):
+        '''
+        Record a finished command invocation.
+
+        :param str name: the command name
+        :param int rc: the invocation's return code
+        :param float elapsed: the number of seconds the invocation ran for
+        :param bool exception: whether the invocation raised an exception
+        :param bool pipe: whether the invocation ran as a pipe stage
+        :param int pipe_chars: the number of characters the pipe stage wrote
+            to the pipe
+        '''
+        commands = self._get_shard().commands
+        metrics = commands.get(name)
+        if metrics is None:
+            metrics = commands[name] = CommandMetrics(len(self.buckets) + 1)
+
+        metrics.invocations += 1
+        if exception:
+            metrics.exceptions += 1
+        elif rc:
+            metrics.failures += 1
+        if pipe:
+            metrics.pipe_stages += 1
+            metrics.pipe_chars += pipe_chars
+        metrics.buckets[bisect.bisect_left(self.buckets, elapsed)] += 1
+        metrics.latency_sum += elapsed
+
+    def observe_statement(self, rc):
+        '''
+        Record a finished statement.
+
+        :param int rc: the statement's return code
+        '''
+        shard = self._get_shard()
+        shard.statements += 1
+        if rc:
+            shard.failed_statements += 1
+
+    def snapshot(self):
+        '''
+        Merge the metrics of every thread.
+
+        :returns tuple: the number of statements, the number of statements
+            that failed, and a dict of command names to
+            :class:`CommandMetrics`
+        '''
+        total = _Shard()
+        with self._lock:
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                self._merge(total, shard)
+        return total.statements, total.failed_statements, total.commands
+
+    def reset(self):
+        '''
+        Discard all recorded metrics.
+        '''
+        with self._lock:
+            for _, shard in self._shards:
+                # The owning thread may be updating the shard, so replace its
+                # contents rather than the shard itself.
+                shard.commands = {}
+                shard.statements = shard.failed_statements = 0
+            self._retired = _Shard()
+
+    def to_dict(self):
+        '''
+        :returns dict: the metrics as a JSON serializable dict
+        '''
+        statements, failed, commands = self.snapshot()
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'statements': {'total': statements, 'failed': failed},
+            'commands': {
+                name: {
+                    'invocations': metrics.invocations,
+                    'failures': metrics.failures,
+                    'exceptions': metrics.exceptions,
+                    'pipe_stages': metrics.pipe_stages,
+                    'pipe_chars': metrics.pipe_chars,
+                    'latency': {
+                        'sum': metrics.latency_sum,
+                        'count': metrics.invocations,
+                        'buckets': dict(zip(bounds, metrics.buckets))
+                    }
+                }
+                for name, metrics in sorted(commands.items())
+            }
+        }
+
+    def write_json(self, fp):
+        '''
+        Write the metrics as JSON.
+
+        :param file fp: the output stream
+        '''
+        json.dump(self.to_dict(), fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+    def write_prometheus(self, fp):
+        '''
+        Write the metrics in the Prometheus text exposition format.
+
+        :param file fp: the output stream
+        '''
+        statements, failed, commands = self.snapshot()
+        commands = sorted(commands.items())
+        lines = []
+
+        def header(name, kind, description):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+
+        header('pypsi_statements_total', 'counter',
+               'Number of statements executed.')
+        lines.append("pypsi_statements_total {}".format(statements))
+        header('pypsi_statement_failures_total', 'counter',
+               'Number of statements that returned a non-zero code.')
+        lines.append("pypsi_statement_failures_total {}".format(failed))
+
+        counters = (
+            ('pypsi_command_invocations_total', 'invocations',
+             'Number of command invocations.'),
+            ('pypsi_command_failures_total', 'failures',
+             'Number of command invocations that returned a non-zero code.'),
+            ('pypsi_command_exceptions_total', 'exceptions',
+             'Number of command invocations that raised an exception.'),
+            ('pypsi_pipe_stages_total', 'pipe_stages',
+             'Number of command invocations that ran as a pipe stage.'),
+            ('pypsi_pipe_characters_total', 'pipe_chars',
+             'Number of characters written to pipes by pipe stages.'),
+        )
+        for name, attr, description in counters:
+            header(name, 'counter', description)
+            for command, metrics in commands:
+                lines.append('{}{{command="{}"}} {}'.format(
+                    name, _escape_label(command), getattr(metrics, attr)
+                ))
+
+        name = 'pypsi_command_duration_seconds'
+        header(name, 'histogram', 'Command invocation run time.')
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        for command, metrics in commands:
+            label = _escape_label(command)
+            count = 0
+            for bound, bucket in zip(bounds, metrics.buckets):
+                count += bucket
+                lines.append('{}_bucket{{command="{}",le="{}"}} {}'.format(
+                    name, label, bound, count
+                ))
+            lines.append('{}_sum{{command="{}"}} {}'.format(
+                name, label, metrics.latency_sum
+            ))
+            lines.append('{}_count{{command="{}"}} {}'.format(
+                name, label, metrics.invocations
+            ))
+
+        fp.write('\n'.join(lines) + '\n')
+
+    def write_table(self, fp, width=80):
+        '''
+        Write the metrics as a table.
+
+        :param file fp: the output stream
+        :param int width: the table width
+        '''
+        statements, failed, commands = self.snapshot()
+        print("statements:", statements, "failed:", failed, file=fp)
+
+        table = Table(
+            columns=(
+                Column('Command', Column.Grow), Column('Calls'),
+                Column('Failed'), Column('Errors'), Column('Stages'),
+                Column('Mean (ms)'), Column('Total (s)')
+            ),
+            width=width
+        )
+        for name, metrics in sorted(commands.items()):
+            table.append(
+                name, metrics.invocations, metrics.failures,
+                metrics.exceptions, metrics.pipe_stages,
+                "{:.3f}".format(
+                    metrics.latency_sum * 1000 / metrics.invocations
+                ),
+                "{:.3f}".format(metrics.latency_sum)
+            )
+        table.write(fp)
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsCommand(Command):
+    '''
+    Print or save the metrics recorded by the :class:`MetricsPlugin`.
+    '''
+
+    def __init__(self, name='metrics', brief='print command metrics',
+                 topic='shell', **kwargs):
+        self.parser = PypsiArgParser(
+            prog=name,
+            description=brief,
+            usage=MetricsCmdUsage
+        )
+
+        self.parser.add_argument(
+            '-f', '--format', choices=('table', 'json', 'prometheus'),
+            default='table', help='output format'
+        )
+
+        self.parser.add_argument(
+            '-o', '--output', metavar='FILE',
+            help='write the metrics to a file'
+        )
+
+        self.parser.add_argument(
+            '-r', '--reset', action='store_true',
+            help='reset the metrics after they are written'
+        )
+
+        super().__init__(
+            name=name, usage=self.parser.format_help, topic=topic,
+            brief=brief, **kwargs
+        )
+
+    def run(self, shell, args):
+        try:
+            ns = self.parser.parse_args(args)
+        except CommandShortCircuit as e:
+            return e.code
+
+        if 'metrics' not in shell.ctx:
+            self.error(shell, "metrics are not enabled")
+            return 1
+
+        registry = shell.ctx.metrics
+        if ns.output:
+            try:
+                fp = open(ns.output, 'w', encoding='utf-8')  # pylint: disable=consider-using-with
+            except OSError as e:
+                self.error(shell, ns.output, ": ", e.strerror)
+                return 1
+        else:
+            fp = sys.stdout
+
+        try:
+            if ns.format == 'json':
+                registry.write_json(fp)
+            elif ns.format == 'prometheus':
+                registry.write_prometheus(fp)
+            else:
+                registry.write_table(fp, shell.width)
+        finally:
+            if ns.output:
+                fp.close()
+
+        if ns.reset:
+            registry.reset()
+        return 0
+
+
+class MetricsPlugin(Plugin):
+    '''
+    Record the number of invocations, non-zero return codes, exceptions, and
+    the run time of each command, and how many pipe stages ran and how much
+    they wrote to pipes. The metrics are stored in a :class:`MetricsRegistry`
+    that can be accessed by retrieving the ``shell.ctx.metrics`` attribute
+    and are printed by the :class:`MetricsCommand`.
+    '''
+
+    def __init__(self, postprocess=90, metrics_cmd='metrics',
+                 buckets=DefaultBuckets, **kwargs):
+        '''
+        :param int postprocess: the postprocess priority, statements are only
+            counted when this is not :const:`None`
+        :param str metrics_cmd: the name of the metrics command
+        :param tuple buckets: the upper bounds, in seconds, of the latency
+            histogram buckets
+        '''
+        super().__init__(postprocess=postprocess, **kwargs)
+        self.metrics_cmd = MetricsCommand(name=metrics_cmd)
+        #: The recorded metrics
+        self.registry = MetricsRegistry(buckets)
+
+    def setup(self, shell):
+        shell.register(self.metrics_cmd)
+        shell.ctx.metrics = self.registry
+        return 0
+
+    def on_invocation_end(self, shell, invoke, rc, elapsed, exc_info):  # pylint: disable=too-many-arguments
+        pipe = invoke.chain_pipe()
+        buf = invoke.stdout_buffer if pipe else None
+        self.registry.observe_invocation(
+            invoke.name, rc, elapsed, exception=exc_info is not None,
+            pipe=pipe, pipe_chars=getattr(buf, 'written', 0)
+        )
+        return 0
+
+    def on_statement_finished(self, shell, rc):
+        self.registry.observe_statement(rc)
+        return 0
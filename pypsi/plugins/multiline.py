@@ -56,6 +56,15 @@ class MultilinePlugin(Plugin):
             shell.prompt = self.orig_prompt
             self.orig_prompt = ''
 
+    def parse_cache_key(self, shell, line):
+        # A statement that completes a buffered multiline statement depends on
+        # the previous lines and can't be cached.
+        return None if self.buffer else ()
+
+    def prompt_cache_key(self, shell, prompt):
+        # The prompt is not modified by on_tokenize()
+        return ()
+
     def on_tokenize(self, shell, tokens, origin):
         if origin != 'input':
             return tokens
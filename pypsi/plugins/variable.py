@@ -16,16 +16,44 @@
 #
 
 import os
+import re
 import sys
+import contextlib
+import contextvars
 from datetime import datetime
 import argparse
 from pypsi.core import Plugin, Command, PypsiArgParser, CommandShortCircuit
 from pypsi.namespace import ScopedNamespace
 from pypsi.cmdline import (Token, StringToken, TokenContinue, TokenEnd,
-                           Expression)
+                           Expression, TokenRule)
 from pypsi.format import Table, Column, obj_str
 
 
+#: Variables that are bound in the current context, see :func:`bind_vars`
+_bound_vars = contextvars.ContextVar('pypsi_bound_vars', default=None)
+
+
+@contextlib.contextmanager
+def bind_vars(values):
+    '''
+    Bind variables in the current context. While the context manager is
+    active, a bound variable takes precedence over the shell's variable of
+    the same name when it is expanded by the :class:`VariablePlugin`. The
+    shell's variables, ``shell.ctx.vars``, are not modified, so the bindings
+    are private to the current thread and to the pipe stages it starts. For
+    example, the :class:`~pypsi.commands.macro.Macro` command binds its
+    arguments to the variables ``$0-9``.
+
+    :param dict values: the variables to bind, by name
+    '''
+    bound = _bound_vars.get()
+    token = _bound_vars.set(dict(bound, **values) if bound else values)
+    try:
+        yield
+    finally:
+        _bound_vars.reset(token)
+
+
 class ManagedVariable(object):
     '''
     Represents a variable that is managed by the shell. Managed variables have
@@ -35,17 +63,25 @@ class ManagedVariable(object):
     is :const:`None`, the variable is read-only. The setter must accept two
     arguments when it is called: the active :class:`~pypsi.shell.Shell`
     instance, and the :class:`str` value.
+
+    The rendered prompt is cached and only rendered again when the value of a
+    variable it references changes. A variable whose value changes every time
+    it is retrieved, such as the current time, should be ``volatile`` so that
+    a prompt that references it is rendered every time.
     '''
 
-    def __init__(self, getter, setter=None):
+    def __init__(self, getter, setter=None, volatile=False):
         '''
         :param callable getter: the callable to call when retrieving the
             variable's value (must return a value)
         :param callable setter: the callable to call when setting the
             variable's value
+        :param bool volatile: whether the value changes every time it is
+            retrieved
         '''
         self.getter = getter
         self.setter = setter
+        self.volatile = volatile
 
     def set(self, shell, value):
         if self.setter:
@@ -87,7 +123,7 @@ class VariableCommand(Command):
             nargs=argparse.REMAINDER
         )
         super().__init__(
-            name=name, usage=self.parser.format_help(), topic=topic,
+            name=name, usage=self.parser.format_help, topic=topic,
             brief=brief, **kwargs
         )
 
@@ -161,6 +197,8 @@ class VariableCommand(Command):
 
 class VariableToken(Token):
 
+    __slots__ = ('prefix', 'var')
+
     VarChars = ('abcdefghijklmnopqrstuvwxyz'
                 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
                 '0123456789_')
@@ -275,9 +313,13 @@ class VariablePlugin(Plugin):
         super().__init__(preprocess=preprocess, postprocess=postprocess, **kwargs)
         self.var_cmd = VariableCommand(name=var_cmd, topic=topic)
         self.prefix = prefix
+        self.var_pattern = re.compile(
+            re.escape(prefix) + '([{}]+)'.format(VariableToken.VarChars)
+        )
 
         self.base = dict(os.environ) if env else {}
         self.case_sensitive = case_sensitive
+        self._prompt_vars = None
         if locals:
             self.base.update(locals)
 
@@ -292,9 +334,12 @@ class VariablePlugin(Plugin):
             for key, value in self.base.items():
                 shell.ctx.vars[key] = value
 
-            shell.ctx.vars.date = ManagedVariable(var_date_getter)
-            shell.ctx.vars.time = ManagedVariable(var_time_getter)
-            shell.ctx.vars.datetime = ManagedVariable(var_datetime_getter)
+            shell.ctx.vars.date = ManagedVariable(var_date_getter,
+                                                  volatile=True)
+            shell.ctx.vars.time = ManagedVariable(var_time_getter,
+                                                  volatile=True)
+            shell.ctx.vars.datetime = ManagedVariable(var_datetime_getter,
+                                                      volatile=True)
             shell.ctx.vars.prompt = ManagedVariable(var_prompt_getter,
                                                     self.set_prompt)
             shell.ctx.vars.errno = ManagedVariable(var_errno_getter)
@@ -305,6 +350,9 @@ class VariablePlugin(Plugin):
 
     def expand(self, shell, vart):
         name = vart.var
+        bound = _bound_vars.get()
+        if bound is not None and name in bound:
+            return bound[name]
         if name in shell.ctx.vars:
             s = shell.ctx.vars[name]
             if callable(s):
@@ -314,6 +362,86 @@ class VariablePlugin(Plugin):
             return s
         return ''
 
+    def parse_cache_key(self, shell, line):
+        '''
+        The parsed statement depends on the values of the variables that the
+        line references, including the variables bound by :func:`bind_vars`.
+        Lines that reference a callable or :class:`ManagedVariable` can't be
+        cached since their value may change every time they are expanded.
+        '''
+        if self.prefix not in line:
+            return ()
+
+        bound = _bound_vars.get()
+        key = []
+        for name in self.var_pattern.findall(line):
+            if bound is not None and name in bound:
+                s = bound[name]
+            else:
+                s = shell.ctx.vars[name] if name in shell.ctx.vars else None
+            if callable(s) or isinstance(s, ManagedVariable):
+                return None
+            key.append((name, s))
+        return tuple(key)
+
+    def prompt_cache_key(self, shell, prompt):
+        '''
+        The rendered prompt depends on the values of the variables that the
+        prompt references. The variable names are only searched for when the
+        prompt changes. The value of a :class:`ManagedVariable` is retrieved
+        to build the key, unless the variable is volatile, in which case the
+        prompt must be rendered every time, as is the case when it references
+        a callable.
+        '''
+        if self.prefix not in prompt:
+            return ()
+
+        if self._prompt_vars and self._prompt_vars[0] == prompt:
+            names = self._prompt_vars[1]
+        else:
+            names = tuple(self.var_pattern.findall(prompt))
+            self._prompt_vars = (prompt, names)
+
+        key = []
+        for name in names:
+            s = shell.ctx.vars[name] if name in shell.ctx.vars else None
+            if isinstance(s, ManagedVariable):
+                if s.volatile:
+                    return None
+                s = s.get(shell)
+            elif callable(s):
+                return None
+            key.append((name, s))
+        return tuple(key)
+
+    def get_token_rules(self, shell):
+        if shell.features.escape_char != '\\':
+            # get_subtokens() always uses a backslash as the escape character
+            return None
+
+        prefix = re.escape(self.prefix)
+        name = prefix + '([{}]*)'.format(VariableToken.VarChars)
+        triggers = self.prefix + '\\"\''
+        return [
+            TokenRule(r'\\' + prefix, lambda m, token: self.prefix,
+                      requires=self.prefix, triggers=triggers),
+            # get_subtokens() creates a StringToken from the first character
+            # after a variable, which can't be a quote. A variable name can
+            # also be continued by a hex code escape sequence.
+            TokenRule(r'\A["\']|' + name + r'(?=["\']|\\x)',
+                      lambda m, token: None, requires=self.prefix,
+                      triggers=triggers),
+            TokenRule(name, lambda m, token: StringToken(
+                token.index + m.start(),
+                self.expand(shell, VariableToken(token.index + m.start(),
+                                                 self.prefix, m.group(1))),
+                '"'
+            ), requires=self.prefix, triggers=triggers, split=True),
+            # A trailing escape character is removed
+            TokenRule(r'\\\Z', lambda m, token: '', requires=self.prefix,
+                      triggers=triggers)
+        ]
+
     def on_tokenize(self, shell, tokens, origin):
         ret = []
         for token in tokens:
@@ -17,6 +17,7 @@
 
 import sys
 import os
+import time
 
 if sys.platform == "win32":
     import collections
@@ -29,16 +30,22 @@ if sys.platform == "win32":
 import readline
 from pypsi.cmdline import (StatementParser, StatementSyntaxError,
                            IORedirectionError, CommandNotFoundError,
-                           StringToken, OperatorToken, WhitespaceToken,
-                           UnclosedQuotationError, TrailingEscapeError)
+                           StringToken, UnclosedQuotationError,
+                           TrailingEscapeError, StatementCache,
+                           CompletionState, TokenRewriter)
 
 from pypsi.namespace import Namespace
+from pypsi.jobs import JobTable
+from pypsi.lazy import LazyCommand
+from pypsi.timing import StatementTiming
 from pypsi.completers import path_completer
 from pypsi.os import is_path_prefix
 from pypsi.ansi import AnsiCodes
 from pypsi.features import BashFeatures, TabCompletionFeatures
 from pypsi.core import pypsi_print, Plugin, Command
-from pypsi.pipes import ThreadLocalStream, InvocationThread
+from pypsi.pipes import (ThreadLocalStream, InvocationThread, ObjectPipe,
+                         PipeWorkerPool, PooledInvocation, PipeProcessPool,
+                         ProcessInvocation)
 
 
 class Shell(object):
@@ -48,8 +55,13 @@ class Shell(object):
     '''
     # pylint: disable=too-many-public-methods
 
+    #: The number of characters :meth:`run_batch` reads from a script at once
+    BatchChunkSize = 65536
+
     def __init__(self, shell_name='pypsi', width=79, exit_rc=-1024, ctx=None,
-                 features=None, completer_delims=None):
+                 features=None, completer_delims=None, parse_cache_size=256,
+                 fuse_token_rules=False, pipe_workers=8,
+                 process_workers=None):
         '''
         Subclasses need to call the Shell constructor to properly initialize
         it.
@@ -58,6 +70,16 @@ class Shell(object):
         :param int exit_rc: the exit return code that is returned from a
             command when the shell needs to end execution
         :param pypsi.namespace.Namespace ctx: the base context
+        :param int parse_cache_size: the maximum number of parsed statements
+            to cache, ``0`` disables the cache
+        :param bool fuse_token_rules: run the token rules of consecutive
+            plugins in a single pass, see :meth:`get_token_stages`
+        :param int pipe_workers: the maximum number of reusable threads that
+            run pipe stages, ``0`` creates a new thread for every stage
+        :param int process_workers: the number of worker processes that run
+            commands with an :attr:`~pypsi.core.Command.isolation` of
+            ``'process'``, defaults to the number of CPUs, ``0`` runs them on
+            threads
         '''
         self.backup_stdout = None
         self.backup_stdin = None
@@ -69,15 +91,71 @@ class Shell(object):
         self.exit_rc = exit_rc
         self.errno = 0
         self.commands = {}
+        #: The registered plugins, in registration order
+        self.plugins = []
+        #: The plugins that have a :attr:`~pypsi.core.Plugin.preprocess`
+        #: priority, sorted by priority
         self.preprocessors = []
+        #: The plugins that have a :attr:`~pypsi.core.Plugin.postprocess`
+        #: priority, sorted by priority
         self.postprocessors = []
-        self.plugins = []
+        #: The preprocessors that override :meth:`~pypsi.core.Plugin.on_input`
+        self.input_plugins = []
+        #: The preprocessors that override
+        #: :meth:`~pypsi.core.Plugin.on_tokenize`
+        self.tokenize_plugins = []
+        #: The preprocessors that contribute to the parsed statement and
+        #: prompt cache keys
+        self.cache_key_plugins = []
+        #: The preprocessors that override
+        #: :meth:`~pypsi.core.Plugin.on_input_canceled`
+        self.canceled_plugins = []
+        #: The postprocessors that override
+        #: :meth:`~pypsi.core.Plugin.on_statement_finished`
+        self.finished_plugins = []
         self.prompt = "{name} )> ".format(name=shell_name)
         self.ctx = ctx or Namespace()
         self.features = features or BashFeatures()
         self.running = False
         self.completion_matches = None
+        #: Incremental tokenizer state of the last completed line buffer
+        #: (:class:`~pypsi.cmdline.CompletionState`)
+        self.completion_state = None
         self.completer_delims = completer_delims
+        #: Cache of parsed statements (:class:`~pypsi.cmdline.StatementCache`)
+        self.parse_cache = StatementCache(parse_cache_size)
+        #: Incremented every time :meth:`invalidate_parse_cache` is called
+        self.parse_generation = 0
+        #: Whether to fuse plugin token rules (see :meth:`get_token_stages`)
+        self.fuse_token_rules = fuse_token_rules
+        self._token_stages = None
+        self._prompt_cache = None
+        #: The :class:`~pypsi.pipes.PipeWorkerPool` that runs pipe stages, or
+        #: :const:`None` if every stage runs on a new thread
+        self.pipe_pool = PipeWorkerPool(pipe_workers) if pipe_workers else None
+        #: The :class:`~pypsi.pipes.PipeProcessPool` that runs process
+        #: isolated commands, or :const:`None` if they run on threads
+        self.process_pool = (
+            PipeProcessPool(process_workers)
+            if process_workers is None or process_workers > 0 else None
+        )
+        #: Statements running in the background
+        #: (:class:`~pypsi.jobs.JobTable`)
+        self.jobs = JobTable()
+        #: Time every statement, even if no plugin overrides
+        #: :meth:`~pypsi.core.Plugin.on_statement_timing`
+        self.time_statements = False
+        #: The plugins that override
+        #: :meth:`~pypsi.core.Plugin.on_statement_timing`
+        self.timing_plugins = []
+        #: The plugins that override
+        #: :meth:`~pypsi.core.Plugin.on_invocation_start` or
+        #: :meth:`~pypsi.core.Plugin.on_invocation_end`
+        self.invocation_plugins = []
+        #: An object with a ``runcall(func, *args)`` method that pipe stages
+        #: are run with on their threads, such as the profiler of the
+        #: :class:`~pypsi.commands.profile.ProfileCommand`
+        self.pipe_profiler = None
 
         self.default_cmd = None
         self.register_base_plugins()
@@ -128,34 +206,90 @@ class Shell(object):
         '''
 
         cls = self.__class__
-        for name in dir(cls):
-            attr = getattr(cls, name)
-            if isinstance(attr, (Command, Plugin)):
-                self.register(attr)
+        self.register_many(
+            attr for attr in (getattr(cls, name) for name in dir(cls))
+            if isinstance(attr, (Command, Plugin))
+        )
 
     def register(self, obj):
         '''
         Register a :class:`~pypsi.core.Command` or a
         :class:`~pypsi.core.Plugin`.
         '''
+        return self.register_many((obj,))
 
-        if isinstance(obj, Command):
-            self.commands[obj.name] = obj
-
-        if isinstance(obj, Plugin):
-            self.plugins.append(obj)
-            if obj.preprocess is not None:
-                self.preprocessors.append(obj)
-                self.preprocessors = sorted(self.preprocessors,
-                                            key=lambda x: x.preprocess)
-            if obj.postprocess is not None:
-                self.postprocessors.append(obj)
-                self.postprocessors = sorted(self.postprocessors,
-                                             key=lambda x: x.postprocess)
+    def register_many(self, objs):
+        '''
+        Register several :class:`~pypsi.core.Command` and
+        :class:`~pypsi.core.Plugin` objects at once. The plugin hook lists are
+        rebuilt once, see :meth:`build_plugin_hooks`, and then every object's
+        ``setup`` method is called in order.
 
-        obj.setup(self)
+        :param list objs: the commands and plugins to register
+        '''
+        objs = list(objs)
+        plugins = False
+        for obj in objs:
+            if isinstance(obj, Command):
+                self.commands[obj.name] = obj
+
+            if isinstance(obj, Plugin):
+                self.plugins.append(obj)
+                plugins = True
+
+        if plugins:
+            self.build_plugin_hooks()
+            self.invalidate_parse_cache()
+
+        for obj in objs:
+            obj.setup(self)
         return 0
 
+    def get_command(self, name):
+        '''
+        Get a registered command, loading it if it was registered as a
+        :class:`~pypsi.lazy.LazyCommand` stub.
+
+        :param str name: the command name
+        :returns pypsi.core.Command: the command or :const:`None` if it does
+            not exist
+        '''
+        cmd = self.commands.get(name)
+        if isinstance(cmd, LazyCommand):
+            cmd = cmd.resolve(self)
+        return cmd
+
+    def build_plugin_hooks(self):
+        '''
+        Build the sorted :attr:`preprocessors` and :attr:`postprocessors`
+        lists and, for each plugin hook, the list of plugins that override the
+        hook. Plugins that inherit a hook from :class:`~pypsi.core.Plugin`
+        are never called for it. This is called when a plugin is registered.
+        '''
+        self.preprocessors = sorted(
+            (pp for pp in self.plugins if pp.preprocess is not None),
+            key=lambda x: x.preprocess
+        )
+        self.postprocessors = sorted(
+            (pp for pp in self.plugins if pp.postprocess is not None),
+            key=lambda x: x.postprocess
+        )
+
+        pre = self.preprocessors
+        self.input_plugins = _hook_plugins(pre, 'on_input')
+        self.tokenize_plugins = _hook_plugins(pre, 'on_tokenize')
+        self.cache_key_plugins = _hook_plugins(
+            pre, 'on_tokenize', 'parse_cache_key', 'prompt_cache_key'
+        )
+        self.canceled_plugins = _hook_plugins(pre, 'on_input_canceled')
+        self.finished_plugins = _hook_plugins(self.postprocessors,
+                                              'on_statement_finished')
+        self.timing_plugins = _hook_plugins(self.plugins,
+                                            'on_statement_timing')
+        self.invocation_plugins = _hook_plugins(
+            self.plugins, 'on_invocation_start', 'on_invocation_end'
+        )
+
     def on_shell_ready(self):
         '''
         Hook that is called after the shell has been created.
@@ -178,12 +312,26 @@ class Shell(object):
         return 0
 
     def get_current_prompt(self):
+        '''
+        Get the rendered prompt. The rendered prompt is cached and only
+        rendered again when :attr:`prompt` or the prompt cache key changes,
+        see :meth:`get_prompt_cache_key`.
+
+        :returns str: the rendered prompt
+        '''
         if callable(self.prompt):
             prompt = self.prompt()  # pylint: disable=not-callable
         else:
             prompt = self.prompt
 
-        return self.preprocess_single(prompt, 'prompt')
+        key = self.get_prompt_cache_key(prompt)
+        cache = self._prompt_cache
+        if key is not None and cache and cache[0] == key:
+            return cache[1]
+
+        rendered = self.preprocess_single(prompt, 'prompt')
+        self._prompt_cache = (key, rendered) if key is not None else None
+        return rendered
 
     def set_readline_completer(self):
         if readline.get_completer() != self.complete:  # pylint: disable=comparison-with-callable
@@ -198,11 +346,65 @@ class Shell(object):
             readline.set_completer(self._backup_completer)
 
     def on_input_canceled(self):
-        for pp in self.preprocessors:
+        for pp in self.canceled_plugins:
             pp.on_input_canceled(self)
 
+    def on_statement_finished(self, rc):
+        '''
+        Call the :meth:`~pypsi.core.Plugin.on_statement_finished` hook of the
+        postprocessors.
+
+        :param int rc: the statement's return code
+        '''
+        for pp in self.finished_plugins:
+            pp.on_statement_finished(self, rc)
+
+    def get_token_stages(self):
+        '''
+        Get the objects whose ``on_tokenize`` method is called, in order, to
+        process tokens. This is the list of preprocessors that override
+        :meth:`~pypsi.core.Plugin.on_tokenize`, unless
+        :attr:`fuse_token_rules` is :const:`True`. In that case, consecutive
+        plugins that provide :meth:`~pypsi.core.Plugin.get_token_rules` are
+        replaced by a single :class:`~pypsi.cmdline.TokenRewriter`. If no
+        other plugin processes tokens after the rewriter, it also removes
+        escape sequences, so that each token is scanned only once before the
+        statement is built.
+
+        :returns list: the token processing stages
+        '''
+        if not self.fuse_token_rules:
+            return self.tokenize_plugins
+
+        key = self.features.cache_key()
+        if self._token_stages and self._token_stages[0] == key:
+            return self._token_stages[1]
+
+        stages = []
+        plugins = []
+        rules = []
+        escape_char = self.features.escape_char
+        for pp in self.tokenize_plugins:
+            pp_rules = pp.get_token_rules(self)
+            if pp_rules is not None:
+                plugins.append(pp)
+                rules.append(pp_rules)
+                continue
+
+            if plugins:
+                stages.append(TokenRewriter(plugins, rules, escape_char))
+                plugins, rules = [], []
+            stages.append(pp)
+
+        if plugins:
+            stages.append(TokenRewriter(plugins, rules, escape_char,
+                                        clean=True))
+
+        self._token_stages = (key, stages)
+        return stages
+
     def on_tokenize(self, tokens, origin):
-        for pp in self.preprocessors:
+        for pp in self.get_token_stages():
             tokens = pp.on_tokenize(self, tokens, origin)
             if not tokens:
                 break
@@ -210,38 +412,52 @@ class Shell(object):
 
     def include(self, file):
         '''
-        Read commands from a file and execute them line by line
+        Read commands from a file and execute them statement by statement. The
+        file is parsed with :meth:`~pypsi.cmdline.StatementParser.parse_stream`
+        so statements that span several lines are read directly from the file.
 
         :param file file: File object to read commands from
         :return int: 0 if error free; 1 if an error occurred
         '''
         rc = 1
-        eof = False
+
+        def read_lines():
+            for raw in iter(sys.stdin.readline, ''):
+                text = self.preprocess(raw.rstrip(), 'input')
+                if text is not None:
+                    yield text
+
+        def on_error(e):
+            nonlocal rc
+            self.error(str(e))
+            rc = self.errno = 1
+            self.on_statement_finished(rc)
 
         # set STDIN to the file
         stdin = sys.stdin._get_target()  # pylint: disable=protected-access
         sys.stdin._proxy(file)  # pylint: disable=protected-access
 
+        parser = StatementParser(self.features)
         try:
-            raw = sys.stdin.readline()
-            while not eof and raw:
-                raw = raw.rstrip()
-
+            statements = parser.parse_stream(
+                read_lines(),
+                on_tokenize=lambda tokens: self.on_tokenize(tokens, 'input'),
+                on_error=on_error
+            )
+            for statement in statements:
                 rc = None
                 try:
-                    rc = self.execute(raw)
+                    rc = self.execute_statement(statement)
                 except SystemExit as e:
                     rc = e.code
-                    eof = True
+                    break
                 else:
                     rc = rc or 0
-                    raw = sys.stdin.readline()
                 finally:
                     if rc is not None:
                         self.errno = rc
 
-                    for pp in self.postprocessors:
-                        pp.on_statement_finished(self, rc)
+                    self.on_statement_finished(rc)
         except (EOFError, KeyboardInterrupt):
             print()
             self.on_input_canceled()
@@ -251,6 +467,85 @@ class Shell(object):
             sys.stdin._proxy(stdin)  # pylint: disable=protected-access
         return rc
 
+    def run_batch(self, stream, stop_on_error=False, summary_rc=True):
+        '''
+        Execute a non-interactive script, such as a file or a script piped
+        into the shell. Unlike :meth:`cmdloop`, the prompt is not rendered,
+        :mod:`readline` and :func:`input` are not used, and no continuation
+        prompts are printed: the stream is read in large chunks and parsed
+        with :meth:`~pypsi.cmdline.StatementParser.parse_stream`, so
+        statements that span several lines are read directly from the
+        stream. Commands should not read the script's stream as their stdin,
+        since lines are read ahead of the statement being executed.
+
+        :param file stream: the script stream
+        :param bool stop_on_error: stop at the first statement that returns a
+            non-zero return code or fails to parse
+        :param bool summary_rc: return 0 only if every statement succeeded,
+            and otherwise the return code of the first statement that
+            failed, rather than the return code of the last statement
+        :returns int: the script's return code
+        '''
+        rc = 0
+        first_error = 0
+        syntax_error = False
+
+        def read_lines():
+            while True:
+                lines = stream.readlines(self.BatchChunkSize)
+                if not lines:
+                    break
+                for raw in lines:
+                    text = self.preprocess(raw.rstrip(), 'input')
+                    if text is not None:
+                        yield text
+
+        def on_error(e):
+            nonlocal rc, first_error, syntax_error
+            self.error(str(e))
+            rc = self.errno = 1
+            first_error = first_error or rc
+            syntax_error = True
+            self.on_statement_finished(rc)
+
+        self.running = True
+        parser = StatementParser(self.features)
+        statements = parser.parse_stream(
+            read_lines(),
+            on_tokenize=lambda tokens: self.on_tokenize(tokens, 'input'),
+            on_error=on_error
+        )
+        try:
+            for statement in statements:
+                if syntax_error and stop_on_error:
+                    break
+
+                rc = None
+                try:
+                    rc = self.execute_statement(statement) or 0
+                except SystemExit as e:
+                    rc = e.code
+                    self.running = False
+                finally:
+                    if rc is not None:
+                        self.errno = rc
+
+                    self.on_statement_finished(rc)
+
+                first_error = first_error or rc
+                if not self.running or (rc and stop_on_error):
+                    break
+        except KeyboardInterrupt:
+            print()
+            self.on_input_canceled()
+            rc = -1
+            first_error = first_error or rc
+        finally:
+            statements.close()
+            self.running = False
+
+        return first_error if summary_rc else rc
+
     def cmdloop(self):
         '''
         Begin the input processing loop where the user will be prompted for
@@ -295,8 +590,7 @@ class Shell(object):
                         if rc is not None:
                             self.errno = rc
 
-                        for pp in self.postprocessors:
-                            pp.on_statement_finished(self, rc)
+                        self.on_statement_finished(rc)
         finally:
             self.on_cmdloop_end()
             self.reset_readline_completer()
@@ -315,64 +609,229 @@ class Shell(object):
             os.fdopen(w, 'w')
         )
 
-    def execute(self, raw):
+    def mkobjpipe(self):
         '''
-        Parse and execute a statement.
+        Create an in-memory pipe that passes Python objects between two pipe
+        stages.
 
-        :param str raw: the raw command line to parse.
-        :param function input: a function that returns a string,
-                                overrides default input function (stdin).
-        :returns int: the return code of the statement.
+        :returns tuple: the read and write ends of a new
+            :class:`~pypsi.pipes.ObjectPipe`
         '''
+        pipe = ObjectPipe()
+        return pipe.reader, pipe.writer
 
-        parser = StatementParser(self.features)
-        input_complete = False
-        while not input_complete:
-            text = self.preprocess(raw, 'input')
-            if text is None:
+    def invalidate_parse_cache(self):
+        '''
+        Clear :attr:`parse_cache` and increment :attr:`parse_generation`. This
+        needs to be called whenever state that affects how statements are
+        parsed changes, such as registering a plugin or modifying an alias,
+        so that cached statements and precompiled statements (see
+        :class:`~pypsi.commands.macro.Macro`) are rebuilt.
+        '''
+        self.parse_generation += 1
+        self.parse_cache.clear()
+        self._token_stages = None
+        self._prompt_cache = None
+
+    def get_parse_cache_key(self, text):
+        '''
+        Get the parsed statement cache key for a preprocessed input line. The
+        key is made up of the line, the shell features, and the
+        :meth:`~pypsi.core.Plugin.parse_cache_key` of every preprocessor.
+
+        :param str text: the preprocessed input line
+        :returns tuple: the cache key or :const:`None` if the statement can't
+            be cached
+        '''
+        return self._get_cache_key(text, 'parse_cache_key')
+
+    def get_prompt_cache_key(self, prompt):
+        '''
+        Get the rendered prompt cache key. The key is made up of the prompt,
+        the shell features, and the :meth:`~pypsi.core.Plugin.prompt_cache_key`
+        of every preprocessor.
+
+        :param str prompt: the prompt template, see :attr:`prompt`
+        :returns tuple: the cache key or :const:`None` if the prompt must be
+            rendered every time
+        '''
+        return self._get_cache_key(prompt, 'prompt_cache_key')
+
+    def _get_cache_key(self, text, hook):
+        deps = []
+        for pp in self.cache_key_plugins:
+            dep = getattr(pp, hook)(self, text)
+            if dep is None:
                 return None
+            deps.append(dep)
+
+        key = (text, self.features.cache_key(), tuple(deps))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
 
+    def parse(self, raw, timing=None):
+        '''
+        Preprocess, tokenize, and build a statement from a raw input line. If
+        the line contains an unclosed quotation or ends with an escape
+        character, the remainder of the statement is read from :func:`input`.
+        Single line statements are stored in and retrieved from
+        :attr:`parse_cache`.
+
+        :param str raw: the raw command line to parse
+        :param pypsi.timing.StatementTiming timing: records the time spent in
+            each parsing phase, if not :const:`None`
+        :raises StatementSyntaxError: the statement is invalid
+        :returns pypsi.cmdline.Statement: the parsed statement, or
+            :const:`None` if the line did not contain a statement
+        '''
+        if timing is not None:
+            start = time.perf_counter()
+        text = self.preprocess(raw, 'input')
+        if timing is not None:
+            timing.add('preprocess', time.perf_counter() - start)
+        if text is None:
+            return None
+
+        key = None
+        if self.parse_cache.size > 0:
+            key = self.get_parse_cache_key(text)
+
+        if key is not None:
+            statement = self.parse_cache.get(key)
+            if statement is not None:
+                if timing is not None:
+                    timing.cached = True
+                return statement
+
+        parser = StatementParser(self.features)
+        while True:
+            if timing is not None:
+                start = time.perf_counter()
             try:
                 tokens = parser.tokenize(text)
             except (UnclosedQuotationError, TrailingEscapeError):
-                input_complete = False
+                # This is a multiline input, which is not cached since it
+                # depends on more than one line of input.
+                key = None
             else:
                 # Parsing succeeded, break out of the input loop
-                input_complete = True
+                break
+            finally:
+                if timing is not None:
+                    timing.add('tokenize', time.perf_counter() - start)
 
-            if not input_complete:
-                # This is a multiline input
-                try:
-                    # hide prompt if reading from a file
-                    raw = input("> " if sys.stdin.isatty() else '')
-                except (EOFError, KeyboardInterrupt) as e:
-                    self.on_input_canceled()
-                    raise e
+            try:
+                # hide prompt if reading from a file
+                raw = input("> " if sys.stdin.isatty() else '')
+            except (EOFError, KeyboardInterrupt) as e:
+                self.on_input_canceled()
+                raise e
+
+            if timing is not None:
+                start = time.perf_counter()
+            text = self.preprocess(raw, 'input')
+            if timing is not None:
+                timing.add('preprocess', time.perf_counter() - start)
+            if text is None:
+                return None
 
+        if timing is not None:
+            start = time.perf_counter()
         tokens = self.on_tokenize(tokens, 'input')
-        statement = None
-
+        if timing is not None:
+            timing.add('on_tokenize', time.perf_counter() - start)
         if not tokens:
             return None
 
+        if timing is not None:
+            start = time.perf_counter()
+        statement = parser.build(tokens)
+        if timing is not None:
+            timing.add('build', time.perf_counter() - start)
+        if key is not None and statement:
+            self.parse_cache.put(key, statement)
+        return statement
+
+    def execute(self, raw):
+        '''
+        Parse and execute a statement.
+
+        :param str raw: the raw command line to parse.
+        :returns int: the return code of the statement.
+        '''
+
+        timing = None
+        if self.timing_plugins or self.time_statements:
+            # Statements are only timed if the timing will be used
+            timing = StatementTiming(raw)
+            start = time.perf_counter()
+
         try:
-            statement = parser.build(tokens)
+            statement = self.parse(raw, timing)
         except StatementSyntaxError as e:
             self.error(str(e))
             return 1
 
-        rc = None
-
         if not statement:
             # The line was empty, a comment, or just contained whitespace.
-            return rc
+            return None
+
+        if timing is None:
+            return self.execute_statement(statement)
+
+        rc = self.execute_statement(statement, timing)
+        timing.total = time.perf_counter() - start
+        timing.rc = rc
+        self.on_statement_timing(timing)
+        return rc
+
+    def on_statement_timing(self, timing):
+        '''
+        Called with the timing of a statement that was executed by
+        :meth:`execute`. The timing is stored in the ``statement_timing``
+        attribute of :attr:`ctx` and passed to every plugin that overrides
+        :meth:`~pypsi.core.Plugin.on_statement_timing`.
+
+        :param pypsi.timing.StatementTiming timing: the statement timing
+        '''
+        self.ctx.statement_timing = timing
+        for pp in self.timing_plugins:
+            pp.on_statement_timing(self, timing)
+
+    def execute_statement(self, statement, timing=None):
+        '''
+        Execute a parsed statement.
+
+        :param pypsi.cmdline.Statement statement: the statement to execute,
+            its command invocations must not have been setup yet
+        :param pypsi.timing.StatementTiming timing: records the time spent
+            setting up and running each invocation, if not :const:`None`
+        :returns int: the return code of the statement.
+        '''
+        if statement.has_background():
+            return self.execute_background(statement)
+
+        rc = None
 
         # Setup the invocations
         for invoke in statement:
             try:
                 # Open any and all I/O redirections and resolve the pypsi
                 # command.
-                invoke.setup(self)
+                if timing is None:
+                    invoke.setup(self)
+                else:
+                    start = time.perf_counter()
+                    invoke_timing = timing.invocation(invoke.name,
+                                                      invoke.chain_pipe())
+                    try:
+                        invoke.setup(self)
+                    finally:
+                        invoke_timing.setup = time.perf_counter() - start
+                        timing.add('setup', invoke_timing.setup)
             except Exception as e:
                 for sub in statement:
                     sub.close_streams()
@@ -389,7 +848,7 @@ class Shell(object):
         pipe = []
 
         # Process the statement
-        for invoke in statement:
+        for i, invoke in enumerate(statement):
             if invoke.chain_pipe():
                 # We are in a pipe
                 pipe.append(invoke)
@@ -399,7 +858,7 @@ class Shell(object):
                 if pipe:
                     # We have a pipe built that needs to be executed.
                     # Create the invocation threads for the pipe.
-                    threads, stdin = self.create_pipe_threads(pipe)
+                    threads, stdin = self.create_pipe_threads(pipe, invoke)
                     # Reset the building pipe
                     pipe = []
                     # Set the current invocation's stdin to the last
@@ -414,9 +873,14 @@ class Shell(object):
                     t.start()
 
                 # Execute the invocation in the current thread.
+                start = time.perf_counter() if timing is not None else 0
                 try:
-                    rc = invoke(self)
+                    rc = self.run_invocation(invoke)
+                    elapsed = time.perf_counter() - start
                 except Exception as e:
+                    elapsed = time.perf_counter() - start
+                    start = time.perf_counter()
+
                     # Unhandled exception, stop all threads if any are running.
                     for t in threads:
                         t.stop()
@@ -430,35 +894,20 @@ class Shell(object):
                         # issued. Stop waiting for threads to terminate.
                         pass
 
+                    if timing is not None:
+                        timing.add('join', time.perf_counter() - start)
+
                     # Print thread-specific unhandled exceptions.
                     for t in threads:
                         if t.exc_info:
-                            if t.exc_info[0] == OSError:
-                                msg = t.exc_info[1].strerror
-                            else:
-                                msg = str(t.exc_info[1])
-
-                            print(
-                                AnsiCodes.red, t.invoke.name, ": ", msg,
-                                AnsiCodes.reset, sep=''
-                            )
-
-                    if isinstance(e, KeyboardInterrupt):
-                        # Ctrl+c was entered
-                        print()
-                        rc = -1
-                    elif isinstance(e, SystemExit):
-                        # The command is requesting to exit the shell.
-                        rc = e.code  # pylint: disable=no-member
-                        print("exiting....")
-                        self.running = False
-                    elif isinstance(e, RuntimeError):
-                        # The command was aborted by a generic exception.
-                        self.error("command aborted: " + str(e))
-                        rc = -1
-                    else:
-                        # Unhandled fatal exception, re-raise it
-                        raise
+                            self.print_pipe_error(t.invoke, t.exc_info[1])
+
+                    rc = self.handle_invocation_error(e)
+
+                if timing is not None:
+                    timing.add('run', elapsed)
+                    self.record_invocation_timing(timing, i, rc, elapsed,
+                                                  threads)
 
                 self.errno = rc
 
@@ -468,22 +917,219 @@ class Shell(object):
 
         return rc
 
-    def create_pipe_threads(self, pipe):
+    def record_invocation_timing(self, timing, index, rc, elapsed, threads):
+        '''
+        Record the run time of an invocation that ran in the current thread
+        and of the pipe stages that fed it.
+
+        :param pypsi.timing.StatementTiming timing: the statement timing
+        :param int index: the index of the invocation in the statement
+        :param int rc: the invocation's return code
+        :param float elapsed: the time the invocation ran for
+        :param list threads: the pipe stages that fed the invocation
+        '''
+        invoke_timing = timing.invocations[index]
+        invoke_timing.run = elapsed
+        invoke_timing.rc = rc
+
+        first = index - len(threads)
+        for t, stage_timing in zip(threads, timing.invocations[first:index]):
+            # Stages that are still running are not waited for
+            stage_timing.run = t.elapsed
+            stage_timing.rc = t.rc
+
+    def execute_background(self, statement):
+        '''
+        Execute a statement that contains the background (&) operator. Each
+        list of commands terminated by ``&`` is started as a job in
+        :attr:`jobs` and the remaining commands are executed in the
+        foreground, see :meth:`~pypsi.cmdline.Statement.split_background`.
+
+        :param pypsi.cmdline.Statement statement: the statement to execute
+        :returns int: the return code of the last foreground command, or 0 if
+            the statement ends with ``&``
+        '''
+        rc = None
+        for part, background in statement.split_background():
+            if background:
+                job = self.jobs.start(self, part)
+                self.on_job_started(job)
+                rc = 0
+            else:
+                rc = self.execute_statement(part)
+        return rc
+
+    def on_job_started(self, job):
+        '''
+        Called when a background job is started.
+
+        :param pypsi.jobs.Job job: the new job
+        '''
+        print("[{}] {}".format(job.id, job.text))
+
+    def print_pipe_error(self, invoke, exc):
+        '''
+        Print an unhandled exception that was raised by a pipe stage.
+
+        :param pypsi.cmdline.CommandInvocation invoke: the pipe stage
+        :param Exception exc: the exception
+        '''
+        if type(exc) is OSError:  # pylint: disable=unidiomatic-typecheck
+            msg = exc.strerror
+        else:
+            msg = str(exc)
+
+        print(AnsiCodes.red, invoke.name, ": ", msg, AnsiCodes.reset, sep='')
+
+    def handle_invocation_error(self, e):
+        '''
+        Handle an exception raised by the invocation that ends a pipe, or by
+        a single invocation.
+
+        :param Exception e: the exception
+        :returns int: the return code of the invocation
+        :raises Exception: ``e``, if it is an unhandled fatal exception
+        '''
+        if isinstance(e, KeyboardInterrupt):
+            # Ctrl+c was entered
+            print()
+            rc = -1
+        elif isinstance(e, SystemExit):
+            # The command is requesting to exit the shell.
+            rc = e.code  # pylint: disable=no-member
+            print("exiting....")
+            self.running = False
+        elif isinstance(e, RuntimeError):
+            # The command was aborted by a generic exception.
+            self.error("command aborted: " + str(e))
+            rc = -1
+        else:
+            # Unhandled fatal exception, re-raise it
+            raise e
+        return rc
+
+    def connect_pipe(self, writer, reader=None):
+        '''
+        Create the pipe that connects two adjacent invocations of a pipe. When
+        both commands have a :attr:`~pypsi.core.Command.pipe` type of
+        ``'obj'`` and neither runs in a worker process this is an object pipe
+        (see :meth:`mkobjpipe`), otherwise it is a text pipe (see
+        :meth:`mkpipe`).
+
+        :param pypsi.cmdline.CommandInvocation writer: the invocation that
+            writes to the pipe
+        :param pypsi.cmdline.CommandInvocation reader: the invocation that
+            reads from the pipe, if known
+        :returns tuple: the read and write ends of the pipe
+        '''
+        if (reader and writer.pipe_type() == 'obj' and
+                reader.pipe_type() == 'obj' and
+                writer.isolation() != 'process' and
+                reader.isolation() != 'process'):
+            return self.mkobjpipe()
+        return self.mkpipe()
+
+    def run_invocation(self, invoke):
+        '''
+        Run an invocation and wait for it to finish. Invocations of commands
+        with an :attr:`~pypsi.core.Command.isolation` of ``'process'`` run in
+        a :attr:`process_pool` worker process when one is available, all
+        others run in the current thread.
+
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        :returns int: the invocation's return code
+        '''
+        if (invoke.isolation() == 'process' and self.process_pool and
+                self.process_pool.acquire()):
+            t = ProcessInvocation(self.process_pool, self, invoke)
+            t.start()
+            t.join()
+            if t.exc_info:
+                raise t.exc_info[1]
+            return t.rc
+        return self.call_invocation(invoke, invoke, self)
+
+    def call_invocation(self, invoke, func, *args):
+        '''
+        Call a function that runs an invocation in the current thread. If any
+        plugin overrides :meth:`~pypsi.core.Plugin.on_invocation_start` or
+        :meth:`~pypsi.core.Plugin.on_invocation_end`, the invocation hooks are
+        called before and after the function.
+
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        :param callable func: the function that runs the invocation
+        :returns: the function's return value
+        '''
+        if not self.invocation_plugins:
+            return func(*args)
+
+        self.on_invocation_start(invoke)
+        start = time.perf_counter()
+        try:
+            rc = func(*args)
+        except BaseException:
+            self.on_invocation_end(invoke, None, time.perf_counter() - start,
+                                   sys.exc_info())
+            raise
+        self.on_invocation_end(invoke, rc, time.perf_counter() - start)
+        return rc
+
+    def on_invocation_start(self, invoke):
+        '''
+        Called before an invocation runs, calls the
+        :meth:`~pypsi.core.Plugin.on_invocation_start` hook of the plugins in
+        :attr:`invocation_plugins`.
+
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        '''
+        for pp in self.invocation_plugins:
+            pp.on_invocation_start(self, invoke)
+
+    def on_invocation_end(self, invoke, rc, elapsed, exc_info=None):
+        '''
+        Called after an invocation has finished, calls the
+        :meth:`~pypsi.core.Plugin.on_invocation_end` hook of the plugins in
+        :attr:`invocation_plugins`.
+
+        :param pypsi.cmdline.CommandInvocation invoke: the invocation
+        :param int rc: the invocation's return code
+        :param float elapsed: the number of seconds the invocation ran for
+        :param tuple exc_info: the exception raised by the invocation
+        '''
+        for pp in self.invocation_plugins:
+            pp.on_invocation_end(self, invoke, rc, elapsed, exc_info)
+
+    def create_pipe_threads(self, pipe, consumer=None):
         '''
         Given a pipe (list of :class:`~pypsi.cmdline.CommandInvocation`
-        objects) create a thread to execute for each invocation.
+        objects) create a thread to execute for each invocation. Adjacent
+        invocations are connected by :meth:`connect_pipe`.
 
+        :param list pipe: the invocations to run in threads
+        :param pypsi.cmdline.CommandInvocation consumer: the invocation that
+            reads the last invocation's stdout, if known
         :returns tuple: a tuple containing the list of threads
-            (:class:`~pypsi.pipes.CommandThread`) and the last invocation's
-            stdout stream.
+            (:class:`~pypsi.pipes.InvocationThread`, or
+            :class:`~pypsi.pipes.PooledInvocation` if :attr:`pipe_pool` is
+            set, or :class:`~pypsi.pipes.ProcessInvocation` for process
+            isolated commands) and the last invocation's stdout stream.
         '''
 
         threads = []
         stdin = None
-        for invoke in pipe:
-            next_stdin, stdout = self.mkpipe()
-
-            t = InvocationThread(self, invoke, stdin=stdin, stdout=stdout)
+        for i, invoke in enumerate(pipe):
+            reader = pipe[i + 1] if i + 1 < len(pipe) else consumer
+            next_stdin, stdout = self.connect_pipe(invoke, reader)
+
+            if (invoke.isolation() == 'process' and self.process_pool and
+                    self.process_pool.acquire()):
+                t = ProcessInvocation(self.process_pool, self, invoke,
+                                      stdin=stdin, stdout=stdout)
+            elif self.pipe_pool:
+                t = PooledInvocation(self.pipe_pool, self, invoke,
+                                     stdin=stdin, stdout=stdout)
+            else:
+                t = InvocationThread(self, invoke, stdin=stdin, stdout=stdout)
             threads.append(t)
 
             stdin = next_stdin
@@ -491,7 +1137,7 @@ class Shell(object):
         return threads, stdin
 
     def preprocess(self, raw, origin):  # pylint: disable=unused-argument
-        for pp in self.preprocessors:
+        for pp in self.input_plugins:
             raw = pp.on_input(self, raw)
             if raw is None:
                 break
@@ -541,6 +1187,29 @@ class Shell(object):
 
         return completions
 
+    def get_completion_state(self, line):
+        '''
+        Get the completion state of a line buffer. The state of the previous
+        line buffer is kept in :attr:`completion_state` so that only the
+        characters that were typed since the last completion are tokenized.
+
+        :param str line: line buffer content up to cursor
+        :returns pypsi.cmdline.CompletionState: the current state of the line
+        '''
+        features = TabCompletionFeatures(self.features)
+        state = self.completion_state
+        if not state or (state.parser.features.cache_key() !=
+                         features.cache_key()):
+            state = self.completion_state = CompletionState(features)
+
+        try:
+            state.update(line)
+        except Exception:
+            # Don't keep a partially updated state
+            self.completion_state = None
+            raise
+        return state.current()
+
     def get_completions(self, line, prefix):
         '''
         Get the list of completions given a line buffer and a prefix.
@@ -550,44 +1219,9 @@ class Shell(object):
         :returns list[str]: list of completions
         '''
         try:
-            parser = StatementParser(TabCompletionFeatures(self.features))
-            tokens = parser.tokenize(line)
-            parser.clean_escapes(tokens)
-
-            cmd_name = ""
-            loc = None
-            args = []
-            next_arg = True
+            state = self.get_completion_state(line)
+            cmd_name, loc, args = state.cmd_name, state.loc, state.args
             ret = []
-            in_quote = None
-            for token in tokens:
-                if isinstance(token, StringToken):
-                    in_quote = token.quote if token.open_quote else None
-                    if not cmd_name:
-                        cmd_name = token.text
-                        loc = 'name'
-                    elif loc == 'name':
-                        cmd_name += token.text
-                    else:
-                        if next_arg:
-                            args.append(token.text)
-                            next_arg = False
-                        else:
-                            args[-1] += token.text
-                elif isinstance(token, OperatorToken):
-                    in_quote = None
-                    if token.operator in ('|', ';', '&&', '||'):
-                        cmd_name = None
-                        args = []
-                        next_arg = True
-                    elif token.operator in ('>', '<', '>>'):
-                        loc = 'path'
-                        args = []
-                elif isinstance(token, WhitespaceToken):
-                    in_quote = None
-                    if loc == 'name':
-                        loc = None
-                    next_arg = True
 
             if loc == 'path':
                 ret = path_completer(''.join(args), prefix)
@@ -600,13 +1234,13 @@ class Shell(object):
                 if cmd_name not in self.commands:
                     ret = []
                 else:
-                    if next_arg:
+                    if state.next_arg:
                         args.append('')
 
-                    cmd = self.commands[cmd_name]
+                    cmd = self.get_command(cmd_name)
                     ret = cmd.complete(self, args, prefix)
 
-            ret = self._clean_completions(ret, in_quote)
+            ret = self._clean_completions(ret, state.in_quote)
         except:
             ret = []
 
@@ -642,3 +1276,12 @@ class Shell(object):
         print("substitution:", substitution)
         print("matches:     ", matches)
         print("max_len:     ", max_len)
+
+
+def _hook_plugins(plugins, *hooks):
+    # The plugins that override at least one of the hooks
+    return [
+        pp for pp in plugins
+        if any(getattr(type(pp), hook) is not getattr(Plugin, hook)
+               for hook in hooks)
+    ]
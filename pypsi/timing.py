@@ -0,0 +1,106 @@
+#
+# Copyright (c) 2015, Adam Meily <meily.adam@gmail.com>
+# Pypsi - https://github.com/ameily/pypsi
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+'''
+High resolution timing of the phases of a statement, see
+:meth:`pypsi.shell.Shell.on_statement_timing`.
+'''
+
+import collections
+
+
+class InvocationTiming(object):
+    '''
+    The timing of a single command invocation in a statement.
+    '''
+
+    def __init__(self, name, pipe=False):
+        '''
+        :param str name: the command name
+        :param bool pipe: whether the invocation ran as a pipe stage
+        '''
+        #: The command name
+        self.name = name
+        #: Whether the invocation ran on a thread or process as a pipe stage
+        self.pipe = pipe
+        #: Seconds spent resolving the command and opening I/O redirections
+        self.setup = 0.0
+        #: Seconds the command ran for, or :const:`None` if the command did
+        #: not run or, for a pipe stage, had not finished when the statement
+        #: finished
+        self.run = None
+        #: The invocation's return code
+        self.rc = None
+
+
+class StatementTiming(object):
+    '''
+    The timing of each phase of a statement and of each of its command
+    invocations. All times are in seconds, measured with
+    :func:`time.perf_counter`.
+
+    The phases are:
+
+    - ``preprocess``: the :meth:`~pypsi.core.Plugin.on_input` plugins
+    - ``tokenize``: splitting the input into tokens
+    - ``on_tokenize``: the :meth:`~pypsi.core.Plugin.on_tokenize` plugins
+    - ``build``: building the statement from the tokens
+    - ``setup``: resolving commands and opening I/O redirections
+    - ``run``: running commands and waiting for pipes to finish
+    - ``join``: waiting for pipe stages to stop after an error
+
+    Phases that were skipped, such as tokenizing a statement that was found
+    in the parse cache, are not present in :attr:`phases`.
+    '''
+
+    def __init__(self, text=None):
+        '''
+        :param str text: the raw input line
+        '''
+        #: The raw input line
+        self.text = text
+        #: The time spent in each phase, in the order the phases started
+        self.phases = collections.OrderedDict()
+        #: The :class:`InvocationTiming` of each command invocation
+        self.invocations = []
+        #: Whether the statement was found in the parse cache
+        self.cached = False
+        #: The total time spent executing the statement
+        self.total = 0.0
+        #: The statement's return code
+        self.rc = None
+
+    def add(self, phase, seconds):
+        '''
+        Add time to a phase.
+
+        :param str phase: the phase name
+        :param float seconds: the time spent in the phase
+        '''
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def invocation(self, name, pipe=False):
+        '''
+        Add the timing of a new command invocation.
+
+        :param str name: the command name
+        :param bool pipe: whether the invocation is a pipe stage
+        :returns InvocationTiming: the new invocation timing
+        '''
+        timing = InvocationTiming(name, pipe)
+        self.invocations.append(timing)
+        return timing
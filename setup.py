@@ -17,7 +17,6 @@
 
 # import platform
 import os
-import sys
 from setuptools import setup
 import pypsi
 
@@ -28,10 +27,7 @@ def load_requirements(filename):
 
 
 requirements = load_requirements('requirements.txt')
-if sys.version_info[:2] == (3, 3):
-    dev_requirements = load_requirements('requirements-dev-py33.txt')
-else:
-    dev_requirements = load_requirements('requirements-dev.txt')
+dev_requirements = load_requirements('requirements-dev.txt')
 
 
 print(requirements)
@@ -47,7 +43,11 @@ setup(
     url='https://github.com/ameily/pypsi',
     download_url='https://pypi.python.org/pypi/pypsi',
     packages=['pypsi', 'pypsi.commands', 'pypsi.plugins', 'pypsi.os'],
+    python_requires='>=3.7',
     install_requires=requirements,
+    entry_points={
+        'console_scripts': ['pypsi-batch=pypsi.batch:main']
+    },
     extras_require={
         'dev': dev_requirements
     },
@@ -64,6 +64,12 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Software Development :: User Interfaces',
         'Topic :: Software Development :: Libraries :: Application Frameworks',
         'Topic :: Terminals'
@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture
+def bootstrap(request, capsys):  # pylint: disable=unused-argument
+    '''
+    Bootstrap the test class's shell. Pipe threads require the thread local
+    streams, which must wrap the streams that pytest captures output with, so
+    the shell is bootstrapped after ``capsys`` and the class's ``setup``.
+    The class's ``teardown`` restores the shell.
+    '''
+    request.instance.shell.bootstrap()
+    return request.instance.shell
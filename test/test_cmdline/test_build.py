@@ -95,7 +95,7 @@ class TestCmdlineBuild:
             ])
         )
 
-    @pytest.mark.parametrize('op', ('|', '&&', '||', ';'))
+    @pytest.mark.parametrize('op', ('|', '&&', '||', ';', '&'))
     def test_chain_operator(self, op):
         assert (
             self.parser.build([
@@ -141,21 +141,22 @@ class TestCmdlineBuild:
                 OperatorToken(1, op)
             ])
 
-    def test_trailing_semicolon(self):
+    @pytest.mark.parametrize('op', (';', '&'))
+    def test_trailing_terminator(self, op):
         assert (
             self.parser.build([
                 StringToken(0, "echo"),
                 WhitespaceToken(1),
-                OperatorToken(2, ';')
+                OperatorToken(2, op)
             ]) == Statement([
                 CommandInvocation(
                     name="echo",
-                    chain=";"
+                    chain=op
                 )
             ])
         )
 
-    @pytest.mark.parametrize('op', ('|', '||', '&&', ';', '>', '>>', '<'))
+    @pytest.mark.parametrize('op', ('|', '||', '&&', ';', '&', '>', '>>', '<'))
     def test_leading_operator(self, op):
         with pytest.raises(StatementSyntaxError):
             self.parser.build([
@@ -186,5 +187,19 @@ class TestCmdlineBuild:
         with pytest.raises(StatementSyntaxError):
             self.parser.build([
                 StringToken(0, "echo"),
-                OperatorToken(1, "&")
+                OperatorToken(1, "&&&"),
+                StringToken(4, "echo")
             ])
+
+    def test_split_background(self):
+        statement = Statement([
+            CommandInvocation("a", chain='&&'),
+            CommandInvocation("b", chain='&'),
+            CommandInvocation("c", chain=';'),
+            CommandInvocation("d")
+        ])
+        parts = statement.split_background()
+        assert [([i.name for i in s], bg) for (s, bg) in parts] == [
+            (['a', 'b'], True), (['c'], False), (['d'], False)
+        ]
+        assert str(parts[0][0]) == "a && b"
@@ -0,0 +1,59 @@
+import tracemalloc
+from pypsi import cmdline
+from pypsi.cmdline import *
+from pypsi.features import BashFeatures
+
+
+LINE = "echo \"hello world\" a\\ b --flag=1 | grep -v x >> out.txt && cat out.txt"
+COUNT = 2000
+SLOTTED = (
+    'WhitespaceToken', 'StringToken', 'OperatorToken', 'CommandInvocation',
+    'Statement'
+)
+
+
+def bytes_per_statement():
+    '''
+    Measure the memory that is retained by each parsed statement and its
+    tokens.
+    '''
+    features = BashFeatures()
+    # Each statement gets its own line, like reading a script
+    lines = [LINE + str(i) for i in range(COUNT)]
+    results = []
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for line in lines:
+            parser = StatementParser(features)
+            tokens = parser.tokenize(line)
+            results.append((tokens, parser.build(list(tokens))))
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    return (after - before) / COUNT
+
+
+class TestStatementMemory(object):
+
+    def test_no_instance_dict(self):
+        for obj in (WhitespaceToken(0), StringToken(0, 'a'),
+                    OperatorToken(0, '|'), CommandInvocation('echo'),
+                    Statement(), Expression('a', '=', 'b')):
+            assert not hasattr(obj, '__dict__')
+
+    def test_bytes_per_statement(self, monkeypatch):
+        after = bytes_per_statement()
+
+        # Each class is replaced with a subclass that has a per-instance
+        # __dict__, which is how the classes were laid out before __slots__.
+        for name in SLOTTED:
+            cls = getattr(cmdline, name)
+            monkeypatch.setattr(cmdline, name, type(name, (cls,), {}))
+        before = bytes_per_statement()
+
+        print("\nbytes per parsed statement: before={:.0f} after={:.0f}".format(
+            before, after
+        ))
+        assert after < before
@@ -0,0 +1,73 @@
+import pytest
+from pypsi.cmdline import *
+from pypsi.cmdline import UnclosedQuotationError, TrailingEscapeError
+from pypsi.features import BashFeatures
+
+
+class TestParseStream(object):
+
+    def setup(self):
+        self.parser = StatementParser(features=BashFeatures())
+
+    def test_single_lines(self):
+        statements = list(self.parser.parse_stream([
+            "echo hello\n", "\n", "cat file | grep x\n"
+        ]))
+        assert statements == [
+            Statement([CommandInvocation('echo', ['hello'])]),
+            Statement([
+                CommandInvocation('cat', ['file'], chain='|'),
+                CommandInvocation('grep', ['x'])
+            ])
+        ]
+
+    def test_multiline_quote(self):
+        statements = list(self.parser.parse_stream([
+            "echo \"hello\n", "world\" x\n", "echo done\n"
+        ]))
+        assert statements == [
+            Statement([CommandInvocation('echo', ['hello\nworld', 'x'])]),
+            Statement([CommandInvocation('echo', ['done'])])
+        ]
+
+    def test_trailing_escape(self):
+        statements = list(self.parser.parse_stream([
+            "echo hello \\\n", "world\n"
+        ]))
+        assert statements == [
+            Statement([CommandInvocation('echo', ['hello', 'world'])])
+        ]
+
+    def test_lazy(self):
+        lines = iter(["echo 1\n", "echo 2\n"])
+        statements = self.parser.parse_stream(lines)
+        next(statements)
+        assert next(lines) == "echo 2\n"
+
+    def test_on_tokenize(self):
+        def on_tokenize(tokens):
+            return None if tokens[0].text == 'skip' else tokens
+
+        statements = list(self.parser.parse_stream(
+            ["skip me\n", "echo x\n"], on_tokenize=on_tokenize
+        ))
+        assert statements == [Statement([CommandInvocation('echo', ['x'])])]
+
+    def test_syntax_error_raised(self):
+        with pytest.raises(StatementSyntaxError):
+            list(self.parser.parse_stream(["echo x |\n"]))
+
+    def test_on_error(self):
+        errors = []
+        statements = list(self.parser.parse_stream(
+            ["echo x |\n", "echo y\n", "echo \"open\n"],
+            on_error=errors.append
+        ))
+        assert statements == [Statement([CommandInvocation('echo', ['y'])])]
+        assert [type(e) for e in errors] == [
+            StatementSyntaxError, UnclosedQuotationError
+        ]
+
+    def test_eof_escape(self):
+        with pytest.raises(TrailingEscapeError):
+            list(self.parser.parse_stream(["echo x \\\n"]))
@@ -0,0 +1,113 @@
+import pytest
+from pypsi.cmdline import *
+from pypsi.cmdline import UnclosedQuotationError
+from pypsi.features import BashFeatures, PypsiFeatures, RegexTokenizer
+from test.test_cmdline import test_tokenize
+
+
+def regex_features(**kwargs):
+    return PypsiFeatures(tokenizer=RegexTokenizer, **kwargs)
+
+
+def dump(tokens):
+    return [
+        (type(t).__name__, t.index, getattr(t, 'text', None),
+         getattr(t, 'operator', None), getattr(t, 'quote', None),
+         getattr(t, 'escape', None), getattr(t, 'open_quote', None))
+        for t in tokens
+    ]
+
+
+CORPUS = [
+    "echo \thello",
+    "echo 'hello'",
+    "echo \"hello\"",
+    "echo \"hello\"\"world\"",
+    "echo 'hello''world'",
+    "echo \"hello\"'world'",
+    "echo hello\"world\"goodbye",
+    "echo hello\\ world",
+    "echo hello\\\"",
+    "echo \"hello \\\"world\\\"\"",
+    "echo \\\\ hello",
+    "echo '\\\\'",
+    "echo '\\c'",
+    "echo \\",
+    "echo \\x1b[1;31mred",
+    "echo hello\xa0\xa0world",
+    "cmd1 && cmd2 || cmd3 ; cmd4 | cmd5 & cmd6",
+    "echo hello >> out.txt < in.txt",
+    "echo <>|&;;&&>>",
+    "echo \"unclosed",
+    "echo 'unclosed \\' quote",
+    "",
+    "   ",
+    "\\",
+] + [
+    "echo {}{}{}".format(q, op, q)
+    for q in ('', "'", '"')
+    for op in test_tokenize.OPERATORS
+] + [
+    "echo \\" + '\\'.join(op) for op in test_tokenize.OPERATORS
+] + [
+    fmt.format(op)
+    for fmt in ("echo {} postfix", "echo {}postfix", "echo{} postfix",
+                "echo{}postfix")
+    for op in test_tokenize.OPERATORS
+]
+
+
+class TestCmdlineTokenizeRegex(test_tokenize.TestCmdlineTokenize):
+    '''
+    Run the character tokenizer test suite against the regex tokenizer.
+    '''
+
+    def setup(self):
+        self.parser = StatementParser(features=regex_features(multiline=True))
+
+    def test_trailing_escape_no_multiline(self):
+        self.parser.features = regex_features(multiline=False)
+        t = StringToken(2, "")
+        t.text = "\\"
+        assert self.parser.tokenize("echo \\") == [
+            StringToken(0, "echo"),
+            WhitespaceToken(1),
+            t
+        ]
+
+
+class TestCmdlineScanDifferential(object):
+
+    @pytest.mark.parametrize('escape_char', ('\\', '`', ''))
+    @pytest.mark.parametrize('line', CORPUS)
+    def test_same_tokens(self, line, escape_char):
+        char = StatementParser(PypsiFeatures(escape_char=escape_char))
+        regex = StatementParser(regex_features(escape_char=escape_char))
+        assert dump(regex.tokenize(line)) == dump(char.tokenize(line))
+
+    @pytest.mark.parametrize('lines', (
+        ("echo \"hello", "world\" done"),
+        ("echo 'a", "b", "c' d"),
+        ("echo hello \\", "world"),
+        ("echo hello \\", "\\", "x"),
+    ))
+    def test_same_tokens_multiline(self, lines):
+        results = []
+        for features in (BashFeatures(), regex_features(multiline=True)):
+            parser = StatementParser(features)
+            for line in lines:
+                try:
+                    tokens = parser.tokenize(line)
+                except (UnclosedQuotationError, TrailingEscapeError) as e:
+                    results.append(type(e))
+            results.append(dump(tokens))
+
+        half = len(results) // 2
+        assert results[:half] == results[half:]
+
+    def test_same_statement(self):
+        line = "echo \"hello \\\"world\\\"\" a\\ b && cat < in | grep x >> out"
+        char = StatementParser(BashFeatures())
+        regex = StatementParser(regex_features(multiline=True))
+        assert (regex.build(regex.tokenize(line)) ==
+                char.build(char.tokenize(line)))
@@ -0,0 +1,58 @@
+from pypsi.cmdline import *
+
+
+def make_statement(*names):
+    return Statement([CommandInvocation(name, ['arg'], chain=';')
+                      for name in names])
+
+
+class TestStatementCache(object):
+
+    def test_miss(self):
+        cache = StatementCache(2)
+        assert cache.get('key') is None
+        assert cache.misses == 1
+        assert cache.hits == 0
+
+    def test_hit_returns_copy(self):
+        cache = StatementCache(2)
+        statement = make_statement('echo')
+        cache.put('key', statement)
+
+        first = cache.get('key')
+        first[0].args.append('modified')
+        first[0].stdout = 'file.txt'
+
+        assert cache.get('key') == statement
+        assert cache.get('key') is not first
+        assert cache.hits == 3
+
+    def test_put_stores_copy(self):
+        cache = StatementCache(2)
+        statement = make_statement('echo')
+        cache.put('key', statement)
+        statement[0].args.append('modified')
+        assert cache.get('key') == make_statement('echo')
+
+    def test_evict_lru(self):
+        cache = StatementCache(2)
+        cache.put('a', make_statement('a'))
+        cache.put('b', make_statement('b'))
+        cache.get('a')
+        cache.put('c', make_statement('c'))
+
+        assert len(cache) == 2
+        assert cache.get('b') is None
+        assert cache.get('a') == make_statement('a')
+        assert cache.get('c') == make_statement('c')
+
+    def test_disabled(self):
+        cache = StatementCache(0)
+        cache.put('a', make_statement('a'))
+        assert len(cache) == 0
+
+    def test_clear(self):
+        cache = StatementCache(2)
+        cache.put('a', make_statement('a'))
+        cache.clear()
+        assert cache.get('a') is None
@@ -0,0 +1,75 @@
+import pytest
+import tracemalloc
+from pypsi.cmdline import *
+from pypsi.cmdline import TrailingEscapeError, UnclosedQuotationError
+from pypsi.features import BashFeatures, PypsiFeatures, RegexTokenizer
+
+
+class TestTokenSpan(object):
+
+    def setup(self):
+        self.parser = StatementParser(features=BashFeatures())
+
+    def test_references_line(self):
+        line = "echo hello"
+        tokens = self.parser.tokenize(line)
+        assert tokens[2]._line is line
+        assert (tokens[2]._start, tokens[2]._end) == (5, 10)
+        assert tokens[2].text == "hello"
+        assert tokens[2]._line is None
+
+    def test_escape_map(self):
+        line = "echo hello\\ world\\|x"
+        tokens = self.parser.tokenize(line)
+        assert list(tokens[2]._skips) == [10, 17]
+        assert tokens[2].text == "hello world|x"
+
+    def test_quoted_span(self):
+        line = "echo \"a \\\"b\\\" \\c\""
+        tokens = self.parser.tokenize(line)
+        assert tokens[2].text == "a \"b\" \\c"
+        assert tokens[2].quote == '"'
+
+    def test_pending_escape(self):
+        with pytest.raises(TrailingEscapeError):
+            self.parser.tokenize("echo \\")
+        token = self.parser.token
+        assert token.escape
+        assert token.text == ''
+
+    def test_set_text(self):
+        token = self.parser.tokenize("echo hello")[2]
+        token.text = "goodbye"
+        assert token.text == "goodbye"
+        token.add_char("!")
+        assert token.text == "goodbye!"
+
+    def test_operator_span(self):
+        line = "echo a >> b"
+        token = self.parser.tokenize(line)[4]
+        assert token._line is line
+        assert token.operator == ">>"
+
+    def test_multiline_detach(self):
+        try:
+            self.parser.tokenize("echo \"hello")
+        except UnclosedQuotationError:
+            pass
+        tokens = self.parser.tokenize("world\" x")
+        assert tokens[2].text == "hello\nworld"
+        assert tokens[4].text == "x"
+
+    def test_tokenize_does_not_copy(self):
+        line = "echo " + "x" * 100000 + " \"" + "y" * 100000 + "\""
+        for tokenizer in ('char', RegexTokenizer):
+            parser = StatementParser(PypsiFeatures(tokenizer=tokenizer))
+            tracemalloc.start()
+            try:
+                tokens = parser.tokenize(line)
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            assert peak < len(line) // 10
+            assert len(tokens[2].text) == 100000
+            assert len(tokens[4].text) == 100000
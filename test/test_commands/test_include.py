@@ -1,14 +1,69 @@
+import os
+import tempfile
+from pypsi.core import Command
 from pypsi.shell import Shell
 from pypsi.commands.include import IncludeCommand
+from pypsi.plugins.variable import VariablePlugin
+
+
+class RecordCommand(Command):
+
+    def __init__(self):
+        super().__init__(name='record')
+        self.calls = []
+
+    def run(self, shell, args):
+        self.calls.append(list(args))
+        return 0
+
 
 class CmdShell(Shell):
-    include = IncludeCommand()
+    include_cmd = IncludeCommand()
+    var = VariablePlugin(env=False)
 
 
 class TestInclude:
 
     def setup(self):
         self.shell = CmdShell()
+        self.record = RecordCommand()
+        self.shell.register(self.record)
+        self.fp = tempfile.NamedTemporaryFile('w', delete=False)
 
     def teardown(self):
         self.shell.restore()
+        os.remove(self.fp.name)
+
+    def run_script(self, script):
+        self.fp.write(script)
+        self.fp.close()
+        return self.shell.include(open(self.fp.name))
+
+    def test_include(self):
+        rc = self.run_script("record hello\nrecord world\n")
+        assert rc == 0
+        assert self.record.calls == [['hello'], ['world']]
+
+    def test_include_command(self):
+        self.fp.write("record hello\n")
+        self.fp.close()
+        assert self.shell.execute("include " + self.fp.name) == 0
+        assert self.record.calls == [['hello']]
+
+    def test_include_multiline(self):
+        self.run_script("record \"hello\nworld\" x\nrecord done\n")
+        assert self.record.calls == [['hello\nworld', 'x'], ['done']]
+
+    def test_include_variables(self):
+        self.run_script("var x = 1\nrecord $x\nvar x = 2\nrecord $x\n")
+        assert self.record.calls == [['1'], ['2']]
+
+    def test_include_syntax_error(self):
+        rc = self.run_script("record a |\nrecord b\n")
+        assert rc == 0
+        assert self.record.calls == [['b']]
+
+    def test_include_unclosed_quote(self):
+        rc = self.run_script("record a\nrecord \"b\n")
+        assert rc == 1
+        assert self.record.calls == [['a']]
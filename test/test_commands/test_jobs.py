@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import pytest
+from pypsi.asyncshell import AsyncShell
+from pypsi.core import Command
+from pypsi.shell import Shell
+from pypsi.commands.echo import EchoCommand
+from pypsi.commands.jobs import JobsCommand, FgCommand, WaitCommand
+
+
+class BlockCommand(Command):
+    '''
+    Wait until the test releases the command and return the first argument.
+    '''
+
+    def __init__(self, name='block', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.release = threading.Event()
+
+    def run(self, shell, args):
+        self.release.wait(5)
+        print("released")
+        return int(args[0]) if args else 0
+
+
+class CmdShell(Shell):
+    echo = EchoCommand()
+    block = BlockCommand()
+    jobs_cmd = JobsCommand()
+    fg = FgCommand()
+    wait = WaitCommand()
+
+
+class AsyncCmdShell(AsyncShell):
+    echo = EchoCommand()
+    wait = WaitCommand()
+
+
+@pytest.mark.usefixtures('bootstrap')
+class TestJobs(object):
+
+    def setup(self):
+        self.shell = CmdShell()
+        CmdShell.block.release.clear()
+
+    def teardown(self):
+        CmdShell.block.release.set()
+        self.shell.restore()
+
+    def test_background(self, capsys):
+        assert self.shell.execute("block 5 &") == 0
+        job = self.shell.jobs.get(1)
+        assert job.text == "block 5 &"
+        assert job.state() == 'Running'
+        assert capsys.readouterr().out == "[1] block 5 &\n"
+
+        CmdShell.block.release.set()
+        assert self.shell.execute("wait") == 5
+        assert len(self.shell.jobs) == 0
+        assert "released" in capsys.readouterr().out
+
+    def test_foreground(self, capsys):
+        assert self.shell.execute("block 5 & echo hello") == 0
+        assert capsys.readouterr().out == "[1] block 5 &\nhello\n"
+        CmdShell.block.release.set()
+        assert self.shell.jobs.get(1).wait(5)
+
+    def test_and_list(self):
+        CmdShell.block.release.set()
+        self.shell.execute("block 1 && echo hello & block 2 &")
+        assert [job.text for job in self.shell.jobs] == [
+            "block 1 && echo hello &", "block 2 &"
+        ]
+        assert self.shell.execute("wait %1") == 1
+        assert self.shell.execute("wait 2") == 2
+
+    def test_capture_output(self, capsys):
+        self.shell.jobs.capture_output = True
+        self.shell.execute("echo hello &")
+        job = self.shell.jobs.get(1)
+        assert job.wait(5)
+        assert job.output == "hello\n"
+        capsys.readouterr()
+
+        assert self.shell.execute("fg") == 0
+        assert capsys.readouterr().out == "echo hello &\nhello\n"
+
+    def test_jobs(self, capsys):
+        CmdShell.block.release.set()
+        self.shell.execute("block 3 &")
+        assert self.shell.jobs.get(1).wait(5)
+        capsys.readouterr()
+
+        assert self.shell.execute("jobs") == 0
+        assert capsys.readouterr().out == "[1]  Done(3)     block 3 &\n"
+        assert len(self.shell.jobs) == 0
+
+    def test_no_such_job(self, capsys):
+        assert self.shell.execute("fg %1") == 1
+        assert "no such job" in capsys.readouterr().err
+        assert self.shell.execute("fg") == 1
+        assert "no current job" in capsys.readouterr().err
+
+    def test_async_background(self, capsys):
+        shell = AsyncCmdShell()
+        shell.jobs.capture_output = True
+
+        async def run():
+            assert await shell.execute_async("echo hello &") == 0
+            job = shell.jobs.get(1)
+            await job.task
+            return job
+
+        try:
+            shell.bootstrap()
+            job = asyncio.run(run())
+            assert job.rc == 0
+            assert job.output == "hello\n"
+        finally:
+            shell.restore()
@@ -1,13 +1,46 @@
+import sys
+import threading
 from io import StringIO
 from unittest.mock import patch
 from pypsi.shell import Shell
-from pypsi.commands.macro import MacroCommand, Macro
+from pypsi.commands.echo import EchoCommand
+from pypsi.commands.macro import MacroCommand, Macro, MacroPlan
+from pypsi.core import Command, Plugin
+from pypsi.plugins.block import BlockPlugin
 from pypsi.plugins.variable import VariablePlugin
+from pypsi.cmdline import Statement, CommandInvocation
+
+
+class InputCounterPlugin(Plugin):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.count = 0
+
+    def on_input(self, shell, line):
+        self.count += 1
+        return line
+
+
+class ArgVarsCommand(Command):
+
+    def __init__(self, name='argvars', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.seen = None
+
+    def run(self, shell, args):
+        self.seen = [name for name in '0123456789' if name in shell.ctx.vars]
+        return 0
+
 
 class CmdShell(Shell):
     cmd = MacroCommand(macros={'test': ['echo hello']})
     macro = Macro(['echo hello'], name='test')
     variable = VariablePlugin()
+    block = BlockPlugin()
+    counter = InputCounterPlugin(preprocess=50)
+    echo = EchoCommand()
+    argvars = ArgVarsCommand()
 
 
 class TestMacro:
@@ -36,12 +69,140 @@ class TestMacro:
         assert '0' not in self.shell.ctx.vars
         assert '1' not in self.shell.ctx.vars
 
-    @patch('test.test_commands.test_macro.CmdShell.execute')
+    @patch('test.test_commands.test_macro.CmdShell.execute_statement')
     def test_macro_run(self, exec_mock):
         exec_mock.return_value = 0
         rc = self.macro.run(self.shell, [])
         assert rc == 0
-        exec_mock.assert_called_with('echo hello')
+        exec_mock.assert_called_with(
+            Statement([CommandInvocation('echo', ['hello'])])
+        )
+
+    @patch('test.test_commands.test_macro.CmdShell.execute')
+    def test_macro_run_lines(self, exec_mock):
+        exec_mock.return_value = 0
+        macro = Macro(['echo $date'], name='test')
+        rc = macro.run(self.shell, [])
+        assert rc == 0
+        assert macro.plans[0].key is None
+        exec_mock.assert_called_with('echo $date')
+
+    def test_macro_run_lines_arg_vars(self, capsys):
+        macro = Macro(['echo $1 $date'], name='test')
+        macro.run(self.shell, ['first'])
+        assert capsys.readouterr().out.startswith("first ")
+        assert '1' not in self.shell.ctx.vars
+
+    def test_macro_run_lines_preprocess_once(self):
+        macro = Macro(['echo $date'], name='test')
+        macro.run(self.shell, [])
+        count = self.shell.counter.count
+        macro.run(self.shell, [])
+        assert self.shell.counter.count == count + 1
+
+    def test_macro_preprocess_once(self):
+        macro = Macro(['echo $1', 'echo $2'], name='test')
+        macro.run(self.shell, ['a', 'b'])
+        count = self.shell.counter.count
+        macro.run(self.shell, ['c', 'd'])
+        assert self.shell.counter.count == count
+
+    def test_macro_vars_not_modified(self):
+        macro = Macro(['argvars $1'], name='test')
+        version = self.shell.ctx.vars._version
+        macro.run(self.shell, ['a'])
+        assert self.shell.argvars.seen == []
+        assert self.shell.ctx.vars._version == version
+
+    def test_macro_concurrent_runs(self):
+        macro = Macro(['echo $0 $1'], name='test')
+        seen = []
+
+        def execute_statement(statement):
+            seen.append((threading.get_ident(), statement[0].args))
+
+        def worker():
+            for _ in range(200):
+                macro.run(self.shell, [str(threading.get_ident())])
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with patch.object(self.shell, 'execute_statement',
+                              execute_statement):
+                threads = [threading.Thread(target=worker) for _ in range(4)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        assert len(seen) == 800
+        for ident, args in seen:
+            assert args == ['test', str(ident)]
+
+    def test_macro_records_block(self):
+        macro = Macro(['macro inner', 'echo $1', 'end'], name='outer')
+        macro.run(self.shell, ['a'])
+        assert self.shell.ctx.macros['inner'] == ['echo $1']
+
+    @patch('test.test_commands.test_macro.CmdShell.execute_statement')
+    def test_macro_run_bind_args(self, exec_mock):
+        macro = Macro(['echo $0 $1 "$2 x" > $3.txt'], name='test')
+        macro.run(self.shell, ['a', 'b c', 'out'])
+        macro.run(self.shell, ['d'])
+        assert [c[0][0] for c in exec_mock.call_args_list] == [
+            Statement([CommandInvocation('echo', ['test', 'a', 'b c x'],
+                                         stdout=('out.txt', 'w'))]),
+            Statement([CommandInvocation('echo', ['test', 'd', ' x'],
+                                         stdout=('.txt', 'w'))]),
+        ]
+        assert '1' not in self.shell.ctx.vars
+
+    @patch('test.test_commands.test_macro.CmdShell.execute_statement')
+    def test_macro_compile_once(self, exec_mock):
+        macro = Macro(['echo $1'], name='test')
+        macro.run(self.shell, ['a'])
+        plan = macro.plans[0]
+        macro.run(self.shell, ['b'])
+        assert macro.plans[0] is plan
+        assert isinstance(plan, MacroPlan)
+
+    @patch('test.test_commands.test_macro.CmdShell.execute_statement')
+    def test_macro_recompile_var_change(self, exec_mock):
+        macro = Macro(['echo $1 $name'], name='test')
+        self.shell.ctx.vars['name'] = 'first'
+        macro.run(self.shell, ['a'])
+        self.shell.ctx.vars['name'] = 'second'
+        macro.run(self.shell, ['a'])
+        assert exec_mock.call_args[0][0][0].args == ['a', 'second']
+
+    @patch('test.test_commands.test_macro.CmdShell.execute_statement')
+    def test_macro_unrelated_var_change(self, exec_mock):
+        macro = Macro(['echo $1 $name'], name='test')
+        macro.run(self.shell, ['a'])
+        plan = macro.plans[0]
+        self.shell.ctx.vars['other'] = 'value'
+        macro.run(self.shell, ['b'])
+        assert macro.plans[0] is plan
+
+    def test_macro_recompile_invalidate(self):
+        macro = Macro(['echo hello'], name='test')
+        plan = macro.get_plan(self.shell, 0)
+        self.shell.invalidate_parse_cache()
+        assert macro.get_plan(self.shell, 0) is not plan
+
+    def test_macro_sets_var(self, capsys):
+        macro = Macro(['var x = hello', 'echo x is $x'], name='test')
+        macro.run(self.shell, [])
+        assert capsys.readouterr().out == "x is hello\n"
+
+    def test_macro_sets_var_from_arg(self, capsys):
+        macro = Macro(['var y = $1', 'echo y is $y'], name='test')
+        macro.run(self.shell, ['first'])
+        macro.run(self.shell, ['second'])
+        assert capsys.readouterr().out == "y is first\ny is second\n"
 
     @patch('sys.stderr', new_callable=StringIO)
     def test_cmd_help(self, stderr):
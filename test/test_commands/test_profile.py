@@ -0,0 +1,77 @@
+import pstats
+import sys
+import pytest
+from pypsi.core import Command
+from pypsi.shell import Shell
+from pypsi.commands.echo import EchoCommand
+from pypsi.commands.profile import ProfileCommand
+
+
+def stage_work(line):
+    return line.upper()
+
+
+class UpperCommand(Command):
+
+    def __init__(self, name='upper', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write(stage_work(line))
+        return int(args[0]) if args else 0
+
+
+class CmdShell(Shell):
+    echo = EchoCommand()
+    upper = UpperCommand()
+    profile = ProfileCommand()
+
+
+@pytest.mark.usefixtures('bootstrap')
+class TestProfile(object):
+
+    def setup(self):
+        self.shell = CmdShell()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def test_print(self, capsys):
+        assert self.shell.execute("profile echo hello") == 0
+        out = capsys.readouterr().out
+        assert out.startswith("hello\n")
+        assert "function calls in" in out
+        assert "ncalls" in out
+        assert "echo.py" in out
+        assert self.shell.pipe_profiler is None
+
+    def test_pipe_stages(self, tmp_path, capsys):
+        path = tmp_path / 'profile.out'
+        assert self.shell.execute(
+            'profile -o {} "echo hello | upper | upper 3"'.format(path)
+        ) == 3
+        assert capsys.readouterr().out == "HELLO\n"
+
+        stats = pstats.Stats(str(path))
+        funcs = {name: stat for (_, _, name), stat in stats.stats.items()}
+        # The first upper runs on a pipe thread and the second in the
+        # current thread
+        assert funcs['stage_work'][1] == 2
+
+    def test_sort_key(self, capsys):
+        assert self.shell.execute("profile -s tottime -n 1 echo hello") == 0
+        lines = capsys.readouterr().out.splitlines()
+        # The rows follow the table header's separator, a row starts with
+        # the number of calls and wrapped columns start with whitespace.
+        sep = max(i for i, line in enumerate(lines) if line.startswith("="))
+        rows = lines[sep + 1:]
+        assert len([row for row in rows if row[:1].isdigit()]) == 1
+
+    def test_invalid_sort_key(self, capsys):
+        assert self.shell.execute("profile -s nothing echo hello") == 1
+        assert "invalid choice" in capsys.readouterr().err
+
+    def test_missing_statement(self, capsys):
+        assert self.shell.execute("profile") == 1
+        assert "missing statement" in capsys.readouterr().err
@@ -1,14 +1,90 @@
+import threading
+import pytest
+from pypsi.core import Command
 from pypsi.shell import Shell
+from pypsi.commands.echo import EchoCommand
 from pypsi.commands.xargs import XArgsCommand
 
+
+class RecordCommand(Command):
+    '''
+    Record the arguments of each invocation and return the first argument.
+    '''
+
+    def __init__(self, name='record', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def run(self, shell, args):
+        with self.lock:
+            self.calls.append(args)
+        return int(args[0]) if args and args[0].isdigit() else 0
+
+
 class CmdShell(Shell):
     xargs = XArgsCommand()
+    echo = EchoCommand()
+    record = RecordCommand()
 
 
+@pytest.mark.usefixtures('bootstrap')
 class TestXArgs:
 
     def setup(self):
         self.shell = CmdShell()
+        CmdShell.record.calls = []
 
     def teardown(self):
         self.shell.restore()
+
+    def execute(self, tmp_path, lines, cmd):
+        path = tmp_path / 'input.txt'
+        path.write_text(''.join(line + '\n' for line in lines))
+        return self.shell.execute("{} < {}".format(cmd, path))
+
+    def test_token(self, tmp_path):
+        assert self.execute(tmp_path, ['a', '', 'b'], "xargs record x {}") == 0
+        assert CmdShell.record.calls == [['x', 'a'], ['x', 'b']]
+
+    def test_max_args(self, tmp_path):
+        assert self.execute(tmp_path, ['a', 'b', 'c'],
+                            "xargs -n 2 record {} x") == 0
+        assert CmdShell.record.calls == [['a', 'b', 'x'], ['c', 'x']]
+
+    def test_embedded_token(self, tmp_path):
+        assert self.execute(tmp_path, ['a', 'b'],
+                            "xargs -n 2 record x={}") == 0
+        assert CmdShell.record.calls == [['x=a b']]
+
+    def test_no_token(self, tmp_path):
+        assert self.execute(tmp_path, ['a', 'b'], "xargs record x") == 0
+        assert CmdShell.record.calls == [['x', 'a'], ['x', 'b']]
+
+    def test_template_statement(self, tmp_path, capsys):
+        assert self.execute(tmp_path, ['a', 'b'],
+                            'xargs -I@ "echo line: @"') == 0
+        assert capsys.readouterr().out == "line: a\nline: b\n"
+
+    def test_failed(self, tmp_path):
+        assert self.execute(tmp_path, ['0', '3', '0'], "xargs record") == 123
+        assert len(CmdShell.record.calls) == 3
+
+    def test_parallel(self, tmp_path):
+        lines = [str(i) for i in range(1, 50)]
+        assert self.execute(tmp_path, lines, "xargs -P 4 record x {}") == 0
+        assert sorted(int(args[1]) for args in CmdShell.record.calls) == \
+            list(range(1, 50))
+
+    def test_parallel_keep_order(self, tmp_path, capsys):
+        lines = [str(i) for i in range(50)]
+        assert self.execute(tmp_path, lines, "xargs -P 4 -k echo") == 0
+        assert capsys.readouterr().out.split() == lines
+
+    def test_missing_command(self, tmp_path, capsys):
+        assert self.execute(tmp_path, ['a'], "xargs") == 1
+        assert "missing command" in capsys.readouterr().err
+
+    def test_invalid_max_args(self, tmp_path, capsys):
+        assert self.execute(tmp_path, ['a'], "xargs -n 0 record") == 1
+        assert "MAX_ARGS" in capsys.readouterr().err
@@ -0,0 +1,137 @@
+import sys
+import textwrap
+import pytest
+from pypsi.commands.echo import EchoCommand
+from pypsi.lazy import LazyCommand, discover_commands
+from pypsi.shell import Shell
+
+
+COMMAND_MODULE = '''
+from pypsi.core import Command
+
+
+class GreetCommand(Command):
+
+    def __init__(self, name='greet', greeting='hello', **kwargs):
+        super().__init__(name=name, usage='usage: greet NAME',
+                         brief='greet someone', topic='people', **kwargs)
+        self.greeting = greeting
+        self.shells = []
+
+    def setup(self, shell):
+        self.shells.append(shell)
+
+    def run(self, shell, args):
+        print(self.greeting, *args)
+        return 0
+
+    def complete(self, shell, args, prefix):
+        return ['world']
+'''
+
+
+class LazyShell(Shell):
+    echo = EchoCommand()
+
+
+@pytest.fixture
+def module(tmp_path, monkeypatch):
+    name = 'lazy_greet_{}'.format(id(tmp_path))
+    (tmp_path / (name + '.py')).write_text(COMMAND_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield name
+    sys.modules.pop(name, None)
+
+
+class TestLazyCommand(object):
+
+    def setup(self):
+        self.shell = LazyShell()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def test_stub(self, module):
+        stub = LazyCommand(module + ':GreetCommand', 'greet',
+                           brief='greet someone')
+        self.shell.register(stub)
+        assert self.shell.commands['greet'] is stub
+        assert self.shell.get_command_name_completions('gr') == ['greet']
+        assert stub.brief == 'greet someone'
+        assert not stub.loaded
+        assert module not in sys.modules
+
+    def test_execute(self, module, capsys):
+        stub = LazyCommand(module + ':GreetCommand', 'greet', greeting='hi')
+        self.shell.register(stub)
+        assert self.shell.execute("greet world") == 0
+        assert capsys.readouterr().out == "hi world\n"
+
+        cmd = self.shell.commands['greet']
+        assert cmd is not stub
+        assert cmd.shells == [self.shell]
+        assert self.shell.get_command('greet') is cmd
+
+    def test_complete(self, module):
+        self.shell.register(LazyCommand(module + ':GreetCommand', 'greet'))
+        assert self.shell.get_completions("greet w", 'w') == ['world']
+
+    def test_metadata(self, module):
+        stub = LazyCommand(module + ':GreetCommand', 'greet')
+        self.shell.register(stub)
+        assert stub.topic == 'people'
+        assert stub.usage == 'usage: greet NAME'
+        assert stub.loaded
+
+    def test_register_after_load(self, module):
+        stub = LazyCommand(module + ':GreetCommand', 'greet')
+        cmd = stub.load()
+        self.shell.register(stub)
+        assert self.shell.commands['greet'] is cmd
+        assert cmd.shells == [self.shell]
+
+    def test_setup_per_shell(self, module):
+        stub = LazyCommand(module + ':GreetCommand', 'greet')
+        discarded = LazyShell()
+        discarded.register(stub)
+        discarded.restore()
+        other = LazyShell()
+        self.shell.register(stub)
+        other.register(stub)
+        del discarded
+
+        cmd = self.shell.get_command('greet')
+        assert cmd.shells == [self.shell]
+        assert other.commands['greet'] is stub
+        assert other.get_command('greet') is cmd
+        assert cmd.shells == [self.shell, other]
+        other.restore()
+
+    def test_factory(self):
+        stub = LazyCommand(EchoCommand, 'say')
+        assert stub.load().name == 'say'
+
+
+class TestDiscoverCommands(object):
+
+    def test_entry_points(self, tmp_path, module, monkeypatch):
+        dist = tmp_path / 'lazy_greet-1.0.dist-info'
+        dist.mkdir()
+        (dist / 'METADATA').write_text(
+            "Metadata-Version: 2.1\nName: lazy-greet\nVersion: 1.0\n"
+        )
+        (dist / 'entry_points.txt').write_text(textwrap.dedent('''
+            [pypsi.commands]
+            greet = {}:GreetCommand
+        '''.format(module)))
+
+        stubs = [stub for stub in discover_commands() if stub.name == 'greet']
+        assert len(stubs) == 1
+        assert module not in sys.modules
+
+        shell = LazyShell()
+        try:
+            shell.register_many(stubs)
+            assert shell.get_command('greet').brief == 'greet someone'
+        finally:
+            shell.restore()
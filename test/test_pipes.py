@@ -0,0 +1,432 @@
+import asyncio
+import io
+import sys
+import threading
+import time
+import pytest
+from pypsi.pipes import (ObjectPipe, write_object, read_objects,
+                         PipeWorkerPool, PooledInvocation, ThreadLocalStream,
+                         AsyncPipe, awrite_object, aread_objects,
+                         BufferedStream)
+from pypsi.cmdline import CommandInvocation
+from pypsi.commands.echo import EchoCommand
+from pypsi.core import pypsi_print
+from pypsi.shell import Shell
+
+
+class TestObjectPipe(object):
+
+    def setup(self):
+        self.pipe = ObjectPipe(maxsize=2)
+
+    def test_objects(self):
+        obj = {'a': 1}
+        self.pipe.writer.write_object(obj)
+        self.pipe.writer.write_object(2)
+        self.pipe.writer.close()
+        assert list(self.pipe.reader) == [obj, 2]
+        assert self.pipe.reader.read_object() is ObjectPipe.EOF
+
+    def test_text_lines(self):
+        self.pipe.writer.write("hello ")
+        self.pipe.writer.write("world\nx")
+        self.pipe.writer.close()
+        assert list(self.pipe.reader) == ["hello world", "x"]
+
+    def test_readline(self):
+        self.pipe.writer.write_object(1)
+        self.pipe.writer.close()
+        assert self.pipe.reader.readline() == "1\n"
+        assert self.pipe.reader.readline() == ""
+
+    def test_bounded(self):
+        received = []
+
+        def consume():
+            received.extend(self.pipe.reader)
+
+        for i in range(2):
+            self.pipe.writer.write_object(i)
+
+        # The pipe is full until the consumer starts reading
+        t = threading.Thread(target=consume)
+        t.start()
+        for i in range(2, 100):
+            self.pipe.writer.write_object(i)
+        self.pipe.writer.close()
+        t.join()
+        assert received == list(range(100))
+
+    def test_broken_pipe(self):
+        self.pipe.reader.close()
+        with pytest.raises(BrokenPipeError):
+            self.pipe.writer.write_object(1)
+
+    def test_broken_pipe_unblocks_writer(self):
+        for i in range(2):
+            self.pipe.writer.write_object(i)
+
+        errors = []
+
+        def produce():
+            try:
+                self.pipe.writer.write_object(2)
+            except BrokenPipeError as e:
+                errors.append(e)
+
+        t = threading.Thread(target=produce)
+        t.start()
+        self.pipe.reader.close()
+        t.join()
+        assert len(errors) == 1
+
+
+class TestObjectHelpers(object):
+
+    def test_write_object_pipe(self):
+        pipe = ObjectPipe()
+        write_object(1, file=pipe.writer)
+        assert pipe.get() == 1
+
+    def test_write_object_text(self):
+        fp = io.StringIO()
+        write_object(1, file=fp)
+        assert fp.getvalue() == "1\n"
+
+    def test_read_objects_text(self):
+        fp = io.StringIO("a\nb\nc")
+        assert list(read_objects(fp)) == ['a', 'b', 'c']
+
+
+class FakeInvocation(object):
+
+    def __init__(self, func):
+        self.func = func
+        self.stdin = self.stdout = self.stderr = None
+        self.closed = False
+
+    def __call__(self, shell):
+        return self.func()
+
+    def close_streams(self):
+        self.closed = True
+
+
+class TestPipeWorkerPool(object):
+
+    def setup(self):
+        self.pool = PipeWorkerPool(max_workers=2)
+        self.stdout = sys.stdout
+
+    def teardown(self):
+        sys.stdout = self.stdout
+
+    def run(self, func):
+        t = PooledInvocation(self.pool, None, FakeInvocation(func))
+        t.start()
+        t.join()
+        # The worker is returned to the pool after the invocation is done
+        while self.pool.stats()['busy']:
+            time.sleep(0.001)
+        return t
+
+    def test_rc(self):
+        t = self.run(lambda: 5)
+        assert t.rc == 5
+        assert t.exc_info is None
+        assert not t.is_alive()
+
+    def test_exc_info(self):
+        def fail():
+            raise ValueError("failed")
+
+        t = self.run(fail)
+        assert t.rc is None
+        assert t.exc_info[0] is ValueError
+
+    def test_reuse(self):
+        idents = [self.run(threading.get_ident).rc for _ in range(5)]
+        # Every task after the first runs on the idle worker
+        assert len(set(idents)) == 1
+        stats = self.pool.stats()
+        assert stats['workers'] == 1
+        assert stats['submitted'] == 5
+        assert stats['reused'] == 4
+        assert stats['busy'] == 0
+
+    def test_saturation(self):
+        release = threading.Event()
+        tasks = [
+            PooledInvocation(self.pool, None, FakeInvocation(release.wait))
+            for _ in range(3)
+        ]
+        for t in tasks:
+            t.start()
+
+        stats = self.pool.stats()
+        assert stats['workers'] == 2
+        assert stats['busy'] == 2
+        assert stats['saturation'] == 1.0
+        assert stats['overflow'] == 1
+
+        release.set()
+        for t in tasks:
+            t.join()
+        assert all(t.rc for t in tasks)
+        assert self.pool.stats()['peak_busy'] == 2
+
+    def test_unproxy(self):
+        sys.stdout = ThreadLocalStream(io.StringIO())
+        target = io.StringIO()
+
+        def leak():
+            # A stage that doesn't remove its proxy
+            sys.stdout._proxy(target)
+
+        self.run(leak)
+        t = self.run(lambda: sys.stdout._get_target()._stream)
+        assert t.rc is not target
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0.01
+        self.run(lambda: None)
+        for _ in range(100):
+            if not self.pool.stats()['workers']:
+                break
+            time.sleep(0.01)
+        assert self.pool.stats()['workers'] == 0
+        assert self.run(lambda: 1).rc == 1
+
+
+class TestAsyncPipe(object):
+
+    def run(self, coro):
+        return asyncio.run(coro)
+
+    def test_objects(self):
+        async def run():
+            pipe = AsyncPipe()
+            await awrite_object({'a': 1}, file=pipe.writer)
+            pipe.writer.write("hello\nworld")
+            pipe.writer.close()
+            return [obj async for obj in aread_objects(pipe.reader)]
+
+        assert self.run(run()) == [{'a': 1}, "hello", "world"]
+
+    def test_drain(self):
+        async def run():
+            pipe = AsyncPipe(maxsize=2)
+            received = []
+
+            async def consume():
+                async for obj in pipe.reader:
+                    received.append(obj)
+
+            for i in range(2):
+                pipe.writer.write_object(i)
+
+            # The pipe is full until the consumer starts reading
+            drain = asyncio.ensure_future(pipe.writer.drain())
+            await asyncio.sleep(0)
+            assert not drain.done()
+
+            task = asyncio.ensure_future(consume())
+            await drain
+            for i in range(2, 100):
+                await pipe.writer.awrite_object(i)
+            pipe.writer.close()
+            await task
+            return received
+
+        assert self.run(run()) == list(range(100))
+
+    def test_broken_pipe(self):
+        async def run():
+            pipe = AsyncPipe()
+            pipe.reader.close()
+            with pytest.raises(BrokenPipeError):
+                await pipe.writer.awrite_object(1)
+
+        self.run(run())
+
+    def test_blocking_read(self):
+        pipe = AsyncPipe()
+        with pytest.raises(io.UnsupportedOperation):
+            pipe.reader.readline()
+
+
+class TestThreadLocalStream(object):
+
+    def test_task_local(self):
+        stream = ThreadLocalStream(io.StringIO())
+        first, second = io.StringIO(), io.StringIO()
+
+        async def write(target, text):
+            stream._proxy(target)
+            await asyncio.sleep(0)
+            stream.write(text)
+            stream._unproxy()
+
+        async def run():
+            await asyncio.gather(write(first, "a"), write(second, "b"))
+
+        asyncio.run(run())
+        assert first.getvalue() == "a"
+        assert second.getvalue() == "b"
+        assert stream._get_target()._stream.getvalue() == ""
+
+    def test_thread_local(self):
+        target = io.StringIO()
+        stream = ThreadLocalStream(target)
+        proxy = io.StringIO()
+
+        def write():
+            stream._proxy(proxy, isatty=True)
+            stream.write("thread")
+            stream.flush()
+            assert stream.isatty()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+        stream.write("main")
+        assert not stream.isatty()
+        assert proxy.getvalue() == "thread"
+        assert target.getvalue() == "main"
+
+    def test_unproxy_ident(self):
+        target = io.StringIO()
+        stream = ThreadLocalStream(target)
+        stream._proxy(io.StringIO())
+        # The proxy of another thread can't be deleted
+        stream._unproxy(threading.get_ident() + 1)
+        stream.write("proxy")
+        assert target.getvalue() == ""
+
+        stream._unproxy(threading.get_ident())
+        stream.write("target")
+        assert target.getvalue() == "target"
+
+    def test_fallback_attribute(self):
+        target = io.StringIO("hello\n")
+        stream = ThreadLocalStream(target)
+        assert stream.readline() == "hello\n"
+        assert stream.getvalue() == "hello\n"
+
+
+class CountingStream(io.StringIO):
+    '''
+    A string stream that counts the writes and flushes that reach it.
+    '''
+
+    def __init__(self, tty=False):
+        super().__init__()
+        self.tty = tty
+        self.writes = 0
+        self.flushes = 0
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data):
+        self.writes += 1
+        return super().write(data)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TestBufferedStream(object):
+
+    def test_auto_policy(self):
+        assert BufferedStream(CountingStream(tty=True)).buffering == 'line'
+        assert BufferedStream(CountingStream()).buffering == 'block'
+
+    def test_block(self):
+        target = CountingStream()
+        stream = BufferedStream(target, buffer_size=10)
+        stream.write("hello\n")
+        stream.write("world")
+        assert target.writes == 1
+        assert target.getvalue() == "hello\nworld"
+        stream.write("!")
+        stream.flush()
+        assert target.writes == 2
+        assert target.getvalue() == "hello\nworld!"
+
+    def test_line(self):
+        target = CountingStream(tty=True)
+        stream = BufferedStream(target)
+        stream.write("hello ")
+        assert target.writes == 0
+        stream.write("world\n")
+        assert target.writes == 1
+        assert target.getvalue() == "hello world\n"
+
+    def test_wrap_disabled(self):
+        target = CountingStream()
+        assert BufferedStream.wrap(target, 'none') is target
+        writer = ObjectPipe().writer
+        assert BufferedStream.wrap(writer) is writer
+
+    def test_concurrent_writers(self):
+        target = io.StringIO()
+        stream = BufferedStream(target, 'block', buffer_size=16)
+        interval = sys.getswitchinterval()
+
+        def write(n):
+            for i in range(2000):
+                stream.write("{} {}\n".format(n, i))
+
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=write, args=(n,))
+                       for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        stream.flush()
+        lines = target.getvalue().splitlines()
+        assert len(lines) == 8 * 2000
+        assert set(lines) == {
+            "{} {}".format(n, i) for n in range(8) for i in range(2000)
+        }
+        assert stream.written == len(target.getvalue())
+
+    def test_print_block(self):
+        target = CountingStream()
+        stream = BufferedStream(target)
+        for i in range(100):
+            pypsi_print("line", i, file=stream)
+        assert target.writes == 0
+        pypsi_print("last", file=stream, flush=True)
+        assert target.writes == 1
+        assert target.flushes == 1
+        assert target.getvalue().count("\n") == 101
+
+    def test_print_unbuffered(self):
+        target = CountingStream()
+        pypsi_print("hello", "world", file=target)
+        assert target.getvalue() == "hello world\n"
+        assert target.writes == 1
+        assert target.flushes == 1
+
+    def test_invocation_flush(self):
+        shell = Shell()
+        target = CountingStream()
+        invoke = CommandInvocation('echo', ['hello'], stdout=target)
+        invoke.cmd = EchoCommand()
+        try:
+            # Proxying stdout requires the thread local streams
+            shell.bootstrap()
+            assert invoke(shell) == 0
+        finally:
+            shell.restore()
+        # The buffer is flushed when the invocation finishes, before the
+        # stream is closed
+        assert target.closed
+        assert target.writes == 1
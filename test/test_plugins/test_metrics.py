@@ -0,0 +1,136 @@
+import json
+import sys
+import threading
+import time
+import pytest
+from pypsi.core import Command
+from pypsi.commands.echo import EchoCommand
+from pypsi.plugins.metrics import MetricsPlugin, MetricsRegistry
+from pypsi.shell import Shell
+
+
+class CatCommand(Command):
+
+    def __init__(self, name='cat', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write(line)
+        return int(args[0]) if args else 0
+
+
+class FailCommand(Command):
+
+    def __init__(self, name='fail', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        raise RuntimeError("failed")
+
+
+class PluginShell(Shell):
+    metrics_plugin = MetricsPlugin(buckets=(0.5, 10.0))
+    echo = EchoCommand()
+    cat = CatCommand()
+    fail = FailCommand()
+
+
+@pytest.mark.usefixtures('bootstrap')
+class TestMetricsPlugin(object):
+
+    def setup(self):
+        self.shell = PluginShell()
+        self.shell.ctx.metrics.reset()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def wait_for_stages(self, timeout=5.0, **counts):
+        # Pipe stages are not joined once the last invocation returns, so a
+        # stage may record its metrics after the statement has finished
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            _, _, commands = self.shell.ctx.metrics.snapshot()
+            if all(name in commands and commands[name].invocations >= count
+                   for name, count in counts.items()):
+                break
+            time.sleep(0.001)
+
+    def test_invocations(self):
+        self.shell.execute("echo hello | cat | cat 2")
+        self.wait_for_stages(echo=1, cat=2)
+        self.shell.execute("fail")
+        _, _, commands = self.shell.ctx.metrics.snapshot()
+
+        assert commands['echo'].invocations == 1
+        assert commands['echo'].pipe_stages == 1
+        assert commands['echo'].pipe_chars == len("hello\n")
+        assert commands['cat'].invocations == 2
+        assert commands['cat'].pipe_stages == 1
+        assert commands['cat'].failures == 1
+        assert commands['fail'].exceptions == 1
+        assert commands['fail'].failures == 0
+        assert sum(commands['cat'].buckets) == 2
+
+    def test_statements(self):
+        self.shell.ctx.metrics.observe_statement(0)
+        self.shell.ctx.metrics.observe_statement(1)
+        statements, failed, _ = self.shell.ctx.metrics.snapshot()
+        assert (statements, failed) == (2, 1)
+
+    def test_json(self, tmp_path):
+        path = tmp_path / 'metrics.json'
+        self.shell.execute("echo hello")
+        assert self.shell.execute("metrics -f json -o {}".format(path)) == 0
+        data = json.loads(path.read_text())
+        echo = data['commands']['echo']
+        assert echo['invocations'] == 1
+        assert echo['latency']['count'] == 1
+        assert sorted(echo['latency']['buckets']) == ['+Inf', '0.5', '10.0']
+
+    def test_prometheus(self, capsys):
+        self.shell.execute("echo hello")
+        self.shell.execute("echo hello")
+        capsys.readouterr()
+        assert self.shell.execute("metrics -f prometheus -r") == 0
+        out = capsys.readouterr().out
+        assert "# TYPE pypsi_command_invocations_total counter" in out
+        assert 'pypsi_command_invocations_total{command="echo"} 2' in out
+        assert ('pypsi_command_duration_seconds_bucket{command="echo",'
+                'le="+Inf"} 2') in out
+        assert 'pypsi_command_duration_seconds_count{command="echo"} 2' in out
+        _, _, commands = self.shell.ctx.metrics.snapshot()
+        assert list(commands) == ['metrics']
+
+    def test_table(self, capsys):
+        self.shell.execute("echo hello")
+        capsys.readouterr()
+        assert self.shell.execute("metrics") == 0
+        out = capsys.readouterr().out
+        assert out.startswith("statements: 0 failed: 0\n")
+        assert "Command" in out
+        assert "echo" in out
+
+
+class TestMetricsRegistry(object):
+
+    def test_threads(self):
+        registry = MetricsRegistry()
+
+        def observe():
+            for i in range(1000):
+                registry.observe_invocation('cmd', i % 2, 0.001)
+
+        threads = [threading.Thread(target=observe) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # A new thread retires the shards of the exited threads
+        observe()
+
+        _, _, commands = registry.snapshot()
+        assert commands['cmd'].invocations == 5000
+        assert commands['cmd'].failures == 2500
+        assert len(registry._shards) == 1
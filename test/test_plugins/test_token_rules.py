@@ -0,0 +1,184 @@
+import pytest
+from pypsi.cmdline import (StatementParser, StringToken, TokenRewriter,
+                           TokenRule)
+from pypsi.core import Plugin
+from pypsi.features import PypsiFeatures
+from pypsi.plugins.comment import CommentPlugin
+from pypsi.plugins.hexcode import HexCodePlugin
+from pypsi.plugins.variable import VariablePlugin
+from pypsi.shell import Shell
+
+
+class RuleShell(Shell):
+    hexcode = HexCodePlugin()
+    var = VariablePlugin(env=False, locals={
+        'a': 'A', 'ab': 'AB', 'quote': '"', 'esc': '\\x', 'sp': 'x y',
+        'ref': '$a'
+    })
+
+
+class CommentRuleShell(RuleShell):
+    comment = CommentPlugin()
+
+
+CORPUS = [
+    "echo hello world",
+    "echo $a $ab $none",
+    "echo $a$ab-$a_",
+    "echo \"$a and $ab\" '$a'",
+    "echo \\$a \\\\$a $$a",
+    "echo \\x41\\x42 \\x4 \\xzz \\x",
+    "echo \\x24a \\x5c\\x24a",
+    "echo $a\\x41 $quote $esc41 $sp $ref",
+    "echo a\\ b \"a\\\"b\" 'a\\'",
+    "echo $a | grep \\x41 > $ab",
+    "echo \"$a\"$ab\"$a\" \\",
+    "echo $a # $ab",
+    "echo \\# \"#\" $a#",
+]
+
+
+def dump(shell, line):
+    parser = StatementParser(shell.features)
+    tokens = shell.on_tokenize(parser.tokenize(line), 'input')
+    parser.clean_escapes(tokens)
+    return [
+        (type(t).__name__, getattr(t, 'text', None), getattr(t, 'quote', None),
+         getattr(t, 'operator', None))
+        for t in tokens
+    ]
+
+
+class TestTokenRules(object):
+
+    def teardown(self):
+        for shell in self.shells:
+            shell.restore()
+
+    def make(self, cls, escape_char='\\'):
+        self.shells = [
+            cls(features=PypsiFeatures(escape_char=escape_char),
+                fuse_token_rules=fused)
+            for fused in (False, True)
+        ]
+        return self.shells
+
+    @pytest.mark.parametrize('escape_char', ('\\', '`'))
+    @pytest.mark.parametrize('cls', (RuleShell, CommentRuleShell))
+    @pytest.mark.parametrize('line', CORPUS)
+    def test_same_tokens(self, line, cls, escape_char):
+        sequential, fused = self.make(cls, escape_char)
+        assert dump(fused, line) == dump(sequential, line)
+
+    @pytest.mark.parametrize('line', CORPUS)
+    def test_same_statement(self, line):
+        sequential, fused = self.make(CommentRuleShell)
+        assert fused.parse(line) == sequential.parse(line)
+
+    def test_stages(self):
+        sequential, fused = self.make(RuleShell)
+        stages = fused.get_token_stages()
+        assert len(stages) == 1
+        assert isinstance(stages[0], TokenRewriter)
+        assert stages[0].plugins == [RuleShell.hexcode, RuleShell.var]
+        assert stages[0].clean
+        assert sequential.get_token_stages() == sequential.preprocessors
+
+    def test_stages_comment(self):
+        sequential, fused = self.make(CommentRuleShell)
+        stages = fused.get_token_stages()
+        assert len(stages) == 2
+        assert isinstance(stages[0], TokenRewriter)
+        assert not stages[0].clean
+        assert stages[1] is CommentRuleShell.comment
+
+    def test_fallback(self):
+        sequential, fused = self.make(RuleShell)
+        calls = []
+        on_tokenize = RuleShell.var.on_tokenize
+
+        def record(shell, tokens, origin):
+            calls.append([t.text for t in tokens])
+            return on_tokenize(shell, tokens, origin)
+
+        RuleShell.var.on_tokenize = record
+        try:
+            assert dump(fused, "echo $a $a\\x41") == [
+                ('StringToken', 'echo', None, None),
+                ('WhitespaceToken', ' ', None, None),
+                ('StringToken', 'A', '"', None),
+                ('WhitespaceToken', ' ', None, None),
+                ('StringToken', '', '"', None),
+            ]
+        finally:
+            del RuleShell.var.on_tokenize
+        assert calls == [['$aA']]
+
+
+class TestTokenRewriter(object):
+
+    def setup(self):
+        self.shell = Shell(features=PypsiFeatures())
+
+    def teardown(self):
+        self.shell.restore()
+
+    def rewrite(self, rewriter, text, quote=None):
+        token = StringToken(0, '', quote)
+        token.text = text
+        return [
+            (t.text, t.quote, t.index)
+            for t in rewriter.rewrite(self.shell, token, 'input')
+        ]
+
+    def test_rules_in_order(self):
+        rewriter = TokenRewriter([Plugin(), Plugin()], [
+            [TokenRule('a', lambda m, token: 'x', requires='a')],
+            [TokenRule('b', lambda m, token: 'c', requires='b',
+                       quoted=False)],
+        ])
+        assert self.rewrite(rewriter, 'ab') == [('xc', None, 0)]
+        assert self.rewrite(rewriter, 'ab', '"') == [('xb', '"', 0)]
+        assert self.rewrite(rewriter, 'xyz') == [('xyz', None, 0)]
+
+    def test_fallback_on_trigger(self):
+        class Upper(Plugin):
+            def on_tokenize(self, shell, tokens, origin):
+                for token in tokens:
+                    token.text = token.text.upper()
+                return tokens
+
+        rewriter = TokenRewriter([Plugin(), Upper()], [
+            [TokenRule('a', lambda m, token: 'b', requires='a')],
+            [TokenRule('b', lambda m, token: 'c', requires='b')],
+        ])
+        # The replacement text contains a character that the next rule
+        # matches, so the token is passed to the plugins instead.
+        assert self.rewrite(rewriter, 'ab') == [('AB', None, 0)]
+
+    def test_split(self):
+        rewriter = TokenRewriter([Plugin()], [[
+            TokenRule('<(.)>', lambda m, token: StringToken(
+                token.index + m.start(), m.group(1) * 2, '"'
+            ), requires='<', split=True)
+        ]])
+        assert self.rewrite(rewriter, 'a<b>c<d>') == [
+            ('a', None, 0), ('bb', '"', 1), ('c', None, 4), ('dd', '"', 5)
+        ]
+
+    def test_escape_sequences_kept(self):
+        rewriter = TokenRewriter([Plugin()], [
+            [TokenRule('a', lambda m, token: 'b', requires='a')],
+        ], escape_char='\\')
+        assert self.rewrite(rewriter, 'a\\ab') == [('b\\ab', None, 0)]
+
+    def test_clean(self):
+        rewriter = TokenRewriter([Plugin()], [
+            [TokenRule('a', lambda m, token: 'b', requires='a')],
+        ], escape_char='\\', clean=True)
+        token = StringToken(0, '')
+        token.text = 'a\\ a\\a'
+        ret = rewriter.on_tokenize(self.shell, [token], 'input')
+        assert ret == [token]
+        assert token.text == 'b ba'
+        assert token.escapes_removed
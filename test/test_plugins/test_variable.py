@@ -78,6 +78,16 @@ class TestVariablePlugin:
         self.shell.ctx.vars['managed'] = var
         assert self.plugin.expand(self.shell, VariableToken(0, '$', 'managed')) == 'message'
 
+    def test_expand_bound_var(self):
+        self.shell.ctx.vars['test_var'] = 'global'
+        with bind_vars({'test_var': 'bound', '1': 'arg'}):
+            with bind_vars({'1': 'inner'}):
+                assert self.plugin.expand(self.shell, VariableToken(0, '$', '1')) == 'inner'
+            assert self.plugin.expand(self.shell, VariableToken(0, '$', 'test_var')) == 'bound'
+            assert self.plugin.parse_cache_key(self.shell, 'echo $1') == (('1', 'arg'),)
+            assert '1' not in self.shell.ctx.vars
+        assert self.plugin.expand(self.shell, VariableToken(0, '$', 'test_var')) == 'global'
+
     def test_var_token_eq_none(self):
         assert VariableToken(0, '$', 'name') != None
 
@@ -208,3 +218,34 @@ class TestVariablePlugin:
         assert len(stderr.getvalue()) > 0
 
 
+
+    def test_prompt_cached(self):
+        calls = []
+        self.shell.ctx.vars['cwd'] = ManagedVariable(
+            lambda shell: calls.append(1) or shell.ctx.vars['dir']
+        )
+        self.shell.ctx.vars['dir'] = '/tmp'
+        self.shell.prompt = '$cwd $local_var> '
+        with patch.object(self.shell, 'preprocess_single',
+                          wraps=self.shell.preprocess_single) as render:
+            assert self.shell.get_current_prompt() == '/tmp asdf> '
+            assert self.shell.get_current_prompt() == '/tmp asdf> '
+            assert render.call_count == 1
+
+            self.shell.ctx.vars['dir'] = '/home'
+            assert self.shell.get_current_prompt() == '/home asdf> '
+            self.shell.ctx.vars['local_var'] = 'qwer'
+            assert self.shell.get_current_prompt() == '/home qwer> '
+            self.shell.prompt = '$cwd % '
+            assert self.shell.get_current_prompt() == '/home % '
+            assert render.call_count == 4
+
+    def test_prompt_volatile(self):
+        self.shell.prompt = '$time> '
+        assert self.plugin.prompt_cache_key(self.shell, '$time> ') is None
+        assert self.shell.get_prompt_cache_key('$time> ') is None
+        self.shell.get_current_prompt()
+        assert self.shell._prompt_cache is None
+
+    def test_prompt_callable_not_cached(self):
+        assert self.plugin.prompt_cache_key(self.shell, '$callable> ') is None
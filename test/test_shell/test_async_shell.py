@@ -0,0 +1,141 @@
+import asyncio
+import sys
+import pytest
+from pypsi.asyncshell import AsyncShell
+from pypsi.core import Command
+from pypsi.commands.echo import EchoCommand
+from pypsi.pipes import aread_objects
+from pypsi.shell import Shell
+
+
+class AsyncRangeCommand(Command):
+
+    def __init__(self, name='arange', pipe='obj', **kwargs):
+        super().__init__(name=name, pipe=pipe, **kwargs)
+
+    async def run(self, shell, args):
+        for i in range(int(args[0])):
+            await asyncio.sleep(0)
+            yield i
+
+
+class AsyncRecordCommand(Command):
+
+    def __init__(self, name='arecord', pipe='obj', **kwargs):
+        super().__init__(name=name, pipe=pipe, **kwargs)
+        self.received = None
+
+    async def run(self, shell, args):
+        self.received = [obj async for obj in aread_objects()]
+        return len(self.received)
+
+
+class AsyncWaitCommand(Command):
+    '''
+    Print a message once another statement sets an event.
+    '''
+
+    def __init__(self, name='await', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.events = {}
+
+    def get_event(self, name):
+        return self.events.setdefault(name, asyncio.Event())
+
+    async def run(self, shell, args):
+        if args[0] == 'set':
+            self.get_event(args[1]).set()
+        else:
+            await self.get_event(args[1]).wait()
+        print(args[1])
+        return 0
+
+
+class CatCommand(Command):
+
+    def __init__(self, name='cat', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write(line)
+        return 0
+
+
+class FailCommand(Command):
+
+    def __init__(self, name='fail', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    async def run(self, shell, args):
+        raise RuntimeError("failed")
+
+
+class AsyncPipeShell(AsyncShell):
+    echo = EchoCommand()
+    arange = AsyncRangeCommand()
+    arecord = AsyncRecordCommand()
+    await_cmd = AsyncWaitCommand()
+    cat = CatCommand()
+    fail = FailCommand()
+
+
+@pytest.mark.usefixtures('bootstrap')
+class TestAsyncShell(object):
+
+    def setup(self):
+        self.shell = AsyncPipeShell()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def execute(self, *lines):
+        async def run():
+            return await asyncio.gather(
+                *[self.shell.execute_async(line) for line in lines]
+            )
+
+        return asyncio.run(run())
+
+    def test_async_command(self):
+        assert self.execute("arange 3 | arecord") == [3]
+        assert AsyncPipeShell.arecord.received == [0, 1, 2]
+
+    def test_sync_command(self):
+        assert self.execute("echo hello | arecord") == [1]
+        assert AsyncPipeShell.arecord.received == ["hello"]
+
+    def test_mixed_pipe(self):
+        assert self.execute("arange 3 | cat | cat | arecord") == [3]
+        assert AsyncPipeShell.arecord.received == ['0', '1', '2']
+
+    def test_concurrent_statements(self, tmp_path):
+        first = tmp_path / 'first.txt'
+        second = tmp_path / 'second.txt'
+        # The first statement can only finish if the second runs at the same
+        # time.
+        rcs = self.execute(
+            "await wait go > {}".format(first),
+            "await set go > {}".format(second)
+        )
+        assert rcs == [0, 0]
+        assert first.read_text() == "go\n"
+        assert second.read_text() == "go\n"
+
+    def test_chain(self):
+        assert self.execute("fail || arange 2 | arecord") == [2]
+
+    def test_error(self, capsys):
+        assert self.execute("fail") == [-1]
+        assert "command aborted: failed" in capsys.readouterr().err
+
+    def test_sync_execute(self):
+        # The synchronous shell runs async commands with asyncio.run()
+        shell = Shell()
+        shell.register(AsyncRangeCommand())
+        shell.register(AsyncRecordCommand('arecord'))
+        try:
+            assert shell.execute("arange 4 | arecord") == 4
+            assert shell.commands['arecord'].received == [0, 1, 2, 3]
+        finally:
+            shell.restore()
@@ -0,0 +1,96 @@
+import io
+from pypsi.core import Command
+from pypsi.commands.echo import EchoCommand
+from pypsi.commands.exit import ExitCommand
+from pypsi import batch
+from pypsi.shell import Shell
+
+
+class ReturnCommand(Command):
+
+    def __init__(self, name='ret', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        return int(args[0])
+
+
+class BatchShell(Shell):
+    echo = EchoCommand()
+    ret = ReturnCommand()
+    exit = ExitCommand()
+
+
+class TestRunBatch(object):
+
+    def setup(self):
+        self.shell = BatchShell()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def run(self, script, **kwargs):
+        return self.shell.run_batch(io.StringIO(script), **kwargs)
+
+    def test_statements(self, capsys):
+        assert self.run("echo one\necho two\n") == 0
+        assert capsys.readouterr().out == "one\ntwo\n"
+
+    def test_chunks(self, capsys):
+        self.shell.BatchChunkSize = 16
+        script = ''.join("echo line{}\n".format(i) for i in range(100))
+        assert self.run(script) == 0
+        assert capsys.readouterr().out.split() == [
+            "line{}".format(i) for i in range(100)
+        ]
+
+    def test_multiline(self, capsys):
+        assert self.run('echo "one\ntwo"\necho three') == 0
+        assert capsys.readouterr().out == "one\ntwo\nthree\n"
+
+    def test_summary_rc(self, capsys):
+        assert self.run("ret 0\nret 2\nret 3\necho done\n") == 2
+        assert capsys.readouterr().out == "done\n"
+        assert self.shell.errno == 0
+
+    def test_last_rc(self):
+        assert self.run("ret 2\nret 3\n", summary_rc=False) == 3
+        assert self.run("ret 2\nret 0\n", summary_rc=False) == 0
+
+    def test_stop_on_error(self, capsys):
+        assert self.run("ret 0\nret 2\necho done\n", stop_on_error=True) == 2
+        assert capsys.readouterr().out == ""
+
+    def test_syntax_error(self, capsys):
+        assert self.run("echo one\necho 'two\necho three\n") == 1
+        assert "unclosed" in capsys.readouterr().err
+
+    def test_syntax_error_stop(self, capsys):
+        script = "echo one |\n| echo two\necho three\n"
+        assert self.run(script, stop_on_error=True) == 1
+        assert "three" not in capsys.readouterr().out
+
+    def test_exit(self, capsys):
+        assert self.run("echo one\nexit 4\necho two\n") == 4
+        assert "two" not in capsys.readouterr().out
+
+
+class TestBatchMain(object):
+
+    def test_script(self, tmp_path, capsys):
+        path = tmp_path / 'script.txt'
+        path.write_text("echo hello\nret 3\nret 0\n")
+        spec = 'test.test_shell.test_batch:BatchShell'
+        assert batch.main([spec, str(path)]) == 3
+        assert batch.main(['--last-rc', spec, str(path)]) == 0
+        assert capsys.readouterr().out == "hello\nhello\n"
+
+    def test_invalid_shell(self, capsys):
+        for spec in ('test.test_shell.test_batch', 'pypsi.shell:Missing'):
+            try:
+                batch.main([spec])
+            except SystemExit as e:
+                assert e.code == 2
+            else:
+                assert False
+        assert "invalid shell" in capsys.readouterr().err
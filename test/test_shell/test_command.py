@@ -82,3 +82,30 @@ class TestShellCommand(object):
     def test_unhandled_exception(self):
         with pytest.raises(PypsiTestException):
             self.shell.execute('test PypsiTestException')
+
+
+class TestCommandUsage(object):
+
+    def test_string(self):
+        assert Command('cmd', usage='usage: cmd').usage == 'usage: cmd'
+        assert Command('cmd').usage == ''
+
+    def test_lazy(self):
+        calls = []
+
+        def usage():
+            calls.append(1)
+            return 'usage: cmd'
+
+        cmd = Command('cmd', usage=usage)
+        assert not calls
+        assert cmd.usage == 'usage: cmd'
+        assert cmd.usage == 'usage: cmd'
+        assert len(calls) == 1
+
+    def test_usage_error(self, capsys):
+        cmd = Command('cmd', usage=lambda: 'usage: cmd')
+        cmd.usage_error(None, 'bad argument')
+        out, err = capsys.readouterr()
+        assert 'bad argument' in err
+        assert 'usage: cmd' in out
@@ -87,3 +87,20 @@ class TestCompletions:
 
     def test_get_completions_test_cmd(self):
         assert self.shell.get_completions('test ', '') == PypsiTestCommand.CHOICES
+
+    def test_get_completions_incremental(self):
+        assert self.shell.get_completions('test r', 'r') == ['run']
+        state = self.shell.completion_state
+        assert self.shell.get_completions('test ru', 'ru') == ['run']
+        assert self.shell.completion_state is state
+        assert state.line == 'test ru'
+        assert state.count == 2
+
+    def test_get_completions_incremental_backspace(self):
+        assert self.shell.get_completions('test-me ru', 'ru') == ['run']
+        assert self.shell.get_completions('test m', 'm') == ['me']
+        assert self.shell.completion_state.line == 'test m'
+
+    def test_get_completions_incremental_quote(self):
+        assert self.shell.get_completions('test "n', 'n') == ['now']
+        assert self.shell.get_completions('test "no', 'no') == ['now']
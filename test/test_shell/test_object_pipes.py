@@ -0,0 +1,117 @@
+import sys
+import pytest
+from pypsi.core import Command
+from pypsi.commands.echo import EchoCommand
+from pypsi.pipes import read_objects
+from pypsi.shell import Shell
+
+
+class RangeCommand(Command):
+
+    def __init__(self, name='range', pipe='obj', **kwargs):
+        super().__init__(name=name, pipe=pipe, **kwargs)
+
+    def run(self, shell, args):
+        for i in range(int(args[0])):
+            yield i
+        return int(args[1]) if len(args) > 1 else None
+
+
+class RecordCommand(Command):
+
+    def __init__(self, name, pipe='obj', **kwargs):
+        super().__init__(name=name, pipe=pipe, **kwargs)
+        self.received = None
+
+    def run(self, shell, args):
+        self.received = list(read_objects())
+        return 0
+
+
+class TextCommand(Command):
+
+    def __init__(self, name='text', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.received = None
+
+    def run(self, shell, args):
+        self.received = sys.stdin.read()
+        return 0
+
+
+class CatCommand(Command):
+
+    def __init__(self, name='cat', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write(line)
+        return 0
+
+
+class HeadCommand(Command):
+
+    def __init__(self, name='head', pipe='obj', **kwargs):
+        super().__init__(name=name, pipe=pipe, **kwargs)
+        self.received = None
+
+    def run(self, shell, args):
+        self.received = next(iter(read_objects()))
+        return 0
+
+
+class PipeShell(Shell):
+    echo = EchoCommand()
+    range = RangeCommand()
+    record = RecordCommand('record')
+    text = TextCommand()
+    cat = CatCommand()
+    head = HeadCommand()
+
+
+@pytest.mark.usefixtures('bootstrap')
+class TestObjectPipes(object):
+
+    def setup(self):
+        self.shell = PipeShell()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def test_objects(self):
+        assert self.shell.execute("range 3 | record") == 0
+        assert PipeShell.record.received == [0, 1, 2]
+
+    def test_generator_rc(self):
+        assert self.shell.execute("range 3 2 | record") == 0
+        assert self.shell.execute("range 3 2 > /dev/null") == 2
+
+    def test_text_producer(self):
+        self.shell.execute("echo hello world | record")
+        assert PipeShell.record.received == ["hello world"]
+
+    def test_text_consumer(self):
+        self.shell.execute("range 3 | text")
+        assert PipeShell.text.received == "0\n1\n2\n"
+
+    def test_text_stage(self):
+        self.shell.execute("range 3 | cat | record")
+        assert PipeShell.record.received == ["0", "1", "2"]
+
+    def test_consumer_exits(self):
+        assert self.shell.execute("range 1000000 | head") == 0
+        assert PipeShell.head.received == 0
+
+    def test_pipe_types(self):
+        statement = self.shell.parse("range 3 | record | cat | text")
+        for invoke in statement:
+            invoke.setup(self.shell)
+        threads, stdin = self.shell.create_pipe_threads(
+            statement.invokes[:-1], statement.invokes[-1]
+        )
+        assert [type(t.invoke.stdout).__name__ for t in threads] == [
+            'ObjectPipeWriter', 'TextIOWrapper', 'TextIOWrapper'
+        ]
+        for invoke in statement:
+            invoke.close_streams()
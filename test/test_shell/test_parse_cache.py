@@ -0,0 +1,89 @@
+from pypsi.shell import Shell
+from pypsi.core import Command, Plugin
+from pypsi.plugins.variable import VariablePlugin
+from pypsi.plugins.comment import CommentPlugin
+
+
+class PypsiTestCommand(Command):
+
+    def __init__(self):
+        super().__init__(name='test')
+        self.calls = []
+
+    def run(self, shell, args):
+        self.calls.append(list(args))
+        return 0
+
+
+class StatefulPlugin(Plugin):
+
+    def __init__(self):
+        super().__init__(preprocess=50)
+
+    def on_tokenize(self, shell, tokens, origin):
+        return tokens
+
+
+class PypsiTestShell(Shell):
+    test_cmd = PypsiTestCommand()
+    variable = VariablePlugin(env=False)
+    comment = CommentPlugin()
+
+
+class TestShellParseCache(object):
+
+    def setup(self):
+        self.shell = PypsiTestShell()
+        self.shell.test_cmd.calls = []
+
+    def teardown(self):
+        self.shell.restore()
+
+    def test_hit(self):
+        self.shell.execute("test 'hello world'")
+        self.shell.execute("test 'hello world'")
+        assert self.shell.parse_cache.misses == 1
+        assert self.shell.parse_cache.hits == 1
+        assert self.shell.test_cmd.calls == [['hello world'], ['hello world']]
+
+    def test_hit_fresh_invocation(self):
+        first = self.shell.parse("test a > out.txt")
+        second = self.shell.parse("test a > out.txt")
+        assert first is not second
+        assert first[0] is not second[0]
+        assert second[0].stdout == ('out.txt', 'w')
+
+    def test_variable_dependency(self):
+        self.shell.ctx.vars['x'] = '1'
+        self.shell.execute("test $x")
+        self.shell.ctx.vars['x'] = '2'
+        self.shell.execute("test $x")
+        self.shell.execute("test $x")
+        assert self.shell.test_cmd.calls == [['1'], ['2'], ['2']]
+        assert self.shell.parse_cache.hits == 1
+
+    def test_managed_variable_not_cached(self):
+        self.shell.execute("test $errno")
+        self.shell.execute("test $errno")
+        assert self.shell.parse_cache.hits == 0
+        assert len(self.shell.parse_cache) == 0
+
+    def test_comment_not_cached(self):
+        assert self.shell.execute("# comment") is None
+        assert len(self.shell.parse_cache) == 0
+
+    def test_default_plugin_not_cacheable(self):
+        self.shell.register(StatefulPlugin())
+        assert self.shell.get_parse_cache_key("test") is None
+
+    def test_register_clears_cache(self):
+        self.shell.execute("test")
+        self.shell.register(CommentPlugin())
+        assert len(self.shell.parse_cache) == 0
+
+    def test_disabled(self):
+        self.shell.parse_cache.size = 0
+        self.shell.execute("test")
+        self.shell.execute("test")
+        assert self.shell.parse_cache.hits == 0
+        assert self.shell.test_cmd.calls == [[], []]
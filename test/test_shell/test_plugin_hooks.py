@@ -0,0 +1,94 @@
+import io
+from pypsi.core import Command, Plugin
+from pypsi.shell import Shell
+
+
+class EchoArgsCommand(Command):
+
+    def __init__(self, name='args', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.calls = []
+
+    def run(self, shell, args):
+        self.calls.append(args)
+        return 0
+
+
+class InputPlugin(Plugin):
+
+    def __init__(self, suffix, **kwargs):
+        super().__init__(**kwargs)
+        self.suffix = suffix
+
+    def on_input(self, shell, line):
+        return line + self.suffix
+
+
+class FinishedPlugin(Plugin):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rcs = []
+
+    def on_statement_finished(self, shell, rc):
+        self.rcs.append(rc)
+
+
+class SetupPlugin(Plugin):
+
+    def setup(self, shell):
+        self.hooks = list(shell.input_plugins)
+
+
+class NoopPlugin(Plugin):
+    pass
+
+
+class HookShell(Shell):
+    args = EchoArgsCommand()
+    second = InputPlugin(' b', preprocess=20)
+    first = InputPlugin(' a', preprocess=10)
+    finished = FinishedPlugin(postprocess=10)
+    noop = NoopPlugin(preprocess=5, postprocess=5)
+
+
+class TestPluginHooks(object):
+
+    def setup(self):
+        self.shell = HookShell()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def test_hook_lists(self):
+        assert self.shell.preprocessors == [
+            HookShell.noop, HookShell.first, HookShell.second
+        ]
+        assert self.shell.input_plugins == [HookShell.first, HookShell.second]
+        assert self.shell.tokenize_plugins == []
+        assert self.shell.canceled_plugins == []
+        assert self.shell.finished_plugins == [HookShell.finished]
+
+    def test_run_batch(self):
+        assert self.shell.run_batch(io.StringIO("args\n")) == 0
+        assert HookShell.args.calls[-1] == ['a', 'b']
+        assert HookShell.finished.rcs[-1] == 0
+
+    def test_register_many(self):
+        third = InputPlugin(' c', preprocess=15)
+        setup = SetupPlugin(preprocess=1)
+        assert self.shell.register_many([third, setup]) == 0
+        assert self.shell.input_plugins == [
+            HookShell.first, third, HookShell.second
+        ]
+        # Every plugin is registered before any setup method is called
+        assert setup.hooks == self.shell.input_plugins
+        self.shell.execute("args")
+        assert HookShell.args.calls[-1] == ['a', 'c', 'b']
+
+    def test_same_priority_order(self):
+        third = InputPlugin(' c', preprocess=10)
+        self.shell.register(third)
+        assert self.shell.input_plugins == [
+            HookShell.first, third, HookShell.second
+        ]
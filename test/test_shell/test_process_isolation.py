@@ -0,0 +1,101 @@
+import os
+import sys
+import pytest
+from pypsi.core import Command
+from pypsi.commands.echo import EchoCommand
+from pypsi.pipes import PipeProcessPool
+from pypsi.shell import Shell
+
+
+class PidCommand(Command):
+    '''
+    Prefix each line of stdin with the pid of the process running the command.
+    '''
+
+    def __init__(self, name='pid', isolation='process', **kwargs):
+        super().__init__(name=name, isolation=isolation, **kwargs)
+
+    def run(self, shell, args):
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write("{} {}".format(os.getpid(), line))
+        return int(args[0]) if args else 0
+
+
+class FailCommand(Command):
+
+    def __init__(self, name='fail', isolation='process', **kwargs):
+        super().__init__(name=name, isolation=isolation, **kwargs)
+
+    def run(self, shell, args):
+        raise RuntimeError("failed in process")
+
+
+class RecordCommand(Command):
+
+    def __init__(self, name='record', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.received = None
+
+    def run(self, shell, args):
+        self.received = [
+            line.split() for line in iter(sys.stdin.readline, '')
+        ]
+        return 0
+
+
+class ProcessShell(Shell):
+    echo = EchoCommand()
+    pid = PidCommand()
+    fail = FailCommand()
+    record = RecordCommand()
+
+
+@pytest.mark.usefixtures('bootstrap')
+class TestProcessIsolation(object):
+
+    def setup(self):
+        self.shell = ProcessShell()
+
+    def teardown(self):
+        if self.shell.process_pool:
+            self.shell.process_pool.shutdown()
+        self.shell.restore()
+
+    def test_pipe_stage(self):
+        assert self.shell.execute("echo hello | pid | record") == 0
+        pid, text = ProcessShell.record.received[0]
+        assert text == "hello"
+        assert int(pid) != os.getpid()
+
+    def test_rc(self, capsys):
+        assert self.shell.execute("echo hello | pid 3") == 3
+        pid, text = capsys.readouterr().out.split()
+        assert text == "hello"
+        assert int(pid) != os.getpid()
+
+    def test_redirect(self, tmp_path):
+        path = tmp_path / 'out.txt'
+        assert self.shell.execute("echo hello | pid > {}".format(path)) == 0
+        assert path.read_text().split()[1] == "hello"
+
+    def test_exception(self, capsys):
+        assert self.shell.execute("echo hello | fail") == -1
+        assert "failed in process" in capsys.readouterr().err
+
+    def test_saturated(self):
+        self.shell.process_pool.shutdown()
+        self.shell.process_pool = PipeProcessPool(1)
+        assert self.shell.execute("echo hello | pid | pid | record") == 0
+        first, second, text = ProcessShell.record.received[0]
+        assert text == "hello"
+        # The second stage runs on a thread since the only worker is busy
+        assert {int(first), int(second)} - {os.getpid()}
+        assert os.getpid() in {int(first), int(second)}
+        assert self.shell.process_pool.stats()['rejected'] == 1
+
+    def test_disabled(self):
+        self.shell.process_pool.shutdown()
+        self.shell.process_pool = None
+        assert self.shell.execute("echo hello | pid | record") == 0
+        pid, text = ProcessShell.record.received[0]
+        assert int(pid) == os.getpid()
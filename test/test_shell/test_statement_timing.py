@@ -0,0 +1,103 @@
+import sys
+import pytest
+from pypsi.core import Command, Plugin
+from pypsi.commands.echo import EchoCommand
+from pypsi.shell import Shell
+
+
+class CatCommand(Command):
+
+    def __init__(self, name='cat', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write(line)
+        return 0
+
+
+class FailCommand(Command):
+
+    def __init__(self, name='fail', **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def run(self, shell, args):
+        raise RuntimeError("failed")
+
+
+class TimingPlugin(Plugin):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.timings = []
+
+    def on_statement_timing(self, shell, timing):
+        self.timings.append(timing)
+        return 0
+
+
+class TimingShell(Shell):
+    echo = EchoCommand()
+    cat = CatCommand()
+    fail = FailCommand()
+
+
+@pytest.mark.usefixtures('bootstrap')
+class TestStatementTiming(object):
+
+    def setup(self):
+        self.shell = TimingShell()
+        self.plugin = TimingPlugin()
+
+    def teardown(self):
+        self.shell.restore()
+
+    def test_disabled(self):
+        assert self.shell.timing_plugins == []
+        assert self.shell.execute("echo hello") == 0
+        assert 'statement_timing' not in self.shell.ctx
+
+    def test_phases(self, tmp_path):
+        self.shell.register(self.plugin)
+        path = tmp_path / 'out.txt'
+        assert self.shell.execute("echo hello > {}".format(path)) == 0
+
+        timing, = self.plugin.timings
+        assert timing is self.shell.ctx.statement_timing
+        assert list(timing.phases) == [
+            'preprocess', 'tokenize', 'on_tokenize', 'build', 'setup', 'run'
+        ]
+        assert all(value >= 0 for value in timing.phases.values())
+        assert timing.total >= sum(timing.phases.values())
+        assert timing.rc == 0
+        assert not timing.cached
+
+        invoke, = timing.invocations
+        assert invoke.name == 'echo'
+        assert invoke.setup > 0
+        assert invoke.run > 0
+
+    def test_cached(self):
+        self.shell.register(self.plugin)
+        self.shell.execute("echo hello")
+        self.shell.execute("echo hello")
+        timing = self.plugin.timings[-1]
+        assert timing.cached
+        assert 'tokenize' not in timing.phases
+
+    def test_pipe(self):
+        self.shell.register(self.plugin)
+        assert self.shell.execute("echo hello | cat | cat") == 0
+        timing = self.plugin.timings[-1]
+        assert [(t.name, t.pipe) for t in timing.invocations] == [
+            ('echo', True), ('cat', True), ('cat', False)
+        ]
+        assert timing.invocations[-1].run > 0
+
+    def test_error(self):
+        self.shell.time_statements = True
+        assert self.shell.execute("echo hello | fail") == -1
+        timing = self.shell.ctx.statement_timing
+        assert 'join' in timing.phases
+        assert timing.invocations[0].run is not None
+        assert timing.invocations[1].rc == -1